@@ -1,19 +1,30 @@
 from random import choices
 from typing import List, Optional
 from django import forms
-from database.views.facets import Facet
+from database.views.facets import Facet, compute_facets
 from datetime import date
 
 
 class FacetSearchForm(forms.Form):
     def __init__(
-        self, facets: Optional[List[Facet]], work_ids: List[int], *args, **kwargs
+        self,
+        facets: Optional[List[Facet]],
+        work_ids: Optional[List[int]],
+        *args,
+        **kwargs
     ) -> None:
         super(FacetSearchForm, self).__init__(*args, **kwargs)
         if facets:
+            # Counts the values of all the facets at once, unless the values were
+            # already set, e.g. from a cached search result
+            if work_ids is not None:
+                compute_facets(facets, work_ids)
             for facet in facets:
                 choices = []
-                facet.facet_values = facet.make_facet_values(work_ids)
+                if facet.name not in self.fields:
+                    self.fields[facet.name] = forms.MultipleChoiceField(
+                        widget=self.widget, required=False
+                    )
                 for facet_value in facet.facet_values:
                     if facet_value is not None:
                         choices.append(
@@ -1,5 +1,6 @@
 from django import forms
 from database.models import ExtractedFeature
+from database.models.extracted_feature import scalar_value
 from django.db.models import Max, Min
 from database.widgets.range_slider import RangeSlider
 
@@ -13,26 +14,13 @@ class CharFieldWithGroup(forms.CharField):
 
 
 class FeatureSearchForm(forms.Form):
-    def __init__(self, feature_types, file_ids=None, *args, **kwargs):
+    def __init__(self, feature_types, file_ids=None, bounds=None, *args, **kwargs):
         super(FeatureSearchForm, self).__init__(*args, **kwargs)
-        extracted_features = ExtractedFeature.objects.filter(
-            feature_of__id__in=file_ids
-        )
+        if bounds is None:
+            bounds = self.make_bounds(feature_types, file_ids) if file_ids else {}
 
         for feature in feature_types.iterator():
-            if not file_ids:
-                min_val = 0
-                max_val = 0
-            else:
-                max_min_dict = extracted_features.filter(
-                    instance_of_feature__name=feature.name
-                ).aggregate(Min("value"), Max("value"))
-                max_val = (
-                    max_min_dict["value__max"][0] if max_min_dict["value__max"] else 0
-                )
-                min_val = (
-                    max_min_dict["value__min"][0] if max_min_dict["value__min"] else 0
-                )
+            min_val, max_val = bounds.get(feature.pk, (0, 0))
             name = feature.name
             code = feature.code
             group = feature.group
@@ -53,3 +41,23 @@ class FeatureSearchForm(forms.Form):
             self.fields[name] = CharFieldWithGroup(
                 widget=widget, required=False, group=group, help_text=help_text
             )
+
+    @staticmethod
+    def make_bounds(feature_types, file_ids):
+        """Get the min and max value of every feature type in a single grouped query
+
+        Returns a dictionary mapping the pk of each feature type to a (min, max) tuple
+        """
+        value = scalar_value()
+        bounds_tuples = (
+            ExtractedFeature.objects.filter(
+                feature_of__id__in=file_ids, instance_of_feature__in=feature_types
+            )
+            .values("instance_of_feature_id")
+            .annotate(min_val=Min(value), max_val=Max(value))
+            .values_list("instance_of_feature_id", "min_val", "max_val")
+        )
+        bounds = {}
+        for feature_type_id, min_val, max_val in bounds_tuples:
+            bounds[feature_type_id] = (min_val or 0, max_val or 0)
+        return bounds
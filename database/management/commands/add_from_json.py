@@ -13,6 +13,7 @@ from database.models import TypeOfSection
 from database.models import GenreAsInStyle
 from database.models import GenreAsInType
 from database.models import Instrument
+from database.utils.search_index import suspend_reindexing
 from typing import Union
 from psycopg2.extras import NumericRange
 from django.core.files import File as PythonFile
@@ -41,9 +42,11 @@ class Command(BaseCommand):
         pass
 
     def add_data(self, data: dict):
-        for musical_work in data["musical_works"]:
-            work = self.create_musical_work_from_dict(musical_work)
-            work.save()  # So it sends signal to update the search vector
+        # The works are reindexed together once they are all added
+        with suspend_reindexing():
+            for musical_work in data["musical_works"]:
+                work = self.create_musical_work_from_dict(musical_work)
+                work.save()  # So it sends signal to update the search vector
 
     def create_musical_work_from_dict(self, musical_work_dict: dict) -> MusicalWork:
         work, created = MusicalWork.objects.get_or_create(
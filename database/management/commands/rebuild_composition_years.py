@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from database.models import MusicalWork
+
+
+class Command(BaseCommand):
+    help = "Recomputes the composition year range of every Musical Work"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of Musical Works updated per statement",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        work_ids = list(MusicalWork.objects.order_by("id").values_list("id", flat=True))
+        for start in range(0, len(work_ids), batch_size):
+            MusicalWork.update_composition_year_ranges(
+                work_ids[start : start + batch_size]
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt the composition year range of {len(work_ids)} works"
+            )
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from database.models import File
+from database.models import FileFeatureVector
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the table of the one dimensional feature values of every File"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="The number of Files rebuilt per transaction",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        file_ids = list(
+            File.objects.filter(features__isnull=False)
+            .distinct()
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        for start in range(0, len(file_ids), batch_size):
+            FileFeatureVector.rebuild(file_ids[start : start + batch_size])
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt the feature vectors of {len(file_ids)} files")
+        )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from database.models import MusicalWork
+from database.models import WorkFileClosure
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the table linking every Musical Work to the Files that manifest it"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="The number of Musical Works rebuilt per transaction",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        work_ids = list(MusicalWork.objects.order_by("id").values_list("id", flat=True))
+        for start in range(0, len(work_ids), batch_size):
+            WorkFileClosure.rebuild(work_ids[start : start + batch_size])
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt the file closure of {len(work_ids)} works")
+        )
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from database.utils.similarity import NearestNeighbourIndex, SimilarityIndex
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the index used to find Files similar to a File"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend",
+            choices=["auto"] + sorted(NearestNeighbourIndex.registry),
+            default=settings.SIMILARITY_INDEX_BACKEND,
+            help="The nearest neighbour index to use, auto chooses from the "
+            "number of Files",
+        )
+
+    def handle(self, *args, **options):
+        index = SimilarityIndex.build(backend=options["backend"])
+        index.save(settings.SIMILARITY_INDEX_PATH)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {len(index.file_ids)} files with the {index.backend} backend"
+            )
+        )
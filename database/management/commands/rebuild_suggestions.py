@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from database.models import SearchSuggestion
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the terms suggested by the autocomplete of the search box"
+
+    def handle(self, *args, **options):
+        SearchSuggestion.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt {SearchSuggestion.objects.count()} search suggestions"
+            )
+        )
@@ -0,0 +1,93 @@
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from database.models import MusicalWork
+from database.utils.search_index import reindex_works
+
+
+class Command(BaseCommand):
+    help = "Recomputes the search document of Musical Works with set-based SQL"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            help="Only reindex the works that changed, or whose contributions, "
+            "sections or parts changed, since this date or datetime (ISO 8601)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of Musical Works reindexed per statement",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="The number of batches reindexed in parallel, each on its own "
+            "database connection",
+        )
+
+    def parse_since(self, value):
+        since = parse_datetime(value)
+        if since is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError(f"Invalid date: {value}")
+            since = datetime(date.year, date.month, date.day)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def get_work_ids(self, since):
+        works = MusicalWork.objects.all()
+        if since is not None:
+            works = works.filter(
+                Q(date_updated__gte=since)
+                | Q(contributions__date_updated__gte=since)
+                | Q(contributions__person__date_updated__gte=since)
+                | Q(sections__date_updated__gte=since)
+                | Q(parts__date_updated__gte=since)
+            ).distinct()
+        return list(works.order_by("id").values_list("id", flat=True))
+
+    def reindex_batch(self, work_ids):
+        try:
+            return reindex_works(work_ids)
+        finally:
+            # Each worker thread has its own connection
+            connection.close()
+
+    def handle(self, *args, **options):
+        since = self.parse_since(options["since"]) if options["since"] else None
+        batch_size = options["batch_size"]
+        work_ids = self.get_work_ids(since)
+        batches = [
+            work_ids[start : start + batch_size]
+            for start in range(0, len(work_ids), batch_size)
+        ]
+
+        start_time = time.monotonic()
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(options["workers"], 1)) as executor:
+            futures = [executor.submit(self.reindex_batch, batch) for batch in batches]
+            for future in as_completed(futures):
+                done += future.result()
+                elapsed = time.monotonic() - start_time
+                self.stdout.write(
+                    f"Reindexed {done}/{len(work_ids)} works "
+                    f"({done / elapsed if elapsed else 0:.0f} works/s)"
+                )
+
+        elapsed = time.monotonic() - start_time
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reindexed {done} works in {elapsed:.1f}s "
+                f"({done / elapsed if elapsed else 0:.0f} works/s)"
+            )
+        )
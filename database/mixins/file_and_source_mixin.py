@@ -1,16 +1,47 @@
+from typing import List, Union
 from django.apps import apps
-from django.db.models import QuerySet
+from django.db.models import Prefetch, QuerySet
 
 
 class FileAndSourceMixin:
     source_instantiations: QuerySet
+    # The field of WorkFileClosure that points to the model using this mixin
+    closure_field: str
+
+    @classmethod
+    def more_specific_closure_fields(cls) -> List[str]:
+        closure_fields = ["work", "section", "part"]
+        return closure_fields[closure_fields.index(cls.closure_field) + 1 :]
+
+    @classmethod
+    def prefetch_files(cls) -> Prefetch:
+        """Get a Prefetch that lets ``files`` be read without a query per object
+
+        Pass it to ``prefetch_related`` on a QuerySet of the model using this mixin.
+        """
+        closure_model = apps.get_model("database", "workfileclosure")
+        lookups = {field: None for field in cls.more_specific_closure_fields()}
+        closures = (
+            closure_model.objects.filter(**lookups)
+            .select_related("file")
+            .order_by("file_id")
+        )
+        return Prefetch(
+            "file_closures", queryset=closures, to_attr="prefetched_file_closures"
+        )
 
     @property
-    def files(self) -> QuerySet:
+    def files(self) -> Union[QuerySet, List]:
+        # Set by prefetch_files()
+        if "prefetched_file_closures" in self.__dict__:
+            return [closure.file for closure in self.prefetched_file_closures]
         file_model = apps.get_model("database", "file")
-        files = file_model.objects.filter(
-            id__in=self.source_instantiations.all().values_list("files", flat=True)
-        )
+        # Only the Files that instantiate this object directly, and not one of its
+        # Sections or Parts, so the more specific fields of the closure must be null
+        lookups = {"closures__" + self.closure_field: self.pk}
+        for field in self.more_specific_closure_fields():
+            lookups["closures__" + field] = None
+        files = file_model.objects.filter(**lookups)
         return files
 
     @property
@@ -22,6 +53,8 @@ class FileAndSourceMixin:
         return sources
 
     @property
-    def files_count(self) -> QuerySet:
-        count = self.files.count()
-        return count
+    def files_count(self) -> int:
+        files = self.files
+        if isinstance(files, list):
+            return len(files)
+        return files.count()
@@ -9,8 +9,10 @@ The models are:
 * EncoderValidatorBaseModel - A base model for Encoder and Validator
 * ExperimentalStudy - A study based on Files from a particular Research Corpus
 * ExtractedFeature - Content-based data extracted from a file
+* ExtractionCacheEntry - A File whose features can be copied to identical Files
 * FeatureType - A category of Feature of which ExtractedFeatures are instances
 * File - Manifestation of a Source Instantiation as a file
+* FileFeatureVector - Denormalized one dimensional feature values of a File
 * GenreAsInStyle - A musical genre (type of work or style)
 * GeographicArea - A geographic area that can be part of another are
 * Instrument - An instrument or voice
@@ -18,11 +20,14 @@ The models are:
 * Part - A single voice or instrument in a Section of a Musical Work
 * Person - A real world person that contributed to a musical work
 * ResearchCorpus - A collection of files that can be used in a ExperimentStudy
+* SearchSuggestion - A term suggested by the autocomplete of the search box
 * Section - A component of a Musical Work e.g. an Aria in an Opera
 * Software - A Software that encoded, validated or extracted features files
 * Source - A document containing the music of a Musical Work/Section/Part
 * SourceInstantiation - An abstract entity defined by the music in a Source
 * Validator - A User or Software that verified the quality of files
+* WorkFileClosure - Denormalized links from a MusicalWork to its Files
+* WorkSearchProjection - Denormalized properties a MusicalWork is filtered on
 """
 from database.models.archive import Archive
 from database.models.contribution_musical_work import ContributionMusicalWork
@@ -30,8 +35,10 @@ from database.models.custom_base_model import CustomBaseModel
 from database.models.encoding_workflow import EncodingWorkFlow
 from database.models.experimental_study import ExperimentalStudy
 from database.models.extracted_feature import ExtractedFeature
+from database.models.extraction_cache_entry import ExtractionCacheEntry
 from database.models.feature_type import FeatureType
 from database.models.file import File
+from database.models.file_feature_vector import FileFeatureVector
 from database.models.genre_as_in_style import GenreAsInStyle
 from database.models.genre_as_in_type import GenreAsInType
 from database.models.geographic_area import GeographicArea
@@ -41,6 +48,7 @@ from database.models.musical_work import MusicalWork
 from database.models.part import Part
 from database.models.person import Person
 from database.models.research_corpus import ResearchCorpus
+from database.models.search_suggestion import SearchSuggestion
 from database.models.section import Section
 from database.models.software import Software
 from database.models.source import Source
@@ -49,3 +57,5 @@ from database.models.validation_workflow import ValidationWorkFlow
 from database.models.source_instantiation import SourceInstantiation
 from database.models.feature_file import FeatureFile
 from database.models.type_of_section import TypeOfSection
+from database.models.work_file_closure import WorkFileClosure
+from database.models.work_search_projection import WorkSearchProjection
@@ -1,11 +1,23 @@
 """Defines an ExtractedFeature model."""
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields.array import IndexTransform
 from django.core.exceptions import ValidationError
 from django.db import models
 
 from database.models.custom_base_model import CustomBaseModel
 
 
+def scalar_value() -> IndexTransform:
+    """Get an expression for the first element of the value of an ExtractedFeature
+
+    One dimensional features store their value as an array of length 1. Aggregating
+    over this expression instead of the whole array lets PostgreSQL use the
+    expression index on ``value[1]`` rather than sorting arrays.
+    """
+    # Rendered as is, and PostgreSQL arrays start at 1
+    return IndexTransform(1, models.FloatField(), "value")
+
+
 class ExtractedFeature(CustomBaseModel):
     """Content-based data extracted from a SymbolicMusicFile.
 
@@ -80,13 +92,22 @@ class ExtractedFeature(CustomBaseModel):
         else:
             return self.name
 
-    def clean(self) -> None:
-        """Check if length of value is the same as the declared dimensions"""
-        if not (len(self.value) == self.instance_of_feature.dimensions):
+    @staticmethod
+    def check_dimensions(value: list, feature_type) -> None:
+        """Check if length of a value is the same as the dimensions of a FeatureType
+
+        Used by clean(), and by the bulk creation of the ExtractedFeatures of a
+        File, which does not call it.
+        """
+        if not (len(value) == feature_type.dimensions):
             raise ValidationError(
                 "The length of the value array must be the "
                 "same as the dimension of the FeatureType"
             )
+
+    def clean(self) -> None:
+        """Check if length of value is the same as the declared dimensions"""
+        self.check_dimensions(self.value, self.instance_of_feature)
         super().clean()
 
     def save(self, *args, **kwargs) -> None:
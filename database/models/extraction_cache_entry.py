@@ -0,0 +1,137 @@
+"""Defines an ExtractionCacheEntry model"""
+import hashlib
+from typing import Optional
+from django.apps import apps
+from django.db import models, transaction
+
+
+def hash_file(path: str) -> str:
+    """Get the sha256 hex digest of the contents of a file on disk"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCacheEntry(models.Model):
+    """A File whose features were extracted from given contents with a given config
+
+    The same symbolic music file is often uploaded several times, under different
+    works or sources. Its features only depend on its bytes, on the version of
+    jSymbolic and on the config file of the extraction, so the features of a File
+    whose contents were already extracted are copied from the File recorded here
+    instead of running jSymbolic again.
+
+    Attributes
+    ----------
+    content_hash : models.CharField
+        The sha256 of the contents of the File
+
+    config_hash : models.CharField
+        The sha256 of the config file jSymbolic was run with
+
+    extracted_with : models.ForeignKey
+        A reference to the Software, and so the version of jSymbolic, that
+        extracted the features
+
+    file : models.ForeignKey
+        A reference to the File whose ExtractedFeatures and FeatureFiles are copied
+    """
+
+    content_hash = models.CharField(max_length=64)
+    config_hash = models.CharField(max_length=64)
+    extracted_with = models.ForeignKey(
+        "Software", on_delete=models.CASCADE, related_name="extraction_cache_entries"
+    )
+    file = models.ForeignKey(
+        "File", on_delete=models.CASCADE, related_name="extraction_cache_entries"
+    )
+
+    class Meta:
+        db_table = "extraction_cache_entry"
+        verbose_name_plural = "Extraction Cache Entries"
+        unique_together = ("content_hash", "config_hash", "extracted_with")
+
+    def __str__(self) -> str:
+        return "Features of {0} for {1}".format(self.content_hash[:12], self.file_id)
+
+    @classmethod
+    def record(cls, file, content_hash: str, config_hash: str, software) -> None:
+        """Record that the features of some contents were extracted into a File"""
+        cls.objects.update_or_create(
+            content_hash=content_hash,
+            config_hash=config_hash,
+            extracted_with=software,
+            defaults={"file": file},
+        )
+
+    @classmethod
+    def lookup(cls, content_hash: str, config_hash: str, software) -> Optional["File"]:
+        """Get the File whose features were extracted from the same contents"""
+        entry = (
+            cls.objects.filter(
+                content_hash=content_hash,
+                config_hash=config_hash,
+                extracted_with=software,
+            )
+            .select_related("file")
+            .first()
+        )
+        return entry.file if entry is not None else None
+
+    @staticmethod
+    def clone_features(source, target) -> int:
+        """Copy the ExtractedFeatures and FeatureFiles of a File to another File
+
+        The copies of the FeatureFiles point to the feature files of the source on
+        disk. The values are the same as those of the source, so the minimum and
+        maximum of the FeatureTypes do not change.
+
+        Parameters
+        ----------
+        source : File
+            The File the features were extracted from
+        target : File
+            The File that gets a copy of the features
+
+        Returns
+        -------
+        int
+            The number of ExtractedFeatures copied
+        """
+        feature_model = apps.get_model("database", "extractedfeature")
+        feature_file_model = apps.get_model("database", "featurefile")
+        vector_model = apps.get_model("database", "filefeaturevector")
+        with transaction.atomic():
+            features = feature_model.objects.bulk_create(
+                feature_model(
+                    instance_of_feature_id=feature.instance_of_feature_id,
+                    value=feature.value,
+                    extracted_with_id=feature.extracted_with_id,
+                    feature_of=target,
+                )
+                for feature in feature_model.objects.filter(feature_of=source)
+            )
+            if not features:
+                return 0
+            feature_file_model.objects.bulk_create(
+                feature_file_model(
+                    file_format=feature_file.file_format,
+                    file=feature_file.file.name,
+                    config_file=feature_file.config_file.name,
+                    feature_definition_file=feature_file.feature_definition_file.name,
+                    features_from_file=target,
+                    extracted_with_id=feature_file.extracted_with_id,
+                )
+                for feature_file in feature_file_model.objects.filter(
+                    features_from_file=source
+                )
+            )
+            vector_model.rebuild([target.pk])
+        # Imported here since the search cache is part of the views
+        from database.utils import search_cache
+
+        # bulk_create does not send the post_save signals that invalidate the results
+        search_cache.bump_version()
+        return len(features)
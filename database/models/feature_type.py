@@ -1,7 +1,9 @@
 """Defines a FeatureType model"""
-from django.db import models
+from typing import Dict, Iterable, Tuple
+from django.db import connection, models
 from django.db.models import Max, Min
 from database.models.custom_base_model import CustomBaseModel
+from database.models.extracted_feature import ExtractedFeature, scalar_value
 
 
 class FeatureType(CustomBaseModel):
@@ -105,14 +107,50 @@ class FeatureType(CustomBaseModel):
     def max_and_min(self) -> None:
         """Update the max and min values of this FeatureType"""
         if self.dimensions == 1:
-            self.max_val = self.instances.all().aggregate(max_val=Max("value"))[
-                "max_val"
-            ][0]
-            self.min_val = self.instances.all().aggregate(min_val=Min("value"))[
-                "min_val"
-            ][0]
+            value = scalar_value()
+            max_and_min = self.instances.all().aggregate(
+                max_val=Max(value), min_val=Min(value)
+            )
+            self.max_val = max_and_min["max_val"]
+            self.min_val = max_and_min["min_val"]
             self.save()
 
+    @classmethod
+    def extend_max_and_min(cls, features: Iterable[ExtractedFeature]) -> None:
+        """Widen the max and min values of FeatureTypes to new ExtractedFeatures
+
+        Unlike max_and_min(), which aggregates over every instance of a FeatureType,
+        this only compares the stored max and min values with the new values, in a
+        single statement for all the FeatureTypes. It is meant for features that
+        were added in bulk and so did not go through save().
+
+        Parameters
+        ----------
+        features : Iterable[ExtractedFeature]
+            The newly created ExtractedFeatures, whose instance_of_feature is set
+        """
+        bounds: Dict[int, Tuple[float, float]] = {}
+        for feature in features:
+            if feature.instance_of_feature.dimensions != 1:
+                continue
+            value = float(feature.value[0])
+            low, high = bounds.get(feature.instance_of_feature_id, (value, value))
+            bounds[feature.instance_of_feature_id] = (min(low, value), max(high, value))
+        if not bounds:
+            return
+        # Sorted so that concurrent updates lock the rows in the same order
+        ids = sorted(bounds)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE {table} f SET min_val = LEAST(f.min_val, v.min_val), "
+                "max_val = GREATEST(f.max_val, v.max_val), date_updated = now() "
+                "FROM unnest(%s::integer[], %s::float8[], %s::float8[]) "
+                "AS v(id, min_val, max_val) WHERE f.id = v.id".format(
+                    table=cls._meta.db_table
+                ),
+                [ids, [bounds[i][0] for i in ids], [bounds[i][1] for i in ids]],
+            )
+
     @property
     def group(self) -> str:
         """Get the human readable group from the code of this FeatureType"""
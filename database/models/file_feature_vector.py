@@ -0,0 +1,92 @@
+"""Defines a FileFeatureVector model"""
+from typing import Dict, Iterable, List, Optional
+from django.apps import apps
+from django.contrib.postgres.fields import ArrayField
+from django.db import models, transaction
+
+
+class FileFeatureVector(models.Model):
+    """The values of all the one dimensional ExtractedFeatures of a File in one row
+
+    Content search filters Files by ranges of several scalar features at once. Doing
+    so on ExtractedFeature takes one subquery per feature on the largest table of the
+    database, so this table stores a single array per File instead. The value of the
+    FeatureType with pk ``n`` is at position ``n`` of the array (``values[n]`` in SQL,
+    ``values__{n - 1}`` in a lookup) and is null if the File does not have it.
+
+    The rows are rebuilt when feature values are parsed, or with the
+    ``rebuild_feature_vectors`` command, and should never be edited by hand.
+
+    Attributes
+    ----------
+    file : models.OneToOneField
+        Reference to the File
+
+    values : ArrayField(models.FloatField)
+        The values of the one dimensional features of the File, indexed by the pk of
+        their FeatureType
+
+    updated : models.DateTimeField
+        When the row was last rebuilt, so that copies of the table held in memory
+        can be refreshed incrementally
+    """
+
+    file = models.OneToOneField(
+        "File",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="feature_vector",
+    )
+    values = ArrayField(models.FloatField(null=True))
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        db_table = "file_feature_vector"
+        verbose_name_plural = "File Feature Vectors"
+
+    def __str__(self) -> str:
+        return "Feature vector of {0}".format(self.file_id)
+
+    @staticmethod
+    def lookup(feature_type_id: int) -> str:
+        """Get the lookup of the value of a FeatureType, relative to this model"""
+        return "values__{0}".format(feature_type_id - 1)
+
+    def get_value(self, feature_type_id: int) -> Optional[float]:
+        """Get the value of a FeatureType for this File, if it has one"""
+        if feature_type_id > len(self.values):
+            return None
+        return self.values[feature_type_id - 1]
+
+    @classmethod
+    def rebuild(cls, file_ids: Iterable[int]) -> None:
+        """Recompute the rows of some Files from their ExtractedFeatures
+
+        Parameters
+        ----------
+        file_ids : Iterable[int]
+            The ids of the Files whose rows are recomputed
+        """
+        file_ids = set(file_ids)
+        if not file_ids:
+            return
+        feature_model = apps.get_model("database", "extractedfeature")
+        features = feature_model.objects.filter(
+            feature_of__in=file_ids, instance_of_feature__dimensions=1
+        ).values_list("feature_of_id", "instance_of_feature_id", "value")
+
+        vectors: Dict[int, List[Optional[float]]] = {}
+        for file_id, feature_type_id, value in features:
+            vector = vectors.setdefault(file_id, [])
+            if len(vector) < feature_type_id:
+                vector.extend([None] * (feature_type_id - len(vector)))
+            vector[feature_type_id - 1] = value[0]
+
+        with transaction.atomic():
+            cls.objects.filter(file__in=file_ids).delete()
+            cls.objects.bulk_create(
+                [
+                    cls(file_id=file_id, values=vector)
+                    for file_id, vector in vectors.items()
+                ]
+            )
@@ -1,13 +1,13 @@
 """Defines a MusicalWork model"""
 from django.apps import apps
-from django.contrib.postgres.fields import ArrayField
-from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.fields import ArrayField, IntegerRangeField
+from django.contrib.postgres.indexes import GinIndex, GistIndex
 from django.contrib.postgres.search import SearchVectorField
-from django.db import models
-from django.db.models import QuerySet
+from django.db import connections, models
+from django.db.models import Prefetch, QuerySet
 from database.mixins.file_and_source_mixin import FileAndSourceMixin
 from database.models.custom_base_model import CustomBaseModel
-from typing import List
+from typing import Iterable, List, Union
 
 
 class MusicalWork(FileAndSourceMixin, CustomBaseModel):
@@ -64,6 +64,11 @@ class MusicalWork(FileAndSourceMixin, CustomBaseModel):
     search_document : SearchVectorField
         A field that stores information to index and search this MusicalWork
         Should only be updated using the ``on_save`` method in the signals module
+
+    composition_year_range : IntegerRangeField
+        The smallest year range covering the dates of all the Composer
+        Contributions to this MusicalWork, or None if none of them is dated
+        Should only be updated using ``update_composition_year_ranges``
     """
 
     variant_titles = ArrayField(
@@ -112,12 +117,17 @@ class MusicalWork(FileAndSourceMixin, CustomBaseModel):
         "musical work.",
     )
     search_document = SearchVectorField(null=True, blank=True)
+    composition_year_range = IntegerRangeField(null=True, blank=True, editable=False)
+    closure_field = "work"
 
     class Meta(CustomBaseModel.Meta):
         db_table = "musical_work"
         verbose_name_plural = "Musical Works"
         # Indexes the search_document field for quick access
-        indexes = [GinIndex(fields=["search_document"])]
+        indexes = [
+            GinIndex(fields=["search_document"]),
+            GistIndex(fields=["composition_year_range"]),
+        ]
 
     def __str__(self) -> str:
         return self.variant_titles[0]
@@ -203,7 +213,74 @@ class MusicalWork(FileAndSourceMixin, CustomBaseModel):
         """
         return self.variant_titles[1:]
 
-    def _get_contributors_by_role(self, role: str) -> QuerySet:
+    @classmethod
+    def prefetch_contributions(cls) -> Prefetch:
+        """Get a Prefetch that lets the contributors by role be read without queries
+
+        Pass it to ``prefetch_related`` on a QuerySet of MusicalWorks, then
+        ``composers``, ``arrangers`` etc. return lists built from the prefetched
+        Contributions.
+        """
+        contribution_model = apps.get_model("database", "contributionmusicalwork")
+        return Prefetch(
+            "contributions",
+            queryset=contribution_model.objects.select_related("person").order_by(
+                "id"
+            ),
+            to_attr="prefetched_contributions",
+        )
+
+    @classmethod
+    def update_composition_year_ranges(
+        cls, work_ids: Iterable[int], using: str = "default"
+    ) -> None:
+        """Recompute the composition_year_range of some MusicalWorks
+
+        Lets the search filter works by date with an overlap on their own indexed
+        range instead of joining their Contributions. The range spans all the
+        Composer Contributions, so a work whose contributions are far apart also
+        matches the years between them, and it is unbounded on a side where one
+        of them is. Called when the works are reindexed, see
+        ``database.utils.search_index.reindex_works``.
+
+        Parameters
+        ----------
+        work_ids : Iterable[int]
+            The ids of the MusicalWorks to update
+        using : str
+            The alias of the database
+        """
+        work_ids = [work_id for work_id in set(work_ids) if work_id is not None]
+        if not work_ids:
+            return
+        contribution_model = apps.get_model("database", "contributionmusicalwork")
+        with connections[using].cursor() as cursor:
+            # min() and max() skip the NULL limits of the unbounded ranges
+            cursor.execute(
+                "UPDATE {work} w SET composition_year_range = ("
+                "SELECT CASE WHEN count(*) > 0 THEN int4range("
+                "CASE WHEN bool_or(lower_inf(c.date_range_year_only)) THEN NULL "
+                "ELSE min(lower(c.date_range_year_only)) END, "
+                "CASE WHEN bool_or(upper_inf(c.date_range_year_only)) THEN NULL "
+                "ELSE max(upper(c.date_range_year_only)) END) END "
+                "FROM {contribution} c WHERE c.contributed_to_work_id = w.id "
+                "AND c.role = 'COMPOSER' AND c.date_range_year_only IS NOT NULL "
+                "AND NOT isempty(c.date_range_year_only)) "
+                "WHERE w.id = ANY(%s)".format(
+                    work=cls._meta.db_table,
+                    contribution=contribution_model._meta.db_table,
+                ),
+                [work_ids],
+            )
+
+    def _get_contributors_by_role(self, role: str) -> Union[QuerySet, List]:
+        # Set by prefetch_contributions()
+        if "prefetched_contributions" in self.__dict__:
+            return [
+                contribution.person
+                for contribution in self.prefetched_contributions
+                if contribution.role == role
+            ]
         contributors = self.contributors.all().filter(contributions_works__role=role)
         return contributors
 
@@ -61,6 +61,7 @@ class Part(FileAndSourceMixin, CustomBaseModel):
         related_name="parts",
         help_text="The Section to which this Part belongs",
     )
+    closure_field = "part"
 
     class Meta(CustomBaseModel.Meta):
         db_table = "part"
@@ -0,0 +1,182 @@
+"""Defines a SearchSuggestion model"""
+import unicodedata
+from typing import Dict, Iterable, List, Tuple
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import Count, Q, QuerySet
+
+
+def normalize_term(term: str) -> str:
+    """Lowercase a term, strip its accents and collapse its whitespace"""
+    decomposed = unicodedata.normalize("NFKD", term)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.lower().split())
+
+
+class SearchSuggestion(models.Model):
+    """A term suggested by the autocomplete of the search box
+
+    One row per way of typing the name of a MusicalWork, composer, genre or
+    Instrument, so that suggestions for a prefix are read from the btree index on
+    ``term`` with a ``LIKE 'prefix%'`` range scan. The table is derived from the
+    other tables, it is rebuilt with the ``rebuild_suggestions`` command and kept up
+    to date by the receivers in the signals module.
+
+    Attributes
+    ----------
+    term : models.CharField
+        The normalized term, see normalize_term()
+
+    kind : models.CharField
+        The kind of object suggested
+
+    target_id : models.PositiveIntegerField
+        The pk of the object suggested
+
+    label : models.CharField
+        The name of the object as it is displayed
+
+    popularity : models.PositiveIntegerField
+        How much the object is used, suggestions with a higher popularity come first
+    """
+
+    KINDS = (
+        ("work", "Musical Work"),
+        ("composer", "Composer"),
+        ("style", "Genre (Style)"),
+        ("type", "Genre (Type of Work)"),
+        ("instrument", "Instrument/Voice"),
+    )
+    # The model and the detail url of each kind
+    KIND_MODELS = {
+        "work": ("musicalwork", "musicalwork-detail"),
+        "composer": ("person", "person-detail"),
+        "style": ("genreasinstyle", "genreasinstyle-detail"),
+        "type": ("genreasintype", "genreasintype-detail"),
+        "instrument": ("instrument", "instrument-detail"),
+    }
+
+    term = models.CharField(max_length=200)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    target_id = models.PositiveIntegerField()
+    label = models.CharField(max_length=200)
+    popularity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "search_suggestion"
+        verbose_name_plural = "Search Suggestions"
+        indexes = [
+            models.Index(
+                fields=["term"],
+                name="search_suggestion_term_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+            models.Index(fields=["kind", "target_id"]),
+        ]
+
+    def __str__(self) -> str:
+        return "{0}: {1}".format(self.kind, self.label)
+
+    @classmethod
+    def kind_of_model(cls, model_name: str) -> str:
+        """Get the kind of the suggestions of a model"""
+        for kind, (kind_model_name, _) in cls.KIND_MODELS.items():
+            if kind_model_name == model_name:
+                return kind
+        raise KeyError(model_name)
+
+    @classmethod
+    def _targets(cls, kind: str, ids: Iterable[int] = None) -> QuerySet:
+        """Get the objects of a kind with their popularity"""
+        model = apps.get_model("database", cls.KIND_MODELS[kind][0])
+        queryset = model.objects.all()
+        if ids is not None:
+            queryset = queryset.filter(pk__in=list(ids))
+        if kind == "work":
+            return queryset.annotate(
+                popularity=Count("file_closures__file", distinct=True)
+            )
+        if kind == "composer":
+            return queryset.annotate(
+                popularity=Count(
+                    "contributions_works",
+                    filter=Q(contributions_works__role="COMPOSER"),
+                )
+            ).filter(popularity__gt=0)
+        if kind == "instrument":
+            return queryset.annotate(popularity=Count("parts"))
+        return queryset.annotate(popularity=Count("musical_works"))
+
+    @classmethod
+    def _make_rows(cls, kind: str, target) -> List["SearchSuggestion"]:
+        if kind == "work":
+            names = [(title, title) for title in target.variant_titles]
+        elif kind == "composer":
+            label = target.name
+            names = [(label, label)]
+            if target.surname:
+                # Lets composers be found by their surname too
+                surname_first = "{0} {1}".format(target.surname, target.given_name)
+                names.append((surname_first, label))
+        else:
+            names = [(target.name, target.name)]
+        rows: Dict[Tuple[str, str], "SearchSuggestion"] = {}
+        for name, label in names:
+            term = normalize_term(name)[:200]
+            if term:
+                rows[(term, label)] = cls(
+                    term=term,
+                    kind=kind,
+                    target_id=target.pk,
+                    label=label[:200],
+                    popularity=target.popularity,
+                )
+        return list(rows.values())
+
+    @classmethod
+    def refresh(cls, kind: str, ids: Iterable[int] = None) -> None:
+        """Recompute the suggestions of some objects of a kind
+
+        Parameters
+        ----------
+        kind : str
+            One of the kinds in KINDS
+        ids : Iterable[int]
+            The pks of the objects, or None to recompute all the objects of the kind
+        """
+        if ids is not None:
+            ids = list(ids)
+        rows: List[SearchSuggestion] = []
+        for target in cls._targets(kind, ids).iterator():
+            rows.extend(cls._make_rows(kind, target))
+        with transaction.atomic():
+            stale = cls.objects.filter(kind=kind)
+            if ids is not None:
+                stale = stale.filter(target_id__in=ids)
+            stale.delete()
+            cls.objects.bulk_create(rows, batch_size=1000)
+
+    @classmethod
+    def rebuild(cls) -> None:
+        """Recompute all the suggestions"""
+        for kind, _ in cls.KINDS:
+            cls.refresh(kind)
+
+    @classmethod
+    def suggest(cls, prefix: str, limit: int = 10) -> List["SearchSuggestion"]:
+        """Get the most popular suggestions whose term starts with a prefix"""
+        term = normalize_term(prefix)
+        if not term:
+            return []
+        return list(
+            cls.objects.filter(term__startswith=term).order_by(
+                "-popularity", "term"
+            )[:limit]
+        )
+
+    @property
+    def url(self) -> str:
+        """Get the URL of the object suggested"""
+        from django.urls import reverse
+
+        return reverse(self.KIND_MODELS[self.kind][1], kwargs={"pk": self.target_id})
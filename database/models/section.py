@@ -99,6 +99,7 @@ class Section(FileAndSourceMixin, CustomBaseModel):
         related_name="sections",
         help_text="The type of this section, e.g. Aria, Minuet, Chorus, Bridge",
     )
+    closure_field = "section"
 
     class Meta(CustomBaseModel.Meta):
         db_table = "section"
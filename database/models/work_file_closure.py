@@ -0,0 +1,156 @@
+"""Defines a WorkFileClosure model"""
+from typing import Iterable, Set
+from django.apps import apps
+from django.db import models, transaction
+
+
+class WorkFileClosure(models.Model):
+    """A denormalized link between a MusicalWork and every File that manifests it
+
+    Files are attached to MusicalWorks through SourceInstantiations, either directly
+    or through Sections and Parts. Resolving that graph requires OR-ing joins across
+    several tables, so this closure table stores one row per path from a MusicalWork
+    to a File. It is maintained by the receivers in the signals module and should
+    never be edited by hand.
+
+    Rows for Files instantiating the whole MusicalWork have no Section and no Part.
+    Rows for Files instantiating a Section have no Part. Rows for Files instantiating
+    a Part reference the Part and, if the Part belongs to a Section, that Section.
+
+    Attributes
+    ----------
+    work : models.ForeignKey
+        Reference to the MusicalWork manifested by the File
+
+    section : models.ForeignKey
+        Reference to the Section manifested by the File, if any
+
+    part : models.ForeignKey
+        Reference to the Part manifested by the File, if any
+
+    file : models.ForeignKey
+        Reference to the File
+
+    file_format : models.CharField
+        A copy of the format of the File, so that formats can be counted without
+        joining the files table
+    """
+
+    work = models.ForeignKey(
+        "MusicalWork", on_delete=models.CASCADE, related_name="file_closures"
+    )
+    section = models.ForeignKey(
+        "Section",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="file_closures",
+    )
+    part = models.ForeignKey(
+        "Part",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="file_closures",
+    )
+    file = models.ForeignKey("File", on_delete=models.CASCADE, related_name="closures")
+    file_format = models.CharField(max_length=10)
+
+    class Meta:
+        db_table = "work_file_closure"
+        verbose_name_plural = "Work File Closures"
+        indexes = [
+            models.Index(fields=["work", "file"]),
+            models.Index(fields=["file", "work"]),
+            models.Index(fields=["work", "file_format"]),
+        ]
+
+    def __str__(self) -> str:
+        return "{0} -> {1}".format(self.work_id, self.file_id)
+
+    @classmethod
+    def works_of_instantiations(
+        cls, source_instantiation_ids: Iterable[int]
+    ) -> Set[int]:
+        """Get the ids of the MusicalWorks reachable from some SourceInstantiations
+
+        Parameters
+        ----------
+        source_instantiation_ids : Iterable[int]
+            The ids of the SourceInstantiations
+
+        Returns
+        -------
+        Set[int]
+            The ids of the MusicalWorks
+        """
+        instantiation_model = apps.get_model("database", "sourceinstantiation")
+        instantiations = instantiation_model.objects.filter(
+            id__in=source_instantiation_ids
+        )
+        ids: Set[int] = set()
+        for lookup in [
+            "work",
+            "sections__musical_work",
+            "parts__musical_work",
+            "parts__section__musical_work",
+        ]:
+            ids.update(instantiations.values_list(lookup, flat=True))
+        ids.discard(None)
+        return ids
+
+    @classmethod
+    def rebuild(cls, work_ids: Iterable[int]) -> None:
+        """Recompute all the rows of some MusicalWorks from the SourceInstantiations
+
+        Parameters
+        ----------
+        work_ids : Iterable[int]
+            The ids of the MusicalWorks whose rows are recomputed
+        """
+        work_ids = set(work_ids)
+        if not work_ids:
+            return
+        file_model = apps.get_model("database", "file")
+        rows = set()
+        # The lookups from a File to its MusicalWork, Section and Part for each path
+        paths = [
+            ("instantiates__work", None, None),
+            (
+                "instantiates__sections__musical_work",
+                "instantiates__sections",
+                None,
+            ),
+            ("instantiates__parts__musical_work", None, "instantiates__parts"),
+            (
+                "instantiates__parts__section__musical_work",
+                "instantiates__parts__section",
+                "instantiates__parts",
+            ),
+        ]
+        for work_lookup, section_lookup, part_lookup in paths:
+            fields = [
+                field for field in (section_lookup, part_lookup) if field is not None
+            ]
+            files = file_model.objects.filter(
+                **{work_lookup + "__in": work_ids}
+            ).values_list("id", "file_format", work_lookup, *fields)
+            for file_id, file_format, work_id, *others in files:
+                section_id = others.pop(0) if section_lookup else None
+                part_id = others.pop(0) if part_lookup else None
+                rows.add((work_id, section_id, part_id, file_id, file_format))
+
+        with transaction.atomic():
+            cls.objects.filter(work__in=work_ids).delete()
+            cls.objects.bulk_create(
+                [
+                    cls(
+                        work_id=work_id,
+                        section_id=section_id,
+                        part_id=part_id,
+                        file_id=file_id,
+                        file_format=file_format,
+                    )
+                    for work_id, section_id, part_id, file_id, file_format in rows
+                ]
+            )
@@ -0,0 +1,157 @@
+"""Defines a WorkSearchProjection model"""
+from typing import Iterable
+from django.apps import apps
+from django.contrib.postgres.fields import ArrayField, IntegerRangeField
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.db import connections, models
+
+
+class WorkSearchProjection(models.Model):
+    """The properties of a MusicalWork that the search filters on, in a single row
+
+    Filtering MusicalWorks by genre, composer, instrument, file format and date
+    otherwise joins the contributions, genre, part, section and closure tables. This
+    projection stores the ids of each of those as arrays with GIN indexes, so that
+    the facet and date filters of the search are array overlap predicates on one
+    table. It is recomputed with the search_document of the works, by the functions
+    in database/utils/search_index.py, and should never be edited by hand.
+
+    Attributes
+    ----------
+    work : models.OneToOneField
+        Reference to the MusicalWork
+
+    type_ids : ArrayField
+        The ids of the GenreAsInType of the MusicalWork
+
+    style_ids : ArrayField
+        The ids of the GenreAsInStyle of the MusicalWork
+
+    composer_ids : ArrayField
+        The ids of the Persons that contributed to the MusicalWork as Composers
+
+    instrument_ids : ArrayField
+        The ids of the Instruments of the Parts of the MusicalWork and its Sections
+
+    file_formats : ArrayField
+        The formats of the Files that manifest the MusicalWork
+
+    sacred_or_secular : models.NullBooleanField
+        A copy of the sacred_or_secular field of the MusicalWork
+
+    composition_year_range : IntegerRangeField
+        A copy of the composition_year_range field of the MusicalWork
+
+    updated : models.DateTimeField
+        When the row was last recomputed, so that in-memory copies such as the
+        FacetIndex can read back only the rows that changed
+    """
+
+    work = models.OneToOneField(
+        "MusicalWork",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="search_projection",
+    )
+    type_ids = ArrayField(models.IntegerField(), default=list)
+    style_ids = ArrayField(models.IntegerField(), default=list)
+    composer_ids = ArrayField(models.IntegerField(), default=list)
+    instrument_ids = ArrayField(models.IntegerField(), default=list)
+    file_formats = ArrayField(models.CharField(max_length=10), default=list)
+    sacred_or_secular = models.NullBooleanField(null=True, blank=True)
+    composition_year_range = IntegerRangeField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        db_table = "work_search_projection"
+        verbose_name_plural = "Work Search Projections"
+        indexes = [
+            GinIndex(fields=["type_ids"]),
+            GinIndex(fields=["style_ids"]),
+            GinIndex(fields=["composer_ids"]),
+            GinIndex(fields=["instrument_ids"]),
+            GinIndex(fields=["file_formats"]),
+            GistIndex(fields=["composition_year_range"]),
+        ]
+
+    def __str__(self) -> str:
+        return "Search projection of {0}".format(self.work_id)
+
+    @classmethod
+    def get_rebuild_sql(cls) -> str:
+        """Build the statement that upserts the rows of the works whose ids are in %s"""
+        musical_work = apps.get_model("database", "musicalwork")
+        contribution = apps.get_model("database", "contributionmusicalwork")
+        section = apps.get_model("database", "section")
+        part = apps.get_model("database", "part")
+        closure = apps.get_model("database", "workfileclosure")
+
+        def genre_ids(field_name: str) -> str:
+            field = musical_work._meta.get_field(field_name)
+            return (
+                "ARRAY(SELECT t.{genre_column} FROM {through} t "
+                "WHERE t.{work_column} = w.id ORDER BY 1)"
+            ).format(
+                through=field.m2m_db_table(),
+                genre_column=field.m2m_reverse_name(),
+                work_column=field.m2m_column_name(),
+            )
+
+        columns = {
+            "type_ids": genre_ids("genres_as_in_type"),
+            "style_ids": genre_ids("genres_as_in_style"),
+            "composer_ids": (
+                "ARRAY(SELECT DISTINCT c.person_id FROM {contribution} c "
+                "WHERE c.contributed_to_work_id = w.id AND c.role = 'COMPOSER' "
+                "ORDER BY 1)"
+            ).format(contribution=contribution._meta.db_table),
+            "instrument_ids": (
+                "ARRAY(SELECT DISTINCT pa.written_for_id FROM {part} pa "
+                "LEFT JOIN {section} ps ON ps.id = pa.section_id "
+                "WHERE pa.musical_work_id = w.id OR ps.musical_work_id = w.id "
+                "ORDER BY 1)"
+            ).format(part=part._meta.db_table, section=section._meta.db_table),
+            "file_formats": (
+                "ARRAY(SELECT DISTINCT cl.file_format FROM {closure} cl "
+                "WHERE cl.work_id = w.id ORDER BY 1)"
+            ).format(closure=closure._meta.db_table),
+            "sacred_or_secular": "w.sacred_or_secular",
+            "composition_year_range": "w.composition_year_range",
+            "updated": "now()",
+        }
+        return (
+            "INSERT INTO {table} (work_id, {columns}) "
+            "SELECT w.id, {selects} FROM {work_table} w WHERE w.id = ANY(%s) "
+            "ON CONFLICT (work_id) DO UPDATE SET {updates}"
+        ).format(
+            table=cls._meta.db_table,
+            columns=", ".join(columns),
+            selects=", ".join(columns.values()),
+            work_table=musical_work._meta.db_table,
+            updates=", ".join(
+                "{0} = EXCLUDED.{0}".format(column) for column in columns
+            ),
+        )
+
+    @classmethod
+    def rebuild(cls, work_ids: Iterable[int], using: str = "default") -> int:
+        """Recompute the rows of some MusicalWorks in a single statement
+
+        Parameters
+        ----------
+        work_ids : Iterable[int]
+            The ids of the MusicalWorks whose rows are recomputed
+        using : str
+            The alias of the database
+
+        Returns
+        -------
+        int
+            The number of rows inserted or updated
+        """
+        work_ids = list(work_ids)
+        if not work_ids:
+            return 0
+        with connections[using].cursor() as cursor:
+            cursor.execute(cls.get_rebuild_sql(), [work_ids])
+            return cursor.rowcount
@@ -1,19 +1,37 @@
 import os
-from database.models import File
+from database.models import (
+    ContributionMusicalWork,
+    ExtractedFeature,
+    File,
+    GenreAsInStyle,
+    GenreAsInType,
+    Instrument,
+    Part,
+    Person,
+    SearchSuggestion,
+    Section,
+    SourceInstantiation,
+    WorkFileClosure,
+)
 from database.models.musical_work import MusicalWork
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
 from django.dispatch import receiver
 from feature_extraction.feature_extracting import *
 from feature_extraction.feature_parsing import *
 from database.tasks import async_call
-from database.tasks import driver
+from database.tasks import (
+    clone_cached_features,
+    driver,
+    extract_features_batch_task,
+    store_features,
+)
+from django.conf import settings
+from feature_extraction.batch_extracting import enqueue
+from database.utils import search_cache, search_index
+from database.utils.db_utils import create_extra_sql
 from database.models.feature_file import FeatureFile
 from django.core import serializers
-from django.db.models import Value
-from django.contrib.postgres.search import SearchVector
-from functools import reduce
-from django.db import models
-import operator
+from django.core.management import call_command
 
 
 @receiver(post_save, sender=File)
@@ -73,6 +91,27 @@ def run_jsymbolic(instance, **kwargs):
     # in a weired way
     print(path)
     print(os.path.exists(path))
+    if getattr(settings, "JSYMBOLIC_BATCH_SIZE", 1) > 1:
+        # Extracted with other files by one run of jSymbolic, see
+        # feature_extraction/batch_extracting.py. Files whose contents were already
+        # extracted are skipped by extract_features_batch_task
+        pending, first = enqueue(
+            settings.JSYMBOLIC_SPOOL_DIR, instance.pk, path, feature_path_file
+        )
+        args = [
+            jsymbolic_file,
+            jsymbolic_config_file,
+            feature_config_file,
+            feature_definition_file,
+        ]
+        if pending >= settings.JSYMBOLIC_BATCH_SIZE:
+            extract_features_batch_task.delay(*args)
+        elif first:
+            # The first file of a batch waits at most JSYMBOLIC_BATCH_MAX_LATENCY
+            extract_features_batch_task.apply_async(
+                args, countdown=settings.JSYMBOLIC_BATCH_MAX_LATENCY
+            )
+        return
     # instance_json = serializers.serialize('json', [instance, ])
     async_task(
         jsymbolic_file,
@@ -97,45 +136,179 @@ def async_task(
     feature_config_file,
     feature_definition_file,
 ):
-    path_feature_description = os.path.join(
-        os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
-        "feature_extraction",
-        "jSymbolic_2_2_user",
-        "feature_definitions.xml",
-    )
-    version = "2.2"
-    software, created = Software.objects.get_or_create(
-        name="jSymbolic", version=version
-    )
+    if clone_cached_features(instance_pk, path, jsymbolic_config_file):
+        # Same contents as a File whose features were already extracted
+        return
     extracted = driver(jsymbolic_file, jsymbolic_config_file, path)
-    instance = File.objects.get(pk=instance_pk)
     if extracted:
-        parse_feature_types(path_feature_description, software)
-        feature_values_parsed = parse_feature_values(feature_path_file[0], instance, software)
-        if feature_values_parsed:
-            for item in feature_path_file:  # save all the feature files in the DB
-                filename, ext = os.path.splitext(item)
-                FeatureFile.objects.get_or_create(
-                    file_type=ext,
-                    file=item,
-                    features_from_file=instance,
-                    config_file=feature_config_file,
-                    feature_definition_file=feature_definition_file,
-                    extracted_with=software,
-                )
+        store_features(
+            instance_pk,
+            feature_path_file,
+            feature_config_file,
+            feature_definition_file,
+            jsymbolic_config_file=jsymbolic_config_file,
+        )
 
 
 @receiver(post_save, sender=MusicalWork)
 def on_save(instance, **kwargs):
-    index_components = instance.index_components()
-    pk = instance.pk
+    search_index.mark_dirty([instance.pk])
+
+
+@receiver(post_save, sender=ContributionMusicalWork)
+@receiver(post_delete, sender=ContributionMusicalWork)
+def update_search_from_contribution(instance, **kwargs):
+    search_index.mark_dirty([instance.contributed_to_work_id])
+
+
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+def update_search_from_section(instance, **kwargs):
+    search_index.mark_dirty([instance.musical_work_id])
 
-    search_vectors = []
 
-    for weight, data in index_components.items():
-        search_vectors.append(
-            SearchVector(Value(data, output_field=models.TextField()), weight=weight)
+@receiver(post_save, sender=Part)
+@receiver(post_delete, sender=Part)
+def update_search_from_part(instance, **kwargs):
+    work_ids = [instance.musical_work_id]
+    if instance.section_id is not None:
+        work_ids.append(
+            Section.objects.filter(pk=instance.section_id)
+            .values_list("musical_work_id", flat=True)
+            .first()
+        )
+    search_index.mark_dirty(work_ids)
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Instrument)
+@receiver(post_save, sender=GenreAsInStyle)
+@receiver(post_save, sender=GenreAsInType)
+def update_search_from_related(sender, instance, created, **kwargs):
+    # No work can index an object that was just created
+    if not created:
+        search_index.propagate(sender._meta.model_name, [instance.pk])
+
+
+@receiver(m2m_changed, sender=MusicalWork.genres_as_in_style.through)
+@receiver(m2m_changed, sender=MusicalWork.genres_as_in_type.through)
+def update_search_from_genres(instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            search_index.mark_dirty([instance.pk])
+    elif action == "pre_clear":
+        # The instance is a genre, the works it is cleared from are only known now
+        search_index.mark_dirty(instance.musical_works.values_list("id", flat=True))
+    elif action in ("post_add", "post_remove"):
+        search_index.mark_dirty(pk_set or [])
+
+
+@receiver(post_save, sender=MusicalWork)
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Instrument)
+@receiver(post_save, sender=GenreAsInStyle)
+@receiver(post_save, sender=GenreAsInType)
+def update_suggestions(sender, instance, **kwargs):
+    kind = SearchSuggestion.kind_of_model(sender._meta.model_name)
+    SearchSuggestion.refresh(kind, [instance.pk])
+
+
+@receiver(post_delete, sender=MusicalWork)
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Instrument)
+@receiver(post_delete, sender=GenreAsInStyle)
+@receiver(post_delete, sender=GenreAsInType)
+def delete_suggestions(sender, instance, **kwargs):
+    kind = SearchSuggestion.kind_of_model(sender._meta.model_name)
+    SearchSuggestion.objects.filter(kind=kind, target_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=ContributionMusicalWork)
+@receiver(post_delete, sender=ContributionMusicalWork)
+def update_suggestions_from_contribution(instance, **kwargs):
+    # Only the composers of at least one work are suggested
+    if instance.role == "COMPOSER":
+        SearchSuggestion.refresh("composer", [instance.person_id])
+
+
+def rebuild_closure(work_ids):
+    WorkFileClosure.rebuild(work_ids)
+    # The file formats of the works are in their search projection
+    search_index.mark_dirty(work_ids)
+
+
+@receiver(post_save, sender=File)
+def update_closure_from_file(instance, **kwargs):
+    work_ids = set(instance.closures.values_list("work_id", flat=True))
+    work_ids.update(WorkFileClosure.works_of_instantiations([instance.instantiates_id]))
+    rebuild_closure(work_ids)
+
+
+@receiver(post_save, sender=SourceInstantiation)
+def update_closure_from_source_instantiation(instance, **kwargs):
+    work_ids = set(
+        WorkFileClosure.objects.filter(file__instantiates=instance).values_list(
+            "work_id", flat=True
         )
-    instance.__class__.objects.filter(pk=pk).update(
-        search_document=reduce(operator.add, search_vectors)
     )
+    work_ids.update(WorkFileClosure.works_of_instantiations([instance.pk]))
+    rebuild_closure(work_ids)
+
+
+@receiver(m2m_changed, sender=SourceInstantiation.sections.through)
+@receiver(m2m_changed, sender=SourceInstantiation.parts.through)
+def update_closure_from_instantiated_sections_or_parts(
+    instance, action, reverse, pk_set, **kwargs
+):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # The instance is a Section or a Part, pk_set holds SourceInstantiations
+        instantiation_ids = set(pk_set or [])
+        work_ids = set(instance.file_closures.values_list("work_id", flat=True))
+    else:
+        instantiation_ids = {instance.pk}
+        work_ids = set(
+            WorkFileClosure.objects.filter(file__instantiates=instance).values_list(
+                "work_id", flat=True
+            )
+        )
+    work_ids.update(WorkFileClosure.works_of_instantiations(instantiation_ids))
+    rebuild_closure(work_ids)
+
+
+@receiver(post_save, sender=Section)
+def update_closure_from_section(instance, **kwargs):
+    work_ids = set(instance.file_closures.values_list("work_id", flat=True))
+    if instance.source_instantiations.exists() or instance.parts.exists():
+        work_ids.add(instance.musical_work_id)
+    rebuild_closure(work_ids)
+
+
+@receiver(post_save, sender=Part)
+def update_closure_from_part(instance, **kwargs):
+    work_ids = set(instance.file_closures.values_list("work_id", flat=True))
+    if instance.source_instantiations.exists():
+        if instance.musical_work_id:
+            work_ids.add(instance.musical_work_id)
+        elif instance.section_id:
+            work_ids.add(instance.section.musical_work_id)
+    rebuild_closure(work_ids)
+
+
+@receiver(post_migrate)
+def on_migrate(sender, using, **kwargs):
+    if sender.name == "database":
+        create_extra_sql(using)
+        # The table of the result sets cache, see settings.CACHES
+        call_command("createcachetable", database=using)
+
+
+@receiver(post_save, sender=MusicalWork)
+@receiver(post_save, sender=File)
+@receiver(post_save, sender=ExtractedFeature)
+@receiver(post_delete, sender=MusicalWork)
+@receiver(post_delete, sender=File)
+@receiver(post_delete, sender=ExtractedFeature)
+def invalidate_search_cache(**kwargs):
+    search_cache.bump_version()
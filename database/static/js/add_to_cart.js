@@ -45,16 +45,24 @@ function AddCorpusToCart(corpus_id) {
     });
 }
 
-function AddSearchResultsToCart(search_results_file_ids) {
+function AddSearchResultsToCart(search_results) {
     $.ajax({
         url: "/ajax/add_to_cart/",
         type: "POST",
         dataType: "json",
-        data: JSON.stringify({search_results_file_ids: search_results_file_ids}),
+        data: JSON.stringify(search_results),
         success: function(data){
             message = "All the files from the search results were addded to your download cart"
             showalert(message, "alert-success")
         },
+        error: function(xhr){
+            if (xhr.status == 410) {
+                message = "The search results expired, please search again"
+            } else {
+                message = "The search results could not be added to your download cart"
+            }
+            showalert(message, "alert-warning")
+        },
     });
 }
 
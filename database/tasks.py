@@ -1,10 +1,23 @@
 from __future__ import absolute_import
 from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.conf import settings
 from feature_extraction.feature_extracting import extract_features_setup
 import os
+import shutil
+from feature_extraction import jvm_pool
+from feature_extraction.batch_extracting import batch_items, extract_batch, take_batch
 from feature_extraction.feature_extracting import *
 from feature_extraction.feature_parsing import *
+from database.models.extraction_cache_entry import ExtractionCacheEntry, hash_file
 from database.models.feature_file import FeatureFile
+from database.models.file import File
+from database.models.software import Software
+from database.utils.search_index import reindex_dependent_works
+
+JSYMBOLIC_VERSION = "2.2"
+
+logger = get_task_logger(__name__)
 
 
 @shared_task
@@ -14,6 +27,124 @@ def async_call(jsymbolic_file, jsymbolic_config_file, path):
     extracted = driver(jsymbolic_file, jsymbolic_config_file, path)
 
 
+@shared_task
+def reindex_dependent_works_task(model_name, pks):
+    reindex_dependent_works(model_name, pks)
+
+
+@shared_task
+def extract_features_batch_task(
+    jsymbolic_file, jsymbolic_config_file, feature_config_file, feature_definition_file
+):
+    """Extract the features of the pending batch of files with one jSymbolic run"""
+    spool_dir = settings.JSYMBOLIC_SPOOL_DIR
+    batch_dir = take_batch(spool_dir)
+    if batch_dir is None:
+        # Already taken by an earlier task
+        return
+    try:
+        # Looked up here rather than when the Files are saved, since hashing them
+        # would slow down the upload
+        for item_dir, manifest in batch_items(batch_dir):
+            path = os.path.join(item_dir, manifest["name"])
+            if clone_cached_features(manifest["file_pk"], path, jsymbolic_config_file):
+                shutil.rmtree(item_dir)
+        ensure_jsymbolic_pool(jsymbolic_file)
+        extracted = extract_batch(
+            jsymbolic_file, jsymbolic_config_file, batch_dir, log_dir=spool_dir
+        )
+        for instance_pk, feature_path_file in extracted.items():
+            # One File that cannot be stored does not lose the features of the others
+            try:
+                store_features(
+                    instance_pk,
+                    feature_path_file,
+                    feature_config_file,
+                    feature_definition_file,
+                    jsymbolic_config_file=jsymbolic_config_file,
+                )
+            except Exception:
+                logger.exception("Could not store the features of File %s", instance_pk)
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+
+def get_jsymbolic():
+    software, created = Software.objects.get_or_create(
+        name="jSymbolic", version=JSYMBOLIC_VERSION
+    )
+    return software
+
+
+def clone_cached_features(instance_pk, path, jsymbolic_config_file):
+    """Copy the features of an earlier File with the same contents, if there is one
+
+    Returns whether the features were copied, in which case jSymbolic is not run.
+    """
+    if not settings.JSYMBOLIC_EXTRACTION_CACHE or not os.path.exists(path):
+        return False
+    source = ExtractionCacheEntry.lookup(
+        hash_file(path), hash_file(jsymbolic_config_file), get_jsymbolic()
+    )
+    if source is None or source.pk == instance_pk:
+        return False
+    instance = File.objects.get(pk=instance_pk)
+    return ExtractionCacheEntry.clone_features(source, instance) > 0
+
+
+def store_features(
+    instance_pk,
+    feature_path_file,
+    feature_config_file,
+    feature_definition_file,
+    jsymbolic_config_file=None,
+):
+    """Save the features extracted from a File and its feature files
+
+    If the config file jSymbolic was run with is given, the File is recorded as
+    the source of the features of its contents, see ExtractionCacheEntry.
+    """
+    path_feature_description = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+        "feature_extraction",
+        "jSymbolic_2_2_user",
+        "feature_definitions.xml",
+    )
+    software = get_jsymbolic()
+    instance = File.objects.get(pk=instance_pk)
+    parse_feature_types(path_feature_description, software)
+    feature_values_parsed = parse_feature_values(feature_path_file[0], instance, software)
+    if feature_values_parsed:
+        for item in feature_path_file:  # save all the feature files in the DB
+            filename, ext = os.path.splitext(item)
+            FeatureFile.objects.get_or_create(
+                file_format=ext,
+                file=item,
+                features_from_file=instance,
+                config_file=feature_config_file,
+                feature_definition_file=feature_definition_file,
+                extracted_with=software,
+            )
+        if jsymbolic_config_file is not None and os.path.exists(instance.file.path):
+            ExtractionCacheEntry.record(
+                instance,
+                hash_file(instance.file.path),
+                hash_file(jsymbolic_config_file),
+                software,
+            )
+
+
+def ensure_jsymbolic_pool(jsymbolic_file):
+    """Keep warm jSymbolic JVMs in this Celery worker if JSYMBOLIC_POOL_SIZE is set"""
+    jvm_pool.ensure_pool(
+        jsymbolic_file,
+        settings.JSYMBOLIC_POOL_SIZE,
+        max_jobs=settings.JSYMBOLIC_POOL_MAX_JOBS,
+        max_memory_mb=settings.JSYMBOLIC_POOL_MAX_MEMORY_MB,
+    )
+
+
 def driver(jsymbolic_file, jsymbolic_config_file, file_path):
+    ensure_jsymbolic_pool(jsymbolic_file)
     extracted = extract_features_setup(jsymbolic_file, jsymbolic_config_file, file_path)
     return extracted
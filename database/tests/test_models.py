@@ -5,14 +5,26 @@ from pprint import pprint
 from typing import List
 
 from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
 from django.core.exceptions import ValidationError
 from django.core.files import File as PythonFile
-from django.test import TestCase
-from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.db.models import Prefetch, QuerySet
 from model_bakery import baker
 from psycopg2.extras import NumericRange
 
+from database.forms.feature_search_form import FeatureSearchForm
 from database.models import *
+from database.models.extraction_cache_entry import hash_file
+from database.utils.search_index import (
+    dependent_works,
+    flush,
+    reindex_works,
+    suspend_reindexing,
+)
+from database.utils.facet_index import FacetIndex
+from database.utils.trigram import search_persons
+from database.views.facets import StyleFacet
 
 
 def gen_int_range() -> NumericRange:
@@ -276,6 +288,61 @@ class ExtractedFeatureModelTest(TestCase):
         os.remove(self.file.file.path)
 
 
+class ExtractionCacheEntryModelTest(TestCase):
+    def setUp(self) -> None:
+        self.source = baker.make("File", _create_files=True)
+        self.target = baker.make("File", _create_files=True)
+        self.software = baker.make("Software")
+        self.feature_type = baker.make(
+            "FeatureType", software=self.software, dimensions=1
+        )
+        baker.make(
+            "ExtractedFeature",
+            instance_of_feature=self.feature_type,
+            feature_of=self.source,
+            extracted_with=self.software,
+            value=[3.0],
+        )
+        self.feature_file = baker.make(
+            "FeatureFile",
+            features_from_file=self.source,
+            extracted_with=self.software,
+            _create_files=True,
+        )
+
+    def test_lookup(self) -> None:
+        content_hash = hash_file(self.source.file.path)
+        ExtractionCacheEntry.record(self.source, content_hash, "config", self.software)
+        self.assertEqual(
+            ExtractionCacheEntry.lookup(content_hash, "config", self.software),
+            self.source,
+        )
+        self.assertIsNone(
+            ExtractionCacheEntry.lookup(content_hash, "other", self.software)
+        )
+
+    def test_clone_features(self) -> None:
+        self.assertEqual(
+            ExtractionCacheEntry.clone_features(self.source, self.target), 1
+        )
+        feature = self.target.features.get()
+        self.assertEqual(feature.value, [3.0])
+        self.assertEqual(feature.instance_of_feature, self.feature_type)
+        self.assertEqual(
+            self.target.feature_files.get().file.name, self.feature_file.file.name
+        )
+        vector = FileFeatureVector.objects.get(file=self.target)
+        self.assertEqual(vector.get_value(self.feature_type.id), 3.0)
+
+    def tearDown(self) -> None:
+        """Delete the files that were uploaded when creating the test objects"""
+        os.remove(self.source.file.path)
+        os.remove(self.target.file.path)
+        os.remove(self.feature_file.file.path)
+        os.remove(self.feature_file.config_file.path)
+        os.remove(self.feature_file.feature_definition_file.path)
+
+
 class FeatureFileModelTest(TestCase):
     def setUp(self) -> None:
         self.file = baker.make("File", _create_files=True)
@@ -358,6 +425,64 @@ class FeatureTypeModelTest(TestCase):
                 self.assertEquals(max(values), feature_type.max_val)
                 self.assertEquals(min(values), feature_type.min_val)
 
+    def test_extend_max_and_min(self) -> None:
+        feature_type = self.feature_types[0]
+        baker.make(
+            "ExtractedFeature",
+            value=[5.0],
+            instance_of_feature=feature_type,
+            extracted_with=self.software,
+            feature_of=self.file,
+        )
+        features = ExtractedFeature.objects.bulk_create(
+            ExtractedFeature(
+                value=[value],
+                instance_of_feature=feature_type,
+                extracted_with=self.software,
+                feature_of=self.file,
+            )
+            for value in [2.0, 4.0]
+        )
+        FeatureType.extend_max_and_min(features)
+        feature_type.refresh_from_db()
+        self.assertEquals(feature_type.min_val, 2.0)
+        self.assertEquals(feature_type.max_val, 5.0)
+
+    def test_make_bounds(self) -> None:
+        other_file = baker.make("File", _create_files=True)
+        self.addCleanup(os.remove, other_file.file.path)
+        first_type, second_type, unused_type = self.feature_types[:3]
+        for feature_type, file, value in [
+            (first_type, self.file, 3.0),
+            (first_type, other_file, -1.0),
+            (second_type, self.file, 7.0),
+            (second_type, other_file, 9.0),
+            (unused_type, self.file, 1.0),
+        ]:
+            baker.make(
+                "ExtractedFeature",
+                value=[value],
+                instance_of_feature=feature_type,
+                extracted_with=self.software,
+                feature_of=file,
+            )
+        feature_types = FeatureType.objects.filter(
+            pk__in=[first_type.pk, second_type.pk]
+        )
+        with self.assertNumQueries(1):
+            bounds = FeatureSearchForm.make_bounds(
+                feature_types, [self.file.pk, other_file.pk]
+            )
+        self.assertEqual(
+            bounds, {first_type.pk: (-1.0, 3.0), second_type.pk: (7.0, 9.0)}
+        )
+        # Only the values of the given Files count
+        bounds = FeatureSearchForm.make_bounds(feature_types, [other_file.pk])
+        self.assertEqual(
+            bounds, {first_type.pk: (-1.0, -1.0), second_type.pk: (9.0, 9.0)}
+        )
+        self.assertEqual(FeatureSearchForm.make_bounds(feature_types, []), {})
+
     def test_group_property(self) -> None:
         for feature_type in self.feature_types:
             if feature_type.code == "P-41":
@@ -679,8 +804,110 @@ class LanguageModelTest(TestCase):
 
 
 class MusicalWorkModelTest(TestCase):
-    # TODO: fill this in
-    pass
+    def test_reindex_works(self) -> None:
+        work = baker.make("MusicalWork", variant_titles=["Missa Pange Lingua"])
+        person = baker.make("Person", given_name="Josquin", surname="Desprez")
+        baker.make(
+            "ContributionMusicalWork",
+            person=person,
+            contributed_to_work=work,
+            role="COMPOSER",
+        )
+        MusicalWork.objects.filter(pk=work.pk).update(search_document=None)
+        self.assertEqual(reindex_works([work.pk]), 1)
+        self.assertSearchable(work, ["pange", "josquin"])
+
+    def test_search_document_updated_on_commit(self) -> None:
+        work = baker.make("MusicalWork", variant_titles=["Ave Maria"])
+        style = baker.make("GenreAsInStyle", name="Renaissance")
+        with suspend_reindexing():
+            style.musical_works.add(work)
+            baker.make("Section", musical_work=work, title="Gloria")
+        # The test runs in a transaction that never commits, so flush by hand
+        flush()
+        self.assertSearchable(work, ["renaissance", "gloria"])
+
+    def test_dependent_works(self) -> None:
+        work = baker.make("MusicalWork", variant_titles=[random_str()])
+        other_work = baker.make("MusicalWork", variant_titles=[random_str()])
+        section = baker.make("Section", musical_work=work)
+        instrument = baker.make("Instrument")
+        baker.make("Part", section=section, written_for=instrument)
+        self.assertEqual(dependent_works("instrument", [instrument.pk]), [work.pk])
+
+    @override_settings(SEARCH_INDEX_ASYNC=False)
+    def test_rename_propagates(self) -> None:
+        work = baker.make("MusicalWork", variant_titles=[random_str()])
+        section = baker.make("Section", musical_work=work)
+        instrument = baker.make("Instrument", name="Sackbut")
+        baker.make("Part", section=section, written_for=instrument)
+        person = baker.make("Person", given_name="Jacob", surname="Obrecht")
+        baker.make(
+            "ContributionMusicalWork",
+            person=person,
+            contributed_to_work=work,
+            role="COMPOSER",
+        )
+        flush()
+        self.assertSearchable(work, ["sackbut", "obrecht"])
+        instrument.name = "Theorbo"
+        instrument.save()
+        person.surname = "Ockeghem"
+        person.save()
+        # The test runs in a transaction that never commits, so flush by hand
+        flush()
+        self.assertSearchable(work, ["theorbo", "ockeghem"])
+        self.assertFalse(
+            MusicalWork.objects.filter(
+                pk=work.pk, search_document=SearchQuery("sackbut")
+            ).exists()
+        )
+
+    def test_composition_year_range(self) -> None:
+        work = baker.make("MusicalWork", variant_titles=[random_str()])
+        for date_range in (NumericRange(1500, 1511), NumericRange(1520, 1531)):
+            baker.make(
+                "ContributionMusicalWork",
+                contributed_to_work=work,
+                role="COMPOSER",
+                date_range_year_only=date_range,
+            )
+        baker.make(
+            "ContributionMusicalWork",
+            contributed_to_work=work,
+            role="ARRANGER",
+            date_range_year_only=NumericRange(1600, 1601),
+        )
+        # The range is computed when the work is reindexed
+        flush()
+        work.refresh_from_db()
+        self.assertEqual(work.composition_year_range, NumericRange(1500, 1531))
+        works = MusicalWork.objects.filter(
+            composition_year_range__overlap=NumericRange(1540, 1650, bounds="[]")
+        )
+        self.assertFalse(works.exists())
+        baker.make(
+            "ContributionMusicalWork",
+            contributed_to_work=work,
+            role="COMPOSER",
+            date_range_year_only=NumericRange(1525, None),
+        )
+        flush()
+        work.refresh_from_db()
+        self.assertEqual(work.composition_year_range, NumericRange(1500, None))
+        self.assertTrue(works.exists())
+        work.contributions.all().delete()
+        flush()
+        work.refresh_from_db()
+        self.assertIsNone(work.composition_year_range)
+
+    def assertSearchable(self, work: MusicalWork, keywords: List[str]) -> None:
+        for keyword in keywords:
+            self.assertTrue(
+                MusicalWork.objects.filter(
+                    pk=work.pk, search_document=SearchQuery(keyword)
+                ).exists()
+            )
 
 
 class PartModelTest(TestCase):
@@ -689,8 +916,13 @@ class PartModelTest(TestCase):
 
 
 class PersonModelTest(TestCase):
-    # TODO: fill this in
-    pass
+    def test_trigram_search(self) -> None:
+        person = baker.make("Person", given_name="Josquin", surname="Desprez")
+        baker.make("Person", given_name="Guillaume", surname="Dufay")
+        persons = search_persons(Person.objects.all(), "Josquin des Prez")
+        test_queryset_equal_to_list(persons, [person])
+        persons = search_persons(Person.objects.all(), "Jusquin")
+        test_queryset_equal_to_list(persons, [person])
 
 
 class ResearchCorpusModelTest(TestCase):
@@ -706,6 +938,24 @@ class ResearchCorpusModelTest(TestCase):
         )
 
 
+class SearchSuggestionModelTest(TestCase):
+    def test_suggest(self) -> None:
+        person = baker.make("Person", given_name="Josquin", surname="Després")
+        work = baker.make("MusicalWork", variant_titles=["Missa Pange lingua"])
+        baker.make(
+            "ContributionMusicalWork",
+            person=person,
+            contributed_to_work=work,
+            role="COMPOSER",
+        )
+        SearchSuggestion.rebuild()
+        suggestions = SearchSuggestion.suggest("despr")
+        self.assertEqual([s.target_id for s in suggestions], [person.pk])
+        self.assertEqual(suggestions[0].label, "Josquin Després")
+        suggestions = SearchSuggestion.suggest("Missa P")
+        self.assertEqual([s.kind for s in suggestions], ["work"])
+
+
 class SectionModelTest(TestCase):
     # TODO: fill this in
     pass
@@ -788,3 +1038,140 @@ class ValidationWorkflowModelTest(TestCase):
     def tearDown(self) -> None:
         """Delete the file that was uploaded when creating the test object"""
         os.remove(self.workflow.workflow_file.path)
+
+
+class WorkFileClosureModelTest(TestCase):
+    def setUp(self) -> None:
+        self.work = baker.make("MusicalWork", variant_titles=[random_str()])
+        self.section = baker.make("Section", musical_work=self.work)
+        # File.rename_file uses the name of the Part
+        self.part = baker.make("Part", section=self.section, name="Violin I")
+        source = baker.make("Source")
+        work_instantiation = baker.make(
+            "SourceInstantiation", source=source, work=self.work
+        )
+        section_instantiation = baker.make(
+            "SourceInstantiation", source=source, sections=[self.section]
+        )
+        part_instantiation = baker.make(
+            "SourceInstantiation", source=source, parts=[self.part]
+        )
+        self.work_file = baker.make(
+            "File", _create_files=True, instantiates=work_instantiation
+        )
+        self.section_file = baker.make(
+            "File", _create_files=True, instantiates=section_instantiation
+        )
+        self.part_file = baker.make(
+            "File", _create_files=True, instantiates=part_instantiation
+        )
+
+    def test_closure_rows(self) -> None:
+        rows = WorkFileClosure.objects.filter(work=self.work).values_list(
+            "section_id", "part_id", "file_id"
+        )
+        self.assertCountEqual(
+            rows,
+            [
+                (None, None, self.work_file.id),
+                (self.section.id, None, self.section_file.id),
+                (self.section.id, self.part.id, self.part_file.id),
+            ],
+        )
+
+    def test_files_property(self) -> None:
+        test_queryset_equal_to_list(self.work.files, [self.work_file])
+        test_queryset_equal_to_list(self.section.files, [self.section_file])
+        test_queryset_equal_to_list(self.part.files, [self.part_file])
+
+    def test_prefetch_files(self) -> None:
+        work = MusicalWork.objects.prefetch_related(
+            MusicalWork.prefetch_files(),
+            Prefetch(
+                "sections",
+                queryset=Section.objects.prefetch_related(Section.prefetch_files()),
+            ),
+        ).get(pk=self.work.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(work.files, [self.work_file])
+            self.assertEqual(work.sections.all()[0].files, [self.section_file])
+            self.assertEqual(work.files_count, 1)
+
+    def test_rebuild(self) -> None:
+        WorkFileClosure.objects.all().delete()
+        WorkFileClosure.rebuild([self.work.id])
+        self.assertEqual(WorkFileClosure.objects.filter(work=self.work).count(), 3)
+
+
+class FileFeatureVectorModelTest(TestCase):
+    def setUp(self) -> None:
+        self.file = baker.make("File", _create_files=True)
+        software = baker.make("Software")
+        self.scalar_type = baker.make("FeatureType", software=software, dimensions=1)
+        self.histogram_type = baker.make(
+            "FeatureType", software=software, dimensions=2
+        )
+        baker.make(
+            "ExtractedFeature",
+            instance_of_feature=self.scalar_type,
+            feature_of=self.file,
+            value=[4.5],
+        )
+        baker.make(
+            "ExtractedFeature",
+            instance_of_feature=self.histogram_type,
+            feature_of=self.file,
+            value=[1.0, 2.0],
+        )
+        FileFeatureVector.rebuild([self.file.id])
+
+    def test_rebuild(self) -> None:
+        vector = FileFeatureVector.objects.get(file=self.file)
+        self.assertEqual(vector.get_value(self.scalar_type.id), 4.5)
+        self.assertIsNone(vector.get_value(self.histogram_type.id))
+
+    def test_lookup(self) -> None:
+        lookup = "feature_vector__" + FileFeatureVector.lookup(self.scalar_type.id)
+        self.assertTrue(File.objects.filter(**{lookup + "__gte": 4}).exists())
+        self.assertFalse(File.objects.filter(**{lookup + "__gte": 5}).exists())
+
+
+class WorkSearchProjectionModelTest(TestCase):
+    def test_rebuild(self) -> None:
+        work = baker.make("MusicalWork", variant_titles=[random_str()])
+        style = baker.make("GenreAsInStyle")
+        work.genres_as_in_style.add(style)
+        person = baker.make("Person")
+        baker.make(
+            "ContributionMusicalWork",
+            person=person,
+            contributed_to_work=work,
+            role="COMPOSER",
+        )
+        section = baker.make("Section", musical_work=work)
+        part = baker.make("Part", section=section)
+        self.assertEqual(WorkSearchProjection.rebuild([work.pk]), 1)
+        projection = WorkSearchProjection.objects.get(work=work)
+        self.assertEqual(projection.style_ids, [style.pk])
+        self.assertEqual(projection.composer_ids, [person.pk])
+        self.assertEqual(projection.instrument_ids, [part.written_for_id])
+        self.assertTrue(
+            WorkSearchProjection.objects.filter(
+                style_ids__overlap=[style.pk], type_ids=[]
+            ).exists()
+        )
+
+    def test_facet_index(self) -> None:
+        work = baker.make("MusicalWork", variant_titles=[random_str()])
+        other_work = baker.make("MusicalWork", variant_titles=[random_str()])
+        style = baker.make("GenreAsInStyle")
+        work.genres_as_in_style.add(style)
+        WorkSearchProjection.rebuild([work.pk, other_work.pk])
+        index = FacetIndex()
+        index.load()
+        facet = StyleFacet(selected=[str(style.pk)])
+        self.assertEqual(index.filter([facet]), [work.pk])
+        index.compute([facet], [work.pk, other_work.pk])
+        self.assertEqual(
+            [(value.pk, value.count) for value in facet.facet_values], [(style.pk, 1)]
+        )
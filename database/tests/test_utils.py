@@ -0,0 +1,616 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Tuple
+from unittest import mock
+
+import numpy as np
+from django.core.paginator import InvalidPage
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from model_bakery import baker
+
+from database.models import *
+from database.utils import feature_matrix, result_sets, search_cache
+from database.utils.feature_matrix import FeatureMatrix
+from database.utils.pagination import (
+    KeysetPaginator,
+    ListKeysetPaginator,
+    encode_cursor,
+    estimate_count,
+)
+from database.utils.parallel import run_in_parallel
+from database.utils.similarity import (
+    BruteForceIndex,
+    RandomProjectionIndex,
+    SimilarityIndex,
+)
+from database.utils.search_index import reindex_works
+from database.views.search import FeatureFilter, SearchView
+from feature_extraction import batch_extracting, jvm_pool
+
+
+def random_str(length: int = 10) -> str:
+    return uuid.uuid4().hex.upper()[0:length]
+
+
+class SearchCacheKeyTest(TestCase):
+    def test_pagination_parameters_are_stripped(self) -> None:
+        self.assertEqual(
+            search_cache.make_key(QueryDict("q=mass&page=3&cursor=abc")),
+            search_cache.make_key(QueryDict("q=mass&pagination=keyset")),
+        )
+
+    def test_parameters_are_canonicalized(self) -> None:
+        self.assertEqual(
+            search_cache.make_key(QueryDict("types=2&q=mass&types=1&styles=")),
+            search_cache.make_key(QueryDict("q=mass&types=1&types=2")),
+        )
+        self.assertNotEqual(
+            search_cache.make_key(QueryDict("q=mass")),
+            search_cache.make_key(QueryDict("q=motet")),
+        )
+
+
+class SearchCacheInvalidationTest(TransactionTestCase):
+    # Outside of TestCase the version is bumped when the transaction commits
+    def setUp(self) -> None:
+        self.query = QueryDict("q=mass")
+
+    def test_saving_a_work_invalidates(self) -> None:
+        key = search_cache.make_key(self.query)
+        baker.make("MusicalWork", variant_titles=[random_str()])
+        self.assertNotEqual(search_cache.make_key(self.query), key)
+
+    def test_reindexing_invalidates(self) -> None:
+        work = baker.make("MusicalWork", variant_titles=[random_str()])
+        key = search_cache.make_key(self.query)
+        # Changes search_document without saving the work
+        reindex_works([work.pk])
+        self.assertNotEqual(search_cache.make_key(self.query), key)
+
+    def test_genre_change_invalidates(self) -> None:
+        work = baker.make("MusicalWork", variant_titles=[random_str()])
+        key = search_cache.make_key(self.query)
+        work.genres_as_in_style.add(baker.make("GenreAsInStyle"))
+        self.assertNotEqual(search_cache.make_key(self.query), key)
+
+
+class ResultSetsTest(TestCase):
+    def test_pack_and_unpack(self) -> None:
+        file_ids = [7, 3, 100000, 3, 12, 4294967]
+        self.assertEqual(
+            result_sets.unpack(result_sets.pack(file_ids)), sorted(set(file_ids))
+        )
+        self.assertEqual(result_sets.unpack(result_sets.pack([])), [])
+
+    def test_same_set_same_token(self) -> None:
+        self.assertEqual(
+            result_sets.make_token(result_sets.pack([1, 2, 3])),
+            result_sets.make_token(result_sets.pack([3, 2, 1, 1])),
+        )
+
+    def test_store_and_load(self) -> None:
+        token = result_sets.store_file_ids([5, 1, 3])
+        self.assertEqual(result_sets.load_file_ids(token), [1, 3, 5])
+        self.assertIsNone(result_sets.load_file_ids("expired"))
+
+    @override_settings(
+        CACHES={
+            "result_sets": {
+                "BACKEND": "django.core.cache.backends.memcached.MemcachedCache"
+            }
+        }
+    )
+    def test_is_shared(self) -> None:
+        self.assertTrue(result_sets.is_shared())
+
+    @override_settings(
+        CACHES={
+            "result_sets": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+            }
+        }
+    )
+    def test_local_memory_is_not_shared(self) -> None:
+        self.assertFalse(result_sets.is_shared())
+
+    def test_default_is_shared(self) -> None:
+        self.assertTrue(result_sets.is_shared())
+
+
+class BatchExtractingTest(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def write(self, name: str, contents: str) -> str:
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(contents)
+        return path
+
+    def test_split_values(self) -> None:
+        path = self.write(
+            "values.xml",
+            "<feature_vector_file><comments></comments>"
+            "<data_set><data_set_id>/in/1__a.mid</data_set_id>"
+            "<feature><name>Range</name><v>12</v></feature></data_set>"
+            "<data_set><data_set_id>/in/2__b.mid</data_set_id>"
+            "<feature><name>Range</name><v>7</v></feature></data_set>"
+            "<data_set><data_set_id>/in/other.mid</data_set_id></data_set>"
+            "</feature_vector_file>",
+        )
+        trees = batch_extracting.split_values(path, ["1__a.mid", "2__b.mid"])
+        self.assertEqual(list(trees), ["1__a.mid", "2__b.mid"])
+        root = trees["2__b.mid"].getroot()
+        self.assertIsNotNone(root.find("comments"))
+        self.assertEqual(len(root.findall("data_set")), 1)
+        self.assertEqual(root.find("data_set/feature/v").text, "7")
+
+    def test_split_csv(self) -> None:
+        path = self.write(
+            "values.csv",
+            'Id,Range\n"/in/1__a.mid",12\n/in/2__b.mid,7\n/in/c.mid,1\n',
+        )
+        csvs = batch_extracting.split_csv(path, ["1__a.mid", "2__b.mid"])
+        self.assertEqual(
+            csvs,
+            {
+                "1__a.mid": 'Id,Range\n"/in/1__a.mid",12\n',
+                "2__b.mid": "Id,Range\n/in/2__b.mid,7\n",
+            },
+        )
+        self.assertEqual(batch_extracting.split_csv(self.write("e.csv", ""), []), {})
+
+    def test_split_arff(self) -> None:
+        header = "@RELATION values\n@ATTRIBUTE Range NUMERIC\n@DATA"
+        path = self.write("values.arff", header + "\n12\n\n7\n")
+        arffs = batch_extracting.split_arff(path, ["1__a.mid", "2__b.mid"])
+        self.assertEqual(
+            arffs, {"1__a.mid": header + "\n12\n", "2__b.mid": header + "\n7\n"}
+        )
+        # The rows cannot be matched to the files
+        self.assertEqual(batch_extracting.split_arff(path, ["1__a.mid"]), {})
+
+    def test_enqueue(self) -> None:
+        path = self.write("a.mid", "")
+        spool_dir = os.path.join(self.directory, "spool")
+        self.assertEqual(
+            batch_extracting.enqueue(spool_dir, 1, path, ["1.xml"]), (1, True)
+        )
+        self.assertEqual(
+            batch_extracting.enqueue(spool_dir, 2, path, ["2.xml"]), (2, False)
+        )
+        batch_dir = batch_extracting.take_batch(spool_dir)
+        self.assertIsNotNone(batch_dir)
+        # The next file opens a new batch
+        self.assertEqual(
+            batch_extracting.enqueue(spool_dir, 3, path, ["3.xml"]), (1, True)
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+
+class FakeWorker(object):
+    """Stands for a JSymbolicWorker without starting a JVM"""
+
+    def __init__(self) -> None:
+        self.jobs = 0
+        self.alive = True
+        self.memory = 100
+        self.stopped = False
+        self.error = None
+        self.process = mock.Mock()
+
+    def run(self, args: List[str], timeout: int) -> Tuple[int, str, str]:
+        if self.error is not None:
+            raise self.error
+        self.jobs += 1
+        return 0, " ".join(args), ""
+
+    def is_alive(self) -> bool:
+        return self.alive and not self.stopped
+
+    def memory_mb(self) -> float:
+        return self.memory
+
+    def stop(self) -> None:
+        self.stopped = True
+
+
+class JSymbolicPoolTest(TestCase):
+    def setUp(self) -> None:
+        self.workers: List[FakeWorker] = []
+
+        def make_worker(jar_file: str) -> FakeWorker:
+            self.workers.append(FakeWorker())
+            return self.workers[-1]
+
+        patcher = mock.patch.object(jvm_pool, "JSymbolicWorker", make_worker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = jvm_pool.JSymbolicPool("jSymbolic2.jar", 1, max_jobs=2)
+
+    def test_unescape(self) -> None:
+        self.assertEqual(jvm_pool.unescape("a\\tb\\\\n\\nc"), "a\tb\\n\nc")
+        self.assertEqual(jvm_pool.unescape("trailing\\"), "trailing")
+
+    def test_reuses_worker(self) -> None:
+        self.assertEqual(self.pool.run(["-help"]), (0, "-help", ""))
+        self.pool.run(["-help"])
+        self.assertEqual(len(self.workers), 1)
+
+    def test_replaces_worker_after_max_jobs(self) -> None:
+        for i in range(3):
+            self.pool.run(["-help"])
+        self.assertEqual(len(self.workers), 2)
+        self.assertTrue(self.workers[0].stopped)
+        self.assertEqual(self.pool.workers, {self.workers[1]})
+
+    def test_replaces_worker_past_max_memory(self) -> None:
+        self.pool = jvm_pool.JSymbolicPool("jSymbolic2.jar", 1, max_jobs=100)
+        self.pool.run(["-help"])
+        self.workers[0].memory = 4096
+        self.pool.run(["-help"])
+        self.pool.run(["-help"])
+        self.assertEqual(len(self.workers), 2)
+        self.assertTrue(self.workers[0].stopped)
+
+    def test_replaces_dead_idle_worker(self) -> None:
+        self.pool.run(["-help"])
+        self.workers[0].alive = False
+        self.pool.run(["-help"])
+        self.assertEqual(len(self.workers), 2)
+        self.assertNotIn(self.workers[0], self.pool.workers)
+
+    def test_discards_failed_worker(self) -> None:
+        self.pool.run(["-help"])
+        # Still looks alive after the error
+        self.workers[0].error = jvm_pool.WorkerError("timed out")
+        self.assertEqual(self.pool.run(["-help"]), (1, "", "timed out"))
+        self.workers[0].process.kill.assert_called_once_with()
+        self.assertTrue(self.workers[0].stopped)
+        self.assertEqual(self.pool.workers, set())
+        self.pool.run(["-help"])
+        self.assertEqual(len(self.workers), 2)
+
+    def test_worker_exited(self) -> None:
+        self.pool.run(["-help"])
+        self.workers[0].error = jvm_pool.WorkerExited(0)
+        self.assertEqual(self.pool.run(["-help"]), (0, "", ""))
+        self.assertTrue(self.workers[0].stopped)
+        self.pool.run(["-help"])
+        self.workers[1].error = jvm_pool.WorkerExited(2)
+        status, stdout, stderr = self.pool.run(["-help"])
+        self.assertEqual(status, 2)
+        self.assertTrue(stderr)
+
+
+class RunInParallelTest(TransactionTestCase):
+    # Inside the transaction of a TestCase the functions always run serially
+    def setUp(self) -> None:
+        baker.make("MusicalWork", variant_titles=[random_str()])
+        # Whether each run of each function was on the thread of the caller
+        self.runs: Dict[str, List[bool]] = {}
+
+    def make_task(
+        self, name: str, fail_on_worker: bool = False, sleep_on_worker: float = 0
+    ) -> Callable[[], Any]:
+        def task() -> Any:
+            on_caller = threading.current_thread() is threading.main_thread()
+            self.runs.setdefault(name, []).append(on_caller)
+            with connection.cursor() as cursor:
+                cursor.execute("SHOW statement_timeout")
+                timeout = cursor.fetchone()[0]
+            result = MusicalWork.objects.count(), timeout
+            if not on_caller:
+                if fail_on_worker:
+                    raise RuntimeError(name)
+                time.sleep(sleep_on_worker)
+            return result
+
+        return task
+
+    @override_settings(PARALLEL_QUERY_TIMEOUT=5)
+    def test_runs_on_own_connections(self) -> None:
+        results = run_in_parallel({"a": self.make_task("a"), "b": self.make_task("b")})
+        self.assertEqual(results, {"a": (1, "5s"), "b": (1, "5s")})
+        self.assertEqual(self.runs, {"a": [False], "b": [False]})
+
+    def test_in_atomic_block(self) -> None:
+        with transaction.atomic():
+            # Only visible to the connection of the caller
+            baker.make("MusicalWork", variant_titles=[random_str()])
+            results = run_in_parallel(
+                {"a": self.make_task("a"), "b": self.make_task("b")}
+            )
+        self.assertEqual([result[0] for result in results.values()], [2, 2])
+        self.assertEqual(self.runs, {"a": [True], "b": [True]})
+
+    @override_settings(PARALLEL_QUERY_WORKERS=1)
+    def test_single_worker(self) -> None:
+        run_in_parallel({"a": self.make_task("a"), "b": self.make_task("b")})
+        self.assertEqual(self.runs, {"a": [True], "b": [True]})
+
+    @override_settings(PARALLEL_QUERY_TIMEOUT=5)
+    def test_failed_task_is_run_again(self) -> None:
+        results = run_in_parallel(
+            {"a": self.make_task("a", fail_on_worker=True), "b": self.make_task("b")}
+        )
+        self.assertEqual(results, {"a": (1, "5s"), "b": (1, "5s")})
+        # Only the function that failed is run again, with the same timeout
+        self.assertEqual(self.runs, {"a": [False, True], "b": [False]})
+
+    @override_settings(PARALLEL_QUERY_TIMEOUT=0.2)
+    def test_slow_task_is_run_again_with_timeout(self) -> None:
+        results = run_in_parallel(
+            {"a": self.make_task("a", sleep_on_worker=1), "b": self.make_task("b")}
+        )
+        self.assertEqual(results["a"], (1, "200ms"))
+        self.assertEqual(self.runs["a"], [False, True])
+        self.assertEqual(self.runs["b"], [False])
+
+
+class KeysetPaginatorTest(TestCase):
+    def setUp(self) -> None:
+        # The works tie on sacred_or_secular, so an ordering by it needs the id
+        for i in range(5):
+            baker.make(
+                "MusicalWork", variant_titles=[random_str()], sacred_or_secular=True
+            )
+        self.works = list(MusicalWork.objects.order_by("-id"))
+
+    def walk(self, paginator: Any) -> List[List[Any]]:
+        """Get every page by following the next cursors, then back to the first"""
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous():
+            backwards.append(paginator.get_page(backwards[-1].previous_cursor))
+        self.assertEqual(
+            [list(page) for page in reversed(backwards)], [list(page) for page in pages]
+        )
+        return [list(page) for page in pages]
+
+    def test_pages(self) -> None:
+        paginator = KeysetPaginator(MusicalWork.objects.all(), 2, ["-id"])
+        self.assertEqual(
+            self.walk(paginator),
+            [self.works[0:2], self.works[2:4], self.works[4:]],
+        )
+
+    def test_pages_with_ties(self) -> None:
+        queryset = MusicalWork.objects.all()
+        paginator = KeysetPaginator(queryset, 2, ["sacred_or_secular", "-id"])
+        pages = self.walk(paginator)
+        self.assertEqual(sum(pages, []), self.works)
+
+    def test_invalid_cursor(self) -> None:
+        paginator = KeysetPaginator(MusicalWork.objects.all(), 2, ["-id"])
+        with self.assertRaises(InvalidPage):
+            paginator.get_page("not a cursor")
+        with self.assertRaises(InvalidPage):
+            paginator.get_page(encode_cursor("next", [1, 2]))
+
+    def test_list_pages(self) -> None:
+        ids = [work.pk for work in self.works]
+        paginator = ListKeysetPaginator(ids, 2)
+        self.assertEqual(self.walk(paginator), [ids[0:2], ids[2:4], ids[4:]])
+        self.assertEqual(paginator.estimated_count, 5)
+        # The cursors of a page of works hold their ids
+        page = paginator.get_page()
+        page.object_list = self.works[0:2]
+        self.assertEqual(list(paginator.get_page(page.next_cursor)), ids[2:4])
+        with self.assertRaises(InvalidPage):
+            paginator.get_page(encode_cursor("next", [-1]))
+
+    def test_estimate_count(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE musical_work")
+        self.assertEqual(estimate_count(MusicalWork.objects.all()), 5)
+
+
+class FeatureMatrixTest(TestCase):
+    def setUp(self) -> None:
+        self.software = baker.make("Software")
+        self.scalar_type = baker.make(
+            "FeatureType", software=self.software, dimensions=1
+        )
+        self.histogram_type = baker.make(
+            "FeatureType", software=self.software, dimensions=2
+        )
+        self.files = [baker.make("File", _create_files=True) for i in range(3)]
+        self.features = [
+            baker.make(
+                "ExtractedFeature",
+                instance_of_feature=self.scalar_type,
+                feature_of=file,
+                value=[value],
+            )
+            for file, value in zip(self.files, (4.5, 7.0))
+        ]
+        # The last File has no value for the scalar feature
+        for file in self.files:
+            baker.make(
+                "ExtractedFeature",
+                instance_of_feature=self.histogram_type,
+                feature_of=file,
+                value=[1.0, 2.0],
+            )
+        FileFeatureVector.rebuild([file.id for file in self.files])
+        self.code = self.scalar_type.code
+
+    def test_load(self) -> None:
+        matrix = FeatureMatrix()
+        matrix.load()
+        self.assertEqual(list(matrix.columns), [self.code])
+        self.assertCountEqual(matrix.file_ids.tolist(), [f.id for f in self.files])
+        self.assertEqual(
+            matrix.filter([FeatureFilter(self.code, 4, 5)]), [self.files[0].id]
+        )
+        self.assertCountEqual(
+            matrix.filter([FeatureFilter(self.code, 0, 100)]),
+            [self.files[0].id, self.files[1].id],
+        )
+        self.assertEqual(matrix.filter([FeatureFilter("unknown", 0, 100)]), [])
+
+    def test_refresh(self) -> None:
+        matrix = FeatureMatrix()
+        matrix.load()
+        ExtractedFeature.objects.filter(pk=self.features[1].pk).update(value=[4.8])
+        FileFeatureVector.rebuild([self.files[1].id])
+        new_file = baker.make("File", _create_files=True)
+        baker.make(
+            "ExtractedFeature",
+            instance_of_feature=self.scalar_type,
+            feature_of=new_file,
+            value=[4.2],
+        )
+        FileFeatureVector.rebuild([new_file.id])
+        self.files.append(new_file)
+        matrix.refresh()
+        self.assertCountEqual(
+            matrix.filter([FeatureFilter(self.code, 4, 5)]),
+            [self.files[0].id, self.files[1].id, new_file.id],
+        )
+        self.assertEqual(len(matrix.file_ids), 4)
+
+    def test_refresh_with_new_feature_type(self) -> None:
+        matrix = FeatureMatrix()
+        matrix.load()
+        other_type = baker.make("FeatureType", software=self.software, dimensions=1)
+        matrix.refresh()
+        self.assertCountEqual(matrix.columns, [self.code, other_type.code])
+
+    @override_settings(CONTENT_SEARCH_ENGINE="memory")
+    def test_content_search(self) -> None:
+        request = RequestFactory().get("/search/", {self.code: "4,5"})
+        files = File.objects.filter(pk__in=[self.files[0].id, self.files[2].id])
+        # A new matrix for this test, not the one of the process
+        with mock.patch.object(feature_matrix, "_feature_matrix", None):
+            in_memory = SearchView().content_search(request, [self.code], files)
+            self.assertEqual(list(in_memory), [self.files[0]])
+        with override_settings(CONTENT_SEARCH_ENGINE="database"):
+            in_database = SearchView().content_search(request, [self.code], files)
+            self.assertEqual(list(in_database), [self.files[0]])
+
+    def tearDown(self) -> None:
+        """Delete the files that were uploaded when creating the test objects"""
+        for file in self.files:
+            os.remove(file.file.path)
+
+
+class NearestNeighbourIndexTest(TestCase):
+    def setUp(self) -> None:
+        random_state = np.random.RandomState(1)
+        self.vectors = random_state.standard_normal((500, 8)).astype(np.float32)
+        self.query = self.vectors[42] + 0.01
+
+    def test_brute_force(self) -> None:
+        rows, distances = BruteForceIndex(self.vectors).query(self.query, 5)
+        expected = np.argsort(np.linalg.norm(self.vectors - self.query, axis=1))[:5]
+        self.assertEqual(rows.tolist(), expected.tolist())
+        self.assertEqual(rows[0], 42)
+        self.assertTrue(np.all(np.diff(distances) >= 0))
+
+    def test_exclude(self) -> None:
+        rows, _ = BruteForceIndex(self.vectors).query(self.vectors[42], 3, exclude=42)
+        self.assertNotIn(42, rows.tolist())
+        self.assertEqual(len(rows), 3)
+
+    def test_random_projection(self) -> None:
+        index = RandomProjectionIndex(self.vectors, tables=8, bits=4)
+        rows, distances = index.query(self.query, 5)
+        # A near duplicate of a row lands in the bucket of the row in some table
+        self.assertEqual(rows[0], 42)
+        self.assertTrue(np.all(np.diff(distances) >= 0))
+        np.testing.assert_allclose(
+            distances, np.linalg.norm(self.vectors[rows] - self.query, axis=1)
+        )
+
+    def test_random_projection_falls_back_to_every_row(self) -> None:
+        index = RandomProjectionIndex(self.vectors, tables=1, bits=12)
+        # Too few rows share the single bucket of the query
+        self.assertEqual(len(index.candidates(self.query, 500)), 500)
+        _, distances = index.query(self.query, 499)
+        _, brute_distances = BruteForceIndex(self.vectors).query(self.query, 499)
+        np.testing.assert_allclose(distances, brute_distances)
+
+
+class SimilarityIndexTest(TestCase):
+    def setUp(self) -> None:
+        software = baker.make("Software")
+        self.scalar_type = baker.make("FeatureType", software=software, dimensions=1)
+        self.histogram_type = baker.make(
+            "FeatureType", software=software, dimensions=2
+        )
+        self.files = [baker.make("File", _create_files=True) for i in range(4)]
+        for file, scalar, histogram in zip(
+            self.files,
+            (1.0, 1.1, 5.0, 9.0),
+            ([0.5, 0.5], [0.4, 0.6], [0.9, 0.1], [0.0, 1.0]),
+        ):
+            self.make_features(file, scalar, histogram)
+        self.directory = tempfile.mkdtemp()
+
+    def make_features(self, file: File, scalar: float, histogram: List[float]) -> None:
+        baker.make(
+            "ExtractedFeature",
+            instance_of_feature=self.scalar_type,
+            feature_of=file,
+            value=[scalar],
+        )
+        baker.make(
+            "ExtractedFeature",
+            instance_of_feature=self.histogram_type,
+            feature_of=file,
+            value=histogram,
+        )
+
+    def test_similar_to(self) -> None:
+        index = SimilarityIndex.build()
+        self.assertEqual(index.backend, "brute")
+        similar = index.similar_to(self.files[0].id, k=2)
+        self.assertEqual(
+            [file_id for file_id, distance in similar],
+            [self.files[1].id, self.files[2].id],
+        )
+
+    def test_file_not_in_index(self) -> None:
+        index = SimilarityIndex.build()
+        new_file = baker.make("File", _create_files=True)
+        self.files.append(new_file)
+        self.make_features(new_file, 8.9, [0.0, 1.0])
+        self.assertEqual(index.similar_to(new_file.id, k=1)[0][0], self.files[3].id)
+
+    def test_save_and_load(self) -> None:
+        for backend in ("brute", "lsh"):
+            index = SimilarityIndex.build(backend)
+            path = os.path.join(self.directory, backend + ".npz")
+            index.save(path)
+            loaded = SimilarityIndex.load(path)
+            self.assertEqual(loaded.backend, backend)
+            self.assertIsInstance(loaded.index, type(index.index))
+            np.testing.assert_array_equal(loaded.file_ids, index.file_ids)
+            np.testing.assert_array_equal(loaded.vectors, index.vectors)
+            for file in self.files:
+                self.assertEqual(
+                    loaded.similar_to(file.id, k=3), index.similar_to(file.id, k=3)
+                )
+
+    def tearDown(self) -> None:
+        """Delete the files that were uploaded when creating the test objects"""
+        for file in self.files:
+            os.remove(file.file.path)
+        shutil.rmtree(self.directory)
@@ -0,0 +1,160 @@
+import json
+import os
+import uuid
+from typing import List, Tuple
+
+from django.test import RequestFactory, TestCase, override_settings
+from model_bakery import baker
+
+from database.models import *
+from database.utils import result_sets
+from database.utils.search_index import reindex_works
+from database.views.facets import Facet, FacetEngine, FacetValue
+from database.views.person import PersonListView
+from database.views.search import SearchView
+
+
+def random_str(length: int = 10) -> str:
+    return uuid.uuid4().hex.upper()[0:length]
+
+
+def facet_tuples(facet_values: List[FacetValue]) -> List[Tuple]:
+    return [(value.pk, value.display_name, value.count) for value in facet_values]
+
+
+class FacetEngineTest(TestCase):
+    def setUp(self) -> None:
+        genre_type = baker.make("GenreAsInType")
+        genre_style = baker.make("GenreAsInStyle")
+        instrument = baker.make("Instrument")
+        composer = baker.make("Person")
+        self.works = [
+            baker.make(
+                "MusicalWork",
+                variant_titles=[random_str()],
+                sacred_or_secular=sacred,
+            )
+            for sacred in (True, False, None)
+        ]
+        for work in self.works[:2]:
+            work.genres_as_in_type.add(genre_type)
+            baker.make(
+                "ContributionMusicalWork",
+                person=composer,
+                contributed_to_work=work,
+                role="COMPOSER",
+            )
+            baker.make("Part", musical_work=work, written_for=instrument)
+        self.works[0].genres_as_in_style.add(genre_style)
+        instantiation = baker.make("SourceInstantiation", work=self.works[0])
+        self.file = baker.make("File", _create_files=True, instantiates=instantiation)
+        WorkFileClosure.rebuild([self.works[0].pk])
+        self.work_ids = [work.pk for work in self.works]
+
+    def test_compute_matches_make_facet_values(self) -> None:
+        queryset = MusicalWork.objects.filter(pk__in=self.work_ids).values_list(
+            "pk", flat=True
+        )
+        for work_ids in (self.work_ids, queryset):
+            facets = [facet_class() for facet_class in Facet.registry.values()]
+            FacetEngine(facets).compute(work_ids)
+            for facet in facets:
+                expected = facet.make_facet_values(self.work_ids)
+                self.assertTrue(expected, facet.name)
+                self.assertCountEqual(
+                    facet_tuples(facet.facet_values), facet_tuples(expected)
+                )
+
+    def tearDown(self) -> None:
+        """Delete the file that was uploaded when creating the test objects"""
+        os.remove(self.file.file.path)
+
+
+@override_settings(TRIGRAM_SEARCH=False)
+class RankCandidatesTest(TestCase):
+    def setUp(self) -> None:
+        self.works = [
+            baker.make("MusicalWork", variant_titles=["Sonata " + random_str()])
+            for i in range(3)
+        ]
+        self.work_ids = sorted(work.pk for work in self.works)
+        reindex_works(self.work_ids)
+        self.view = SearchView()
+
+    def test_truncated_keeps_every_match(self) -> None:
+        works = self.view.keyword_search("sonata")
+        ranked, truncated = self.view.rank_candidates(works, "sonata", 2)
+        self.assertTrue(truncated)
+        ids = list(ranked.values_list("id", flat=True))
+        self.assertCountEqual(ids, self.work_ids)
+        # The first two matches in id order are ranked, the last one follows them
+        self.assertCountEqual(ids[:2], self.work_ids[:2])
+        self.assertEqual(ids[2], self.work_ids[2])
+        self.assertEqual(ranked.get(pk=self.work_ids[2]).rank, -1)
+        self.assertGreaterEqual(ranked.get(pk=self.work_ids[0]).rank, 0)
+
+    def test_not_truncated(self) -> None:
+        works = self.view.keyword_search("sonata")
+        ranked, truncated = self.view.rank_candidates(works, "sonata", 3)
+        self.assertFalse(truncated)
+        self.assertCountEqual(ranked.values_list("id", flat=True), self.work_ids)
+
+
+class AddSearchResultsToCartTest(TestCase):
+    def post(self, data: dict):
+        return self.client.post(
+            "/ajax/add_to_cart/", json.dumps(data), content_type="application/json"
+        )
+
+    def test_token(self) -> None:
+        token = result_sets.store_file_ids([3, 1, 2])
+        response = self.post({"search_results_token": token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session["cart"], [1, 2, 3])
+
+    def test_expired_token(self) -> None:
+        response = self.post({"search_results_token": "expired"})
+        self.assertEqual(response.status_code, 410)
+        self.assertFalse(self.client.session.get("cart"))
+
+    def test_file_ids(self) -> None:
+        response = self.post({"search_results_file_ids": [3, 1, 3]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session["cart"], [3, 1])
+
+    def test_search_page_carries_token(self) -> None:
+        response = self.client.get("/search/")
+        token = response.context["file_ids_token"]
+        self.assertNotIn("file_ids_json", response.context)
+        self.assertIsNotNone(result_sets.load_file_ids(token))
+
+
+@override_settings(TRIGRAM_SEARCH=True)
+class KeysetTrigramSearchTest(TestCase):
+    def setUp(self) -> None:
+        self.persons = [
+            baker.make("Person", given_name="Giovanni", surname=surname)
+            for surname in ("Palestrino", "Palestrina", "Palestrino")
+        ]
+        request = RequestFactory().get(
+            "/persons/", {"q": "palestrina", "pagination": "keyset"}
+        )
+        self.view = PersonListView()
+        self.view.setup(request)
+
+    def test_pages_stay_ranked(self) -> None:
+        queryset = self.view.get_queryset()
+        self.assertEqual(
+            self.view.get_keyset_ordering(queryset), ["-similarity", "surname", "id"]
+        )
+        paginator, page, object_list, is_paginated = self.view.paginate_queryset(
+            queryset, 1
+        )
+        persons = list(page)
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            persons.extend(page)
+        self.assertEqual(persons[0], self.persons[1])
+        self.assertCountEqual(persons, self.persons)
+        similarities = [person.similarity for person in persons]
+        self.assertEqual(similarities, sorted(similarities, reverse=True))
@@ -63,6 +63,9 @@ urlpatterns = [
     ),
     path("files/", FileListView.as_view(), name="file-list"),
     path("files/<int:pk>", FileDetailView.as_view(), name="file-detail"),
+    path(
+        "files/<int:pk>/similar", SimilarFilesView.as_view(), name="file-similar"
+    ),
     path("styles/", GenreAsInStyleListView.as_view(), name="genreasinstyle-detail"),
     path(
         "styles/<int:pk>",
@@ -132,4 +135,5 @@ urlpatterns = [
     path("ajax/add_to_cart/", add_to_cart, name="add-to-cart"),
     path("ajax/remove_from_cart/", remove_from_cart, name="remove-from-cart"),
     path("ajax/clear_cart/", clear_cart, name="clear-cart"),
+    path("ajax/suggest/", suggest, name="suggest"),
 ]
@@ -0,0 +1,43 @@
+"""SQL objects that cannot be declared on the models
+
+Migrations are generated locally with ``makemigrations``, so indexes and extensions
+that Django cannot express in ``Meta.indexes`` are kept here and created by the
+``post_migrate`` receiver in the signals module. Every statement must be idempotent.
+"""
+from typing import List
+from django.db import connections
+
+EXTRA_SQL: List[str] = [
+    # Lets the min and max of one dimensional features be read from an index
+    "CREATE INDEX IF NOT EXISTS extracted_feature_scalar_value_idx "
+    "ON extracted_feature (instance_of_feature_id, (value[1]))",
+    # Fuzzy search of titles and person names, see database/utils/trigram.py
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE OR REPLACE FUNCTION simssadb_titles(text[]) RETURNS text "
+    "LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ SELECT array_to_string($1, ' ') $$",
+    "CREATE OR REPLACE FUNCTION simssadb_person_name(text, text) RETURNS text "
+    "LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ SELECT $1 || ' ' || $2 $$",
+    "CREATE INDEX IF NOT EXISTS musical_work_titles_trgm_idx ON musical_work "
+    "USING gin (simssadb_titles(variant_titles) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS person_name_trgm_idx ON person "
+    "USING gin (simssadb_person_name(given_name, surname) gin_trgm_ops)",
+    # Lets the dates of the contributions in a role be probed with a single index
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    "CREATE INDEX IF NOT EXISTS contribution_role_date_range_idx "
+    "ON contribution_musical_work USING gist (role, date_range_year_only)",
+    # The version of the cached search results, see database/utils/search_cache.py
+    "CREATE SEQUENCE IF NOT EXISTS search_cache_version",
+]
+
+
+def create_extra_sql(using: str = "default") -> None:
+    """Run all the statements in EXTRA_SQL
+
+    Parameters
+    ----------
+    using : str
+        The alias of the database to run the statements on
+    """
+    with connections[using].cursor() as cursor:
+        for statement in EXTRA_SQL:
+            cursor.execute(statement)
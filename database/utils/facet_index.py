@@ -0,0 +1,290 @@
+"""An in-memory index of the facet values of Musical Works as bitmaps
+
+Counting the values of every facet in SQL costs tens of milliseconds per search
+under load. The FacetIndex keeps one bitmap of Musical Works per facet value, as a
+NumPy array of little-endian uint64 words where the bit of a row is set if the work
+of that row has the value. Filtering by the selected values is then OR-ing and
+AND-ing bitmaps, and counting a value among the matched works is a popcount of the
+AND of two bitmaps.
+
+The bitmaps are built from the WorkSearchProjection table. Each process holds its
+own index, loaded on first use. The works reindexed by this process are read back
+on the next use, and the rows updated by other processes are read back at most
+every FACET_INDEX_REFRESH_SECONDS. A deleted work keeps its bits, which is harmless
+since the matched works of a search never include it.
+
+Values are keyed by their text, which is how the search form sends the selected
+values back. Unlike the FacetEngine, the FileFormatFacet counts Musical Works and
+not Files.
+"""
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+import numpy as np
+from django.conf import settings
+from django.db.models import QuerySet
+from database.models import WorkSearchProjection
+from database.utils.feature_matrix import REFRESH_OVERLAP
+from database.views.facets import Facet, FacetValue
+
+# The number of bits set in each byte
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+WORD = np.dtype("<u8")
+
+
+def popcount(bitmap: np.ndarray) -> int:
+    return int(POPCOUNT[bitmap.view(np.uint8)].sum(dtype=np.int64))
+
+
+class FacetIndex(object):
+    """A bitmap of Musical Works per value of every facet
+
+    Attributes
+    ----------
+    work_ids : np.ndarray
+        The id of the Musical Work of each row
+
+    bitmaps : Dict[str, Dict[str, np.ndarray]]
+        The bitmap of each value of each facet, keyed by the name of the facet
+        and the text of the value
+
+    values : Dict[str, Dict[str, Any]]
+        The value of each key of the bitmaps
+
+    names : Dict[str, Dict[str, str]]
+        The display name of each key of the bitmaps
+    """
+
+    def __init__(self) -> None:
+        self.fields: Dict[str, str] = {
+            name: facet_class.projection_field
+            for name, facet_class in Facet.registry.items()
+        }
+        self.work_ids = np.empty(0, dtype=np.int64)
+        self.rows: Dict[int, int] = {}
+        self.words = 0
+        self.bitmaps: Dict[str, Dict[str, np.ndarray]] = {}
+        self.values: Dict[str, Dict[str, Any]] = {}
+        self.names: Dict[str, Dict[str, str]] = {}
+        # The keys set for each row, to clear them when the row is updated
+        self.row_keys: Dict[int, Dict[str, List[str]]] = {}
+        self.sorted_ids = np.empty(0, dtype=np.int64)
+        self.sorted_rows = np.empty(0, dtype=np.int64)
+        self.stale: Set[int] = set()
+        self.loaded = False
+        self.loaded_until = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """Read the whole WorkSearchProjection table"""
+        rows_by_key: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+        work_ids: List[int] = []
+        self.rows = {}
+        self.row_keys = {}
+        self.values = {name: {} for name in self.fields}
+        self.loaded_until = None
+        for work_id, keys in self._read(WorkSearchProjection.objects.all()):
+            row = len(work_ids)
+            work_ids.append(work_id)
+            self.rows[work_id] = row
+            self.row_keys[row] = keys
+            for name, facet_keys in keys.items():
+                for key in facet_keys:
+                    rows_by_key[(name, key)].append(row)
+
+        self.work_ids = np.array(work_ids, dtype=np.int64)
+        self.words = max((len(work_ids) + 63) // 64, 1)
+        self.bitmaps = {name: {} for name in self.fields}
+        for (name, key), rows in rows_by_key.items():
+            self.bitmaps[name][key] = self._pack(np.array(rows, dtype=np.int64))
+        self._sort()
+        self.load_names()
+        self.stale = set()
+        self.loaded = True
+
+    def load_names(self) -> None:
+        """Read the display names of the values of every facet"""
+        for name, facet_class in Facet.registry.items():
+            self.names[name] = {
+                str(pk): display_name
+                for pk, display_name in facet_class().display_names()
+            }
+
+    def refresh(self) -> None:
+        """Read the rows updated since the last load or refresh"""
+        if not self.loaded:
+            self.load()
+            return
+        if self.loaded_until is not None:
+            self._update(
+                WorkSearchProjection.objects.filter(
+                    updated__gte=self.loaded_until - REFRESH_OVERLAP
+                )
+            )
+        self.load_names()
+
+    def mark_stale(self, work_ids: Iterable[int]) -> None:
+        """Read back the rows of some works on the next use of the index"""
+        if self.loaded:
+            with self.lock:
+                self.stale.update(work_ids)
+
+    def _read(
+        self, projections: QuerySet
+    ) -> Iterable[Tuple[int, Dict[str, List[str]]]]:
+        fields = list(self.fields.items())
+        for work_id, *columns, updated in projections.values_list(
+            "work_id", *[field for _, field in fields], "updated"
+        ).iterator():
+            keys: Dict[str, List[str]] = {}
+            for (name, _), column in zip(fields, columns):
+                facet_values = column if isinstance(column, list) else [column]
+                keys[name] = []
+                for value in facet_values:
+                    key = str(value)
+                    self.values[name][key] = value
+                    keys[name].append(key)
+            if self.loaded_until is None or updated > self.loaded_until:
+                self.loaded_until = updated
+            yield work_id, keys
+
+    def _update(self, projections: QuerySet) -> None:
+        new_work_ids: List[int] = []
+        for work_id, keys in self._read(projections):
+            row = self.rows.get(work_id)
+            if row is None:
+                row = len(self.rows)
+                self.rows[work_id] = row
+                new_work_ids.append(work_id)
+                self._grow(len(self.rows))
+            else:
+                self._set_row(row, self.row_keys[row], False)
+            self._set_row(row, keys, True)
+            self.row_keys[row] = keys
+        if new_work_ids:
+            self.work_ids = np.concatenate(
+                [self.work_ids, np.array(new_work_ids, dtype=np.int64)]
+            )
+            self._sort()
+
+    def _set_row(self, row: int, keys: Dict[str, List[str]], on: bool) -> None:
+        word, bit = row >> 6, np.uint64(1 << (row & 63))
+        for name, facet_keys in keys.items():
+            for key in facet_keys:
+                bitmap = self.bitmaps[name].get(key)
+                if bitmap is None:
+                    bitmap = self.bitmaps[name][key] = np.zeros(self.words, WORD)
+                if on:
+                    bitmap[word] |= bit
+                else:
+                    bitmap[word] &= ~bit
+
+    def _grow(self, row_count: int) -> None:
+        if row_count <= self.words * 64:
+            return
+        words = max(self.words * 2, (row_count + 63) // 64)
+        padding = np.zeros(words - self.words, WORD)
+        for bitmaps in self.bitmaps.values():
+            for key, bitmap in bitmaps.items():
+                bitmaps[key] = np.concatenate([bitmap, padding])
+        self.words = words
+
+    def _sort(self) -> None:
+        self.sorted_rows = np.argsort(self.work_ids)
+        self.sorted_ids = self.work_ids[self.sorted_rows]
+
+    def _pack(self, rows: np.ndarray) -> np.ndarray:
+        """Make a bitmap with the bits of some rows set"""
+        mask = np.zeros(self.words * 64, dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask, bitorder="little").view(WORD)
+
+    def to_bitmap(self, work_ids: Union[QuerySet, Iterable[int]]) -> np.ndarray:
+        """Make a bitmap of some Musical Works"""
+        if isinstance(work_ids, QuerySet):
+            work_ids = work_ids.values_list("id", flat=True)
+        ids = np.fromiter(work_ids, dtype=np.int64)
+        if not len(self.sorted_ids):
+            return np.zeros(self.words, WORD)
+        positions = np.searchsorted(self.sorted_ids, ids)
+        positions[positions >= len(self.sorted_ids)] = 0
+        found = self.sorted_ids[positions] == ids
+        return self._pack(self.sorted_rows[positions[found]])
+
+    def to_work_ids(self, bitmap: np.ndarray) -> List[int]:
+        mask = np.unpackbits(bitmap.view(np.uint8), bitorder="little").astype(bool)
+        return self.work_ids[mask[: len(self.work_ids)]].tolist()
+
+    def select(self, facet: Facet) -> Optional[np.ndarray]:
+        """Get the bitmap of the works with any of the selected values of a facet"""
+        if not facet.selected:
+            return None
+        result = np.zeros(self.words, WORD)
+        for key in facet.selected:
+            bitmap = self.bitmaps.get(facet.name, {}).get(str(key))
+            if bitmap is not None:
+                result |= bitmap
+        return result
+
+    def count(self, facet: Facet, matched: np.ndarray) -> List[FacetValue]:
+        """Count the matched works for each value of a facet, most frequent first"""
+        facet_values = []
+        names = self.names.get(facet.name, {})
+        for key, bitmap in self.bitmaps.get(facet.name, {}).items():
+            count = popcount(bitmap & matched)
+            if count:
+                value = self.values[facet.name][key]
+                facet_values.append(FacetValue(value, names.get(key, key), count))
+        facet_values.sort(key=lambda facet_value: -facet_value.count)
+        return facet_values
+
+    def ensure_fresh(self) -> None:
+        """Refresh the index if it is due and read back the stale rows"""
+        now = time.monotonic()
+        interval = getattr(settings, "FACET_INDEX_REFRESH_SECONDS", 30)
+        if not self.loaded or now - self.checked_at > interval:
+            self.refresh()
+            self.checked_at = now
+        if self.stale:
+            stale, self.stale = self.stale, set()
+            self._update(WorkSearchProjection.objects.filter(work_id__in=stale))
+
+    def filter(self, facets: List[Facet]) -> Optional[List[int]]:
+        """Get the ids of the works with a selected value of every facet
+
+        Returns
+        -------
+        Optional[List[int]]
+            The ids of the works, or None if no value is selected
+        """
+        with self.lock:
+            self.ensure_fresh()
+            result = None
+            for facet in facets:
+                selection = self.select(facet)
+                if selection is not None:
+                    result = selection if result is None else result & selection
+            return None if result is None else self.to_work_ids(result)
+
+    def compute(
+        self, facets: List[Facet], work_ids: Union[QuerySet, Iterable[int]]
+    ) -> None:
+        """Set the ``facet_values`` of some facets, as FacetEngine.compute does"""
+        with self.lock:
+            self.ensure_fresh()
+            matched = self.to_bitmap(work_ids)
+            for facet in facets:
+                facet.facet_values = self.count(facet, matched)
+
+
+_facet_index: Optional[FacetIndex] = None
+
+
+def get_facet_index() -> FacetIndex:
+    """Get the FacetIndex of this process"""
+    global _facet_index
+    if _facet_index is None:
+        _facet_index = FacetIndex()
+    return _facet_index
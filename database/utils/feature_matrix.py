@@ -0,0 +1,164 @@
+"""An in-memory engine for content search over one dimensional feature values
+
+Dragging a slider on the search page re-runs the content search, and going to the
+database for every change is too slow to feel interactive. The FeatureMatrix keeps
+a copy of the FileFeatureVector table in a NumPy float32 matrix with one row per
+File and one column per FeatureType, and evaluates range filters as boolean masks.
+
+Each process holds its own matrix, loaded on first use. Afterwards only the rows
+rebuilt since the last refresh are read back, at most every
+FEATURE_MATRIX_REFRESH_SECONDS, so newly parsed features show up without reloading
+the whole table.
+"""
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from django.conf import settings
+from django.db.models import QuerySet
+from database.models import FeatureType, FileFeatureVector
+
+# Rows committed by concurrent transactions can have an earlier timestamp than rows
+# already read, so every refresh reads back a little further than the last one
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+
+class FeatureMatrix(object):
+    """A files x features matrix of the values of one dimensional features
+
+    Missing values are stored as NaN, which fails every range predicate, so a File
+    without a feature never matches a filter on it, as in the database.
+
+    Attributes
+    ----------
+    columns : Dict[str, int]
+        The column of each FeatureType, keyed by its code
+
+    file_ids : np.ndarray
+        The id of the File of each row
+
+    values : np.ndarray
+        The float32 matrix of the feature values
+    """
+
+    def __init__(self) -> None:
+        self.columns: Dict[str, int] = {}
+        self.feature_type_ids: List[int] = []
+        self.file_ids = np.empty(0, dtype=np.int64)
+        self.values = np.empty((0, 0), dtype=np.float32)
+        self.rows: Dict[int, int] = {}
+        self.loaded = False
+        self.loaded_until = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """Read the whole FileFeatureVector table"""
+        feature_types = FeatureType.objects.filter(dimensions=1).order_by("id")
+        self.feature_type_ids = []
+        self.columns = {}
+        for column, (pk, code) in enumerate(feature_types.values_list("id", "code")):
+            self.feature_type_ids.append(pk)
+            self.columns[code] = column
+        self.file_ids = np.empty(0, dtype=np.int64)
+        self.values = np.empty((0, len(self.columns)), dtype=np.float32)
+        self.rows = {}
+        self.loaded_until = None
+        self._update(FileFeatureVector.objects.all())
+        self.loaded = True
+
+    def refresh(self) -> None:
+        """Read the rows rebuilt since the last load or refresh
+
+        The whole table is read again if FeatureTypes were added, since the columns
+        of the matrix change.
+        """
+        feature_type_count = FeatureType.objects.filter(dimensions=1).count()
+        if not self.loaded or feature_type_count != len(self.columns):
+            self.load()
+        elif self.loaded_until is not None:
+            self._update(
+                FileFeatureVector.objects.filter(
+                    updated__gte=self.loaded_until - REFRESH_OVERLAP
+                )
+            )
+
+    def _update(self, vectors: QuerySet) -> None:
+        new_file_ids: List[int] = []
+        new_rows: List[List[float]] = []
+        for file_id, values, updated in vectors.values_list(
+            "file_id", "values", "updated"
+        ).iterator():
+            row = [
+                values[pk - 1]
+                if pk <= len(values) and values[pk - 1] is not None
+                else np.nan
+                for pk in self.feature_type_ids
+            ]
+            index = self.rows.get(file_id)
+            if index is None:
+                self.rows[file_id] = len(self.rows)
+                new_file_ids.append(file_id)
+                new_rows.append(row)
+            else:
+                self.values[index] = row
+            if self.loaded_until is None or updated > self.loaded_until:
+                self.loaded_until = updated
+
+        if new_rows:
+            self.file_ids = np.concatenate(
+                [self.file_ids, np.array(new_file_ids, dtype=np.int64)]
+            )
+            self.values = np.vstack(
+                [
+                    self.values,
+                    np.array(new_rows, dtype=np.float32).reshape(
+                        -1, len(self.columns)
+                    ),
+                ]
+            )
+
+    def filter(self, feature_filters: Iterable) -> List[int]:
+        """Get the ids of the Files matching all of some FeatureFilters
+
+        Parameters
+        ----------
+        feature_filters : Iterable[FeatureFilter]
+            The filters, each with the code of a FeatureType and an inclusive range
+
+        Returns
+        -------
+        List[int]
+            The ids of the matching Files
+        """
+        mask = np.ones(len(self.file_ids), dtype=bool)
+        for feature_filter in feature_filters:
+            column = self.columns.get(feature_filter.code)
+            if column is None:
+                return []
+            values = self.values[:, column]
+            mask &= values >= float(feature_filter.min_val)
+            mask &= values <= float(feature_filter.max_val)
+        return self.file_ids[mask].tolist()
+
+    def search(self, feature_filters: Iterable) -> List[int]:
+        """Refresh the matrix if it is due and filter it"""
+        with self.lock:
+            now = time.monotonic()
+            interval = getattr(settings, "FEATURE_MATRIX_REFRESH_SECONDS", 30)
+            if not self.loaded or now - self.checked_at > interval:
+                self.refresh()
+                self.checked_at = now
+            return self.filter(feature_filters)
+
+
+_feature_matrix: Optional[FeatureMatrix] = None
+
+
+def get_feature_matrix() -> FeatureMatrix:
+    """Get the FeatureMatrix of this process"""
+    global _feature_matrix
+    if _feature_matrix is None:
+        _feature_matrix = FeatureMatrix()
+    return _feature_matrix
@@ -0,0 +1,300 @@
+"""Keyset (cursor based) pagination for large QuerySets
+
+Offset pagination with Django's Paginator counts every row of the QuerySet and then
+scans and discards all the rows before the requested page, so deep pages get
+slower as the table grows. Keyset pagination instead remembers the ordering values
+of the last row of a page in an opaque cursor and asks the database for the rows
+that come after it, which costs the same for every page.
+
+A list of ids, such as a cached search result, is paged with the same cursors by
+ListKeysetPaginator.
+"""
+import base64
+import binascii
+import json
+from typing import Any, List, Optional, Tuple
+from django.conf import settings
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.http import Http404, HttpRequest
+
+
+def get_pagination_mode(request: HttpRequest) -> str:
+    """Get the pagination mode of a request, either "offset" or "keyset"
+
+    The mode can be chosen per request with the ``pagination`` GET parameter and
+    defaults to the PAGINATION_MODE setting.
+    """
+    default = getattr(settings, "PAGINATION_MODE", "offset")
+    return request.GET.get("pagination", default)
+
+
+def encode_cursor(direction: str, values: List[Any]) -> str:
+    """Encode a direction ("next" or "previous") and ordering values as a cursor"""
+    data = json.dumps({"d": direction, "v": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, List[Any]]:
+    """Decode a cursor made by encode_cursor
+
+    Raises
+    ------
+    InvalidPage
+        If the cursor is not a valid cursor
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        direction, values = data["d"], data["v"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidPage("Invalid cursor")
+    if direction not in ("next", "previous") or not isinstance(values, list):
+        raise InvalidPage("Invalid cursor")
+    return direction, values
+
+
+def estimate_count(queryset: QuerySet) -> int:
+    """Get the number of rows of a QuerySet as estimated by the PostgreSQL planner
+
+    This is much cheaper than ``count()`` on large or ranked QuerySets but can be
+    off, so it should only be displayed as an approximation.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class KeysetPage(object):
+    """A page of results from a KeysetPaginator
+
+    Iterating over the page yields the objects of the page in order.
+    """
+
+    is_keyset = True
+
+    def __init__(
+        self,
+        object_list: List[Any],
+        paginator: "KeysetPaginator",
+        has_next: bool,
+        has_previous: bool,
+    ) -> None:
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def has_next(self) -> bool:
+        return self._has_next
+
+    def has_previous(self) -> bool:
+        return self._has_previous
+
+    def has_other_pages(self) -> bool:
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        if not self._has_next:
+            return None
+        return encode_cursor("next", self.paginator.get_values(self.object_list[-1]))
+
+    @property
+    def previous_cursor(self) -> Optional[str]:
+        if not self._has_previous:
+            return None
+        return encode_cursor(
+            "previous", self.paginator.get_values(self.object_list[0])
+        )
+
+
+class KeysetPaginator(object):
+    """Paginates a QuerySet by seeking past the ordering values of a cursor
+
+    Parameters
+    ----------
+    queryset : QuerySet
+        The QuerySet to paginate
+    per_page : int
+        The number of objects in a page
+    ordering : List[str]
+        The fields to order by, with a leading "-" for descending order, as in
+        ``order_by()``. The ordering must be unique, so the last field should
+        be the primary key. Annotations can be used as long as they are not null.
+    """
+
+    is_keyset = True
+
+    def __init__(self, queryset: QuerySet, per_page: int, ordering: List[str]) -> None:
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = ordering
+
+    @property
+    def estimated_count(self) -> int:
+        return estimate_count(self.queryset.order_by())
+
+    def get_values(self, obj: Any) -> List[Any]:
+        """Get the values of the ordering fields of an object"""
+        values = []
+        for field in self.ordering:
+            value = obj
+            for attribute in field.lstrip("-").split("__"):
+                value = getattr(value, attribute)
+            values.append(value)
+        return values
+
+    def _seek(self, values: List[Any], forward: bool) -> Q:
+        # (a, b) > (x, y) is expanded to a > x OR (a = x AND b > y) so that each
+        # field can have its own direction
+        if len(values) != len(self.ordering):
+            raise InvalidPage("Invalid cursor")
+        seek = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            descending = field.startswith("-")
+            lookup = "lt" if descending == forward else "gt"
+            seek |= equal & Q(**{"{0}__{1}".format(name, lookup): value})
+            equal &= Q(**{name: value})
+        return seek
+
+    def get_page(self, cursor: Optional[str] = None) -> KeysetPage:
+        """Get the page that a cursor points to, or the first page if there is none
+
+        Raises
+        ------
+        InvalidPage
+            If the cursor is not a valid cursor
+        """
+        if not cursor:
+            objects = list(self.queryset.order_by(*self.ordering)[: self.per_page + 1])
+            has_next = len(objects) > self.per_page
+            return KeysetPage(objects[: self.per_page], self, has_next, False)
+
+        direction, values = decode_cursor(cursor)
+        if direction == "next":
+            queryset = self.queryset.filter(self._seek(values, forward=True))
+            objects = list(queryset.order_by(*self.ordering)[: self.per_page + 1])
+            has_next = len(objects) > self.per_page
+            return KeysetPage(objects[: self.per_page], self, has_next, True)
+
+        # Going backwards, read the page in reverse order and flip it
+        reverse_ordering = [
+            field[1:] if field.startswith("-") else "-" + field
+            for field in self.ordering
+        ]
+        queryset = self.queryset.filter(self._seek(values, forward=False))
+        objects = list(queryset.order_by(*reverse_ordering)[: self.per_page + 1])
+        has_previous = len(objects) > self.per_page
+        objects = objects[: self.per_page]
+        objects.reverse()
+        return KeysetPage(objects, self, True, has_previous)
+
+
+class ListKeysetPaginator(object):
+    """Paginates a list of ids with the cursors of a KeysetPaginator
+
+    The cursors hold the id of the first or last object of a page, which is looked
+    up in the list, so they stay valid if the list is computed again.
+
+    Parameters
+    ----------
+    ids : List[int]
+        The ids to paginate, in order
+    per_page : int
+        The number of ids in a page
+    """
+
+    is_keyset = True
+
+    def __init__(self, ids: List[int], per_page: int) -> None:
+        self.ids = ids
+        self.per_page = int(per_page)
+
+    @property
+    def estimated_count(self) -> int:
+        return len(self.ids)
+
+    def get_values(self, obj: Any) -> List[Any]:
+        """Get the id of an object of a page, which is either an id or a model"""
+        return [getattr(obj, "pk", obj)]
+
+    def get_page(self, cursor: Optional[str] = None) -> KeysetPage:
+        """Get the page of ids that a cursor points to, or the first page
+
+        Raises
+        ------
+        InvalidPage
+            If the cursor is not a valid cursor or its id is not in the list
+        """
+        start = 0
+        if cursor:
+            direction, values = decode_cursor(cursor)
+            try:
+                (value,) = values
+                index = self.ids.index(value)
+            except ValueError:
+                raise InvalidPage("Invalid cursor")
+            if direction == "next":
+                start = index + 1
+            else:
+                start = max(index - self.per_page, 0)
+        end = start + self.per_page
+        return KeysetPage(self.ids[start:end], self, end < len(self.ids), start > 0)
+
+
+class KeysetPaginationMixin:
+    """Adds a keyset pagination mode to a ListView
+
+    Views using this mixin must define ``keyset_ordering``. When the pagination mode
+    of the request is "keyset", the page is selected with the ``cursor`` GET
+    parameter instead of ``page`` and the page is added to the context as
+    ``keyset_page``.
+    """
+
+    keyset_ordering: List[str] = ["id"]
+
+    def get_keyset_ordering(self, queryset: QuerySet) -> List[str]:
+        """Get the keyset, led by the annotations the QuerySet is ordered by
+
+        A text search orders the objects by an annotation such as their trigram
+        similarity, which is kept ahead of ``keyset_ordering`` so that the pages
+        stay ranked.
+        """
+        ranking = [
+            field
+            for field in queryset.query.order_by
+            if isinstance(field, str)
+            and field.lstrip("-") in queryset.query.annotations
+        ]
+        return ranking + self.keyset_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        if get_pagination_mode(self.request) != "keyset":
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(
+            queryset, page_size, self.get_keyset_ordering(queryset)
+        )
+        try:
+            page = paginator.get_page(self.request.GET.get("cursor"))
+        except InvalidPage as e:
+            raise Http404(str(e))
+        self.keyset_page = page
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["keyset_page"] = getattr(self, "keyset_page", None)
+        return context
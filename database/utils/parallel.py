@@ -0,0 +1,82 @@
+"""Running independent aggregate queries of a search concurrently
+
+The facet counts and the bounds of the feature sliders of a search do not depend
+on each other, so with FACET_BACKEND set to "parallel" they are sent to the
+database at the same time, from a bounded pool of threads. Django gives each
+thread its own connection, which is closed once its query is done, and every
+query is cut off by a statement_timeout.
+
+The queries that fail or do not finish within PARALLEL_QUERY_TIMEOUT are run again
+serially on the connection of the caller, still cut off by the statement_timeout,
+and the results of the others are kept. If the caller is inside a transaction whose
+uncommitted rows the other connections cannot see, all the queries are run serially
+on its connection instead.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict
+from django.conf import settings
+from django.db import connection, transaction
+
+
+def run_serially(tasks: Dict[str, Callable[[], Any]]) -> Dict[str, Any]:
+    return {name: task() for name, task in tasks.items()}
+
+
+def _run_with_timeout(
+    tasks: Dict[str, Callable[[], Any]], timeout: float
+) -> Dict[str, Any]:
+    """Run some functions serially, in a transaction with a statement_timeout"""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Only lasts until the end of the transaction
+            cursor.execute("SET LOCAL statement_timeout = %s", [int(timeout * 1000)])
+        return run_serially(tasks)
+
+
+def _run_on_own_connection(task: Callable[[], Any], timeout: float) -> Any:
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SET statement_timeout = %s", [int(timeout * 1000)])
+        return task()
+    finally:
+        # The connection belongs to this worker thread only
+        connection.close()
+
+
+def run_in_parallel(tasks: Dict[str, Callable[[], Any]]) -> Dict[str, Any]:
+    """Run some functions that query the database concurrently
+
+    Parameters
+    ----------
+    tasks : Dict[str, Callable[[], Any]]
+        The functions to run, keyed by name
+
+    Returns
+    -------
+    Dict[str, Any]
+        The result of each function, keyed by the name of the function
+    """
+    workers = min(getattr(settings, "PARALLEL_QUERY_WORKERS", 4), len(tasks))
+    timeout = getattr(settings, "PARALLEL_QUERY_TIMEOUT", 5)
+    if workers <= 1 or connection.in_atomic_block:
+        return run_serially(tasks)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            name: executor.submit(_run_on_own_connection, task, timeout)
+            for name, task in tasks.items()
+        }
+        done, not_done = wait(futures.values(), timeout=timeout)
+        results = {
+            name: future.result()
+            for name, future in futures.items()
+            if future in done and future.exception() is None
+        }
+        remaining = {name: task for name, task in tasks.items() if name not in results}
+        if remaining:
+            results.update(_run_with_timeout(remaining, timeout))
+        return results
+    finally:
+        # Does not wait for queries that timed out, the statement_timeout ends them
+        executor.shutdown(wait=False)
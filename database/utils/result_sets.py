@@ -0,0 +1,76 @@
+"""Server-side storage of the Files matched by a search, referenced by a short token
+
+A broad search matches tens of thousands of Files. Rather than shipping their ids
+to the browser and back when they are added to the cart, the ids are stored in the
+"result_sets" cache and the page only carries a token.
+
+The ids are stored sorted, as the zlib compressed differences between consecutive
+ids, which are small numbers that compress well. The token is a digest of that
+data, so storing the same set twice yields the same token and a single entry.
+
+The cart may be updated by another process than the one that rendered the page, so
+tokens are only used with a cache backend shared by all the processes. With a
+local-memory cache the page still carries the ids, see ``is_shared``.
+"""
+import hashlib
+import zlib
+from array import array
+from typing import Iterable, List, Optional
+from django.conf import settings
+from django.core.cache import caches
+
+CACHE_ALIAS = "result_sets"
+# The backends whose entries are only seen by the process that stored them
+LOCAL_BACKENDS = [
+    "django.core.cache.backends.dummy.DummyCache",
+    "django.core.cache.backends.locmem.LocMemCache",
+]
+
+
+def pack(file_ids: Iterable[int]) -> bytes:
+    """Encode ids as the compressed differences of their sorted unique values"""
+    deltas = array("L")
+    previous = 0
+    for file_id in sorted(set(file_ids)):
+        deltas.append(file_id - previous)
+        previous = file_id
+    return zlib.compress(deltas.tobytes())
+
+
+def unpack(data: bytes) -> List[int]:
+    """Decode ids encoded by pack(), in ascending order"""
+    deltas = array("L")
+    deltas.frombytes(zlib.decompress(data))
+    file_ids = []
+    current = 0
+    for delta in deltas:
+        current += delta
+        file_ids.append(current)
+    return file_ids
+
+
+def make_token(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:24]
+
+
+def is_shared() -> bool:
+    """Whether the result sets cache is shared by all the processes"""
+    backend = settings.CACHES.get(CACHE_ALIAS, {}).get("BACKEND")
+    return backend is not None and backend not in LOCAL_BACKENDS
+
+
+def store_file_ids(file_ids: Iterable[int]) -> str:
+    """Store a set of File ids and get the token that references it"""
+    data = pack(file_ids)
+    token = make_token(data)
+    # Unlike add(), restarts the timeout of a set that is already stored
+    caches[CACHE_ALIAS].set(token, data)
+    return token
+
+
+def load_file_ids(token: str) -> Optional[List[int]]:
+    """Get the File ids referenced by a token, or None if they expired"""
+    data = caches[CACHE_ALIAS].get(str(token))
+    if data is None:
+        return None
+    return unpack(data)
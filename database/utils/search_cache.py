@@ -0,0 +1,121 @@
+"""A cache of search results keyed by the normalized parameters of the search
+
+Users re-issue identical searches when toggling facets, paginating or navigating
+back. Each cached SearchResult holds everything that is expensive to compute for a
+search: the ordered ids of the matching Musical Works, the ids of the matching
+Files, the facet values and the bounds of the feature sliders.
+
+Entries are stored in the "search" cache, whose backend evicts the least recently
+used entries. Every key includes a version number that is bumped whenever a
+MusicalWork, File or ExtractedFeature is saved or deleted, or search documents are
+recomputed by reindex_works, so stale results are never read back and simply age
+out of the cache.
+
+The version is a PostgreSQL sequence rather than a cache entry. Features are
+extracted and documents reindexed by Celery workers, whose bumps have to reach
+every web process, including those that keep their results in a local-memory
+cache.
+"""
+import hashlib
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.http import QueryDict
+
+CACHE_ALIAS = "search"
+# Created by EXTRA_SQL, see database/utils/db_utils.py
+VERSION_SEQUENCE = "search_cache_version"
+# Parameters that select a page of a result and not the result itself
+PAGINATION_PARAMETERS = ["page", "cursor", "pagination"]
+
+
+class SearchResult(object):
+    """The cacheable outcome of a search
+
+    Attributes
+    ----------
+    work_ids : List[int]
+        The ids of the matching Musical Works, in the order they are displayed
+
+    file_ids : List[int]
+        The ids of the Files of the matching Musical Works
+
+    facet_values : Dict[str, List]
+        The FacetValues of each facet, keyed by the name of the facet
+
+    bounds : Dict[int, Tuple[float, float]]
+        The (min, max) of each feature slider, keyed by the pk of the FeatureType
+
+    truncated : bool
+        Whether only SEARCH_RANK_CANDIDATES of the keyword matches were ranked
+    """
+
+    def __init__(
+        self,
+        work_ids: List[int],
+        file_ids: List[int],
+        facet_values: Dict[str, List],
+        bounds: Dict[int, Tuple[float, float]],
+        truncated: bool = False,
+    ) -> None:
+        self.work_ids = work_ids
+        self.file_ids = file_ids
+        self.facet_values = facet_values
+        self.bounds = bounds
+        self.truncated = truncated
+
+
+def is_enabled() -> bool:
+    return getattr(settings, "SEARCH_CACHE_ENABLED", False)
+
+
+def get_version() -> int:
+    """Get the current version of the search results"""
+    with connection.cursor() as cursor:
+        # last_value is already 1 before the first nextval, which sets is_called
+        cursor.execute(
+            "SELECT last_value + is_called::int FROM {0}".format(VERSION_SEQUENCE)
+        )
+        return cursor.fetchone()[0]
+
+
+def _increment_version() -> None:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(%s)", [VERSION_SEQUENCE])
+
+
+def bump_version() -> None:
+    """Invalidate every cached search result once the current transaction commits
+
+    Bumping earlier would let another process cache the results it still reads
+    from before the commit under the new version.
+    """
+    transaction.on_commit(_increment_version)
+
+
+def make_key(query: QueryDict) -> str:
+    """Make a cache key from the GET parameters of a search
+
+    The parameters are canonicalized so that equivalent searches share a key: keys
+    and multiple values are sorted, empty values are dropped and the pagination
+    parameters are stripped.
+    """
+    items = []
+    for key in sorted(query.keys()):
+        if key in PAGINATION_PARAMETERS:
+            continue
+        for value in sorted(query.getlist(key)):
+            if value != "":
+                items.append((key, value))
+    digest = hashlib.sha256(urlencode(items).encode()).hexdigest()
+    return "search:{0}:{1}".format(get_version(), digest)
+
+
+def get_result(key: str) -> Optional[SearchResult]:
+    return caches[CACHE_ALIAS].get(key)
+
+
+def set_result(key: str, result: SearchResult) -> None:
+    caches[CACHE_ALIAS].set(key, result)
@@ -0,0 +1,271 @@
+"""Set-based computation of the search_document of Musical Works
+
+``MusicalWork.index_components`` gathers the weighted search terms of one work
+with about a dozen queries. ``reindex_works`` computes the same weighted tsvectors
+for any number of works with a single UPDATE, aggregating the titles, contributors,
+genres, sections and instruments of all the works at once:
+
+* A - the variant titles and the names of the composers
+* B - the styles and types of work
+* C - the titles of the sections and the instruments of the parts
+* D - the names of the other contributors, the lifespans of the composers and
+  the dates of the contributions
+
+The WorkSearchProjection of the works, which depends on the same related objects,
+is recomputed along with their search_document.
+
+A work is usually saved and then changed through its contributions, sections,
+parts and genres, so the receivers in the signals module do not reindex it right
+away. They call ``mark_dirty`` and the ids of the affected works are collected and
+reindexed in one batch when the transaction commits. Bulk jobs can hold off the
+reindexing until they are done with ``suspend_reindexing``.
+
+Persons, Instruments and genres are shared by many works, so a change to one of
+them is propagated through ``DEPENDENCIES`` to only the works that index it, in
+batches, by a Celery task unless SEARCH_INDEX_ASYNC is off.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Set
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from database.utils import search_cache
+
+# The lookups from MusicalWork to the related models whose fields are indexed, keyed
+# by the name of the related model
+DEPENDENCIES: Dict[str, List[str]] = {
+    "person": ["contributions__person"],
+    "instrument": ["parts__written_for", "sections__parts__written_for"],
+    "genreasinstyle": ["genres_as_in_style"],
+    "genreasintype": ["genres_as_in_type"],
+}
+
+
+def _year_range(column: str) -> str:
+    """SQL for the years of a range column, as ``range_to_str`` shows them"""
+    return "concat_ws(' ', lower({0}), upper({0}) - 1)".format(column)
+
+
+def get_reindex_sql() -> str:
+    """Build the UPDATE statement that reindexes the works whose ids are in %s"""
+    musical_work = apps.get_model("database", "musicalwork")
+    contribution = apps.get_model("database", "contributionmusicalwork")
+    person = apps.get_model("database", "person")
+    section = apps.get_model("database", "section")
+    part = apps.get_model("database", "part")
+    instrument = apps.get_model("database", "instrument")
+    style_field = musical_work._meta.get_field("genres_as_in_style")
+    type_field = musical_work._meta.get_field("genres_as_in_type")
+
+    def contributors(roles: str, expression: str) -> str:
+        return (
+            "(SELECT string_agg({expression}, ' ') FROM {contribution} c "
+            "JOIN {person} p ON p.id = c.person_id "
+            "WHERE c.contributed_to_work_id = w.id AND c.role {roles})"
+        ).format(
+            expression=expression,
+            contribution=contribution._meta.db_table,
+            person=person._meta.db_table,
+            roles=roles,
+        )
+
+    def genres(field) -> str:
+        return (
+            "(SELECT string_agg(g.name, ' ') FROM {through} t "
+            "JOIN {genre} g ON g.id = t.{genre_column} "
+            "WHERE t.{work_column} = w.id)"
+        ).format(
+            through=field.m2m_db_table(),
+            genre=field.related_model._meta.db_table,
+            genre_column=field.m2m_reverse_name(),
+            work_column=field.m2m_column_name(),
+        )
+
+    name = "concat_ws(' ', p.given_name, p.surname)"
+    lifespan = "concat_ws(' ', {0}, {1})".format(
+        _year_range("p.birth_date_range_year_only"),
+        _year_range("p.death_date_range_year_only"),
+    )
+    components = {
+        "A": "concat_ws(' ', array_to_string(w.variant_titles, ' '), {0})".format(
+            contributors("= 'COMPOSER'", name)
+        ),
+        "B": "concat_ws(' ', {0}, {1})".format(
+            genres(style_field), genres(type_field)
+        ),
+        "C": (
+            "concat_ws(' ', "
+            "(SELECT string_agg(s.title, ' ') FROM {section} s "
+            "WHERE s.musical_work_id = w.id), "
+            "(SELECT string_agg(i.name, ' ') FROM {instrument} i WHERE i.id IN ("
+            "SELECT pa.written_for_id FROM {part} pa "
+            "LEFT JOIN {section} ps ON ps.id = pa.section_id "
+            "WHERE pa.musical_work_id = w.id OR ps.musical_work_id = w.id)))"
+        ).format(
+            section=section._meta.db_table,
+            part=part._meta.db_table,
+            instrument=instrument._meta.db_table,
+        ),
+        "D": "concat_ws(' ', {0}, {1}, {2})".format(
+            contributors("<> 'COMPOSER'", name),
+            contributors("= 'COMPOSER'", lifespan),
+            contributors("IS NOT NULL", _year_range("c.date_range_year_only")),
+        ),
+    }
+    document = " || ".join(
+        "setweight(to_tsvector(COALESCE(d.{0}, '')), '{1}')".format(
+            weight.lower(), weight
+        )
+        for weight in components
+    )
+    selects = ", ".join(
+        "{0} AS {1}".format(sql, weight.lower()) for weight, sql in components.items()
+    )
+    return (
+        "UPDATE {table} SET search_document = {document} "
+        "FROM (SELECT w.id, {selects} FROM {table} w WHERE w.id = ANY(%s)) AS d "
+        "WHERE {table}.id = d.id"
+    ).format(table=musical_work._meta.db_table, document=document, selects=selects)
+
+
+def reindex_works(work_ids: Iterable[int], using: str = "default") -> int:
+    """Recompute the search_document and the projection of some Musical Works
+
+    Parameters
+    ----------
+    work_ids : Iterable[int]
+        The ids of the Musical Works to reindex
+    using : str
+        The alias of the database
+
+    Returns
+    -------
+    int
+        The number of Musical Works that were reindexed
+    """
+    work_ids = list(work_ids)
+    if not work_ids:
+        return 0
+    # Before the projection, which copies it. Also restores the range of a work
+    # saved from a stale instance
+    apps.get_model("database", "musicalwork").update_composition_year_ranges(
+        work_ids, using=using
+    )
+    projection = apps.get_model("database", "worksearchprojection")
+    with connections[using].cursor() as cursor:
+        cursor.execute(get_reindex_sql(), [work_ids])
+        count = cursor.rowcount
+    projection.rebuild(work_ids, using=using)
+    # Imported here since the facet index imports the models
+    from database.utils.facet_index import get_facet_index
+
+    get_facet_index().mark_stale(work_ids)
+    # Also covers the changes to genres, contributions, sections, parts and the
+    # related entities, which reach the works through here
+    search_cache.bump_version()
+    return count
+
+
+class _DirtyWorks(threading.local):
+    def __init__(self) -> None:
+        self.ids: Set[int] = set()
+        self.suspended = 0
+
+
+_dirty_works = _DirtyWorks()
+
+
+def mark_dirty(work_ids: Iterable[int], using: str = "default") -> None:
+    """Reindex some Musical Works once the current transaction commits
+
+    The ids are added to a set of dirty works that is flushed by the first
+    ``on_commit`` callback of the transaction, the later ones find it empty. Outside
+    of a transaction the works are reindexed right away, unless reindexing is
+    suspended.
+    """
+    work_ids = {work_id for work_id in work_ids if work_id is not None}
+    if not work_ids:
+        return
+    _dirty_works.ids.update(work_ids)
+    if not _dirty_works.suspended:
+        transaction.on_commit(lambda: flush(using), using=using)
+
+
+def flush(using: str = "default") -> int:
+    """Reindex all the dirty Musical Works now
+
+    Returns
+    -------
+    int
+        The number of Musical Works that were reindexed
+    """
+    work_ids = _dirty_works.ids
+    _dirty_works.ids = set()
+    return reindex_works(work_ids, using=using)
+
+
+@contextmanager
+def suspend_reindexing(using: str = "default") -> Iterator[None]:
+    """Collect the dirty Musical Works of a block and reindex them once at its end
+
+    If the block is inside a transaction, the works are reindexed when it commits.
+    """
+    _dirty_works.suspended += 1
+    try:
+        yield
+    finally:
+        _dirty_works.suspended -= 1
+        if not _dirty_works.suspended and _dirty_works.ids:
+            transaction.on_commit(lambda: flush(using), using=using)
+
+
+def dependent_works(model_name: str, pks: Iterable[int]) -> List[int]:
+    """Get the ids of the Musical Works that index some objects of a related model
+
+    Parameters
+    ----------
+    model_name : str
+        The name of the related model, one of the keys of DEPENDENCIES
+    pks : Iterable[int]
+        The pks of the changed objects
+    """
+    musical_work = apps.get_model("database", "musicalwork")
+    pks = list(pks)
+    work_ids: Set[int] = set()
+    # One query per path, since OR-ing them would join every path together
+    for lookup in DEPENDENCIES[model_name]:
+        work_ids.update(
+            musical_work.objects.filter(**{lookup + "__in": pks}).values_list(
+                "id", flat=True
+            )
+        )
+    return sorted(work_ids)
+
+
+def reindex_dependent_works(
+    model_name: str, pks: Iterable[int], batch_size: int = 1000
+) -> int:
+    """Reindex in batches the Musical Works that index some objects of a model"""
+    work_ids = dependent_works(model_name, pks)
+    for start in range(0, len(work_ids), batch_size):
+        reindex_works(work_ids[start : start + batch_size])
+    return len(work_ids)
+
+
+def propagate(model_name: str, pks: Iterable[int], using: str = "default") -> None:
+    """Reindex the Musical Works affected by a change to some related objects
+
+    With SEARCH_INDEX_ASYNC, the works are found and reindexed by a Celery task
+    sent once the transaction commits, otherwise they are marked dirty.
+    """
+    pks = list(pks)
+    if getattr(settings, "SEARCH_INDEX_ASYNC", False):
+        # Imported here since the tasks module imports the models
+        from database.tasks import reindex_dependent_works_task
+
+        transaction.on_commit(
+            lambda: reindex_dependent_works_task.delay(model_name, pks), using=using
+        )
+    else:
+        mark_dirty(dependent_works(model_name, pks), using=using)
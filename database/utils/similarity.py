@@ -0,0 +1,336 @@
+"""Finds the Files that are musically similar to a File
+
+Every File with ExtractedFeatures is described by one vector made of the values of
+all its FeatureTypes, scalars and histograms alike. Each column is z-scored with a
+mean and standard deviation stored with the index, and each FeatureType is scaled
+by one over the square root of its dimensions so that a long histogram does not
+outweigh a single scalar feature. Similarity is the Euclidean distance between two
+of these vectors.
+
+Computing this in SQL over extracted_feature is far too slow, so the vectors are
+built by the ``rebuild_similarity_index`` command and saved to
+SIMILARITY_INDEX_PATH. Small corpora are searched exhaustively, large ones through
+a random projection LSH index that only compares a File to the Files sharing one of
+its hash buckets.
+"""
+import math
+import os
+from abc import ABCMeta, abstractmethod
+from typing import Dict, List, Optional, Tuple, Type
+import numpy as np
+from django.conf import settings
+from database.models import ExtractedFeature, FeatureType, File
+
+
+class NearestNeighbourIndex(metaclass=ABCMeta):
+    """Finds the nearest rows of a matrix of vectors
+
+    Subclasses choose the candidate rows that are compared to a query vector, the
+    distances to the candidates are always computed exactly. Every concrete
+    subclass is added to ``registry`` under its name.
+    """
+
+    registry: Dict[str, Type["NearestNeighbourIndex"]] = {}
+
+    def __init__(self, vectors: np.ndarray) -> None:
+        self.vectors = vectors
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        if isinstance(cls.__dict__.get("name"), str):
+            NearestNeighbourIndex.registry[cls.name] = cls
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def candidates(self, vector: np.ndarray, k: int) -> np.ndarray:
+        """Get the rows that may be among the k nearest neighbours of a vector"""
+        raise NotImplementedError
+
+    def query(
+        self, vector: np.ndarray, k: int, exclude: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the k nearest rows to a vector and their distances, nearest first
+
+        Parameters
+        ----------
+        vector : np.ndarray
+            The query vector
+        k : int
+            The number of neighbours
+        exclude : Optional[int]
+            A row to leave out of the results, usually the row of the query itself
+        """
+        rows = self.candidates(vector, k + 1)
+        if exclude is not None:
+            rows = rows[rows != exclude]
+        distances = np.linalg.norm(self.vectors[rows] - vector, axis=1)
+        if k < len(rows):
+            nearest = np.argpartition(distances, k - 1)[:k]
+        else:
+            nearest = np.arange(len(rows))
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        return rows[nearest], distances[nearest]
+
+
+class BruteForceIndex(NearestNeighbourIndex):
+    """Compares the query vector to every row"""
+
+    name = "brute"
+
+    def candidates(self, vector: np.ndarray, k: int) -> np.ndarray:
+        return np.arange(len(self.vectors))
+
+
+class RandomProjectionIndex(NearestNeighbourIndex):
+    """Compares the query vector to the rows sharing a hash bucket with it
+
+    Each of the ``tables`` hashes the vectors to the signs of their projections on
+    ``bits`` random hyperplanes through the origin, which is the mean of the
+    z-scored vectors. Falls back to comparing every row if the buckets hold fewer
+    than k rows.
+    """
+
+    name = "lsh"
+
+    def __init__(
+        self, vectors: np.ndarray, tables: int = 8, bits: int = 12, seed: int = 0
+    ) -> None:
+        super().__init__(vectors)
+        random_state = np.random.RandomState(seed)
+        self.planes = random_state.standard_normal(
+            (tables, vectors.shape[1], bits)
+        ).astype(np.float32)
+        self.powers = 1 << np.arange(bits)
+        self.buckets: List[Tuple[np.ndarray, np.ndarray]] = []
+        for planes in self.planes:
+            codes = self.hash(vectors, planes)
+            order = np.argsort(codes, kind="stable")
+            self.buckets.append((codes[order], order))
+
+    def hash(self, vectors: np.ndarray, planes: np.ndarray) -> np.ndarray:
+        return ((vectors @ planes) > 0) @ self.powers
+
+    def candidates(self, vector: np.ndarray, k: int) -> np.ndarray:
+        rows = []
+        for planes, (codes, order) in zip(self.planes, self.buckets):
+            code = self.hash(vector, planes)
+            start = np.searchsorted(codes, code, side="left")
+            end = np.searchsorted(codes, code, side="right")
+            rows.append(order[start:end])
+        candidates = np.unique(np.concatenate(rows))
+        if len(candidates) < k:
+            return np.arange(len(self.vectors))
+        return candidates
+
+
+class SimilarityIndex(object):
+    """The normalized feature vectors of all the Files and an index over them
+
+    Attributes
+    ----------
+    file_ids : np.ndarray
+        The id of the File of each row
+
+    vectors : np.ndarray
+        The float32 matrix of the normalized feature vectors
+
+    feature_type_ids : np.ndarray
+        The FeatureTypes in the vectors, in the order of their columns
+
+    offsets : np.ndarray
+        The first column of each FeatureType
+
+    mean, std, weights : np.ndarray
+        The mean, standard deviation and weight of each column, used to normalize
+        the raw values of a File
+    """
+
+    def __init__(
+        self,
+        file_ids: np.ndarray,
+        vectors: np.ndarray,
+        feature_type_ids: np.ndarray,
+        offsets: np.ndarray,
+        mean: np.ndarray,
+        std: np.ndarray,
+        weights: np.ndarray,
+        backend: str,
+    ) -> None:
+        self.file_ids = file_ids
+        self.vectors = vectors
+        self.feature_type_ids = feature_type_ids
+        self.offsets = offsets
+        self.mean = mean
+        self.std = std
+        self.weights = weights
+        self.backend = backend
+        self.rows = {int(file_id): row for row, file_id in enumerate(file_ids)}
+        self.index = NearestNeighbourIndex.registry[backend](vectors)
+
+    @staticmethod
+    def choose_backend(file_count: int) -> str:
+        limit = getattr(settings, "SIMILARITY_BRUTE_FORCE_LIMIT", 50000)
+        if file_count <= limit:
+            return BruteForceIndex.name
+        return RandomProjectionIndex.name
+
+    @classmethod
+    def build(cls, backend: str = "auto") -> "SimilarityIndex":
+        """Build the index from all the ExtractedFeatures in the database
+
+        Parameters
+        ----------
+        backend : str
+            The name of a NearestNeighbourIndex, or "auto" to search exhaustively
+            up to SIMILARITY_BRUTE_FORCE_LIMIT Files
+        """
+        feature_types = list(
+            FeatureType.objects.order_by("id").values_list("id", "dimensions")
+        )
+        feature_type_ids = np.array([pk for pk, _ in feature_types], dtype=np.int64)
+        offsets = np.zeros(len(feature_types), dtype=np.int64)
+        weights: List[float] = []
+        columns: Dict[int, Tuple[int, int]] = {}
+        for index, (pk, dimensions) in enumerate(feature_types):
+            offsets[index] = len(weights)
+            columns[pk] = (len(weights), dimensions)
+            if dimensions:
+                weights.extend([1 / math.sqrt(dimensions)] * dimensions)
+
+        file_ids = np.array(
+            list(
+                File.objects.filter(features__isnull=False)
+                .distinct()
+                .order_by("id")
+                .values_list("id", flat=True)
+            ),
+            dtype=np.int64,
+        )
+        rows = {int(file_id): row for row, file_id in enumerate(file_ids)}
+        raw = np.full((len(file_ids), len(weights)), np.nan, dtype=np.float32)
+        features = ExtractedFeature.objects.values_list(
+            "feature_of_id", "instance_of_feature_id", "value"
+        )
+        for file_id, feature_type_id, value in features.iterator():
+            offset, dimensions = columns[feature_type_id]
+            if len(value) == dimensions:
+                raw[rows[file_id], offset : offset + dimensions] = value
+
+        # Columns that no File has are all NaN and get a mean of 0 and a std of 1
+        mean = np.nan_to_num(np.nanmean(raw, axis=0))
+        std = np.nan_to_num(np.nanstd(raw, axis=0))
+        std[std == 0] = 1
+        weights_array = np.array(weights, dtype=np.float32)
+        vectors = cls.normalize(raw, mean, std, weights_array)
+        if backend == "auto":
+            backend = cls.choose_backend(len(file_ids))
+        return cls(
+            file_ids,
+            vectors,
+            feature_type_ids,
+            offsets,
+            mean,
+            std,
+            weights_array,
+            backend,
+        )
+
+    @staticmethod
+    def normalize(
+        raw: np.ndarray, mean: np.ndarray, std: np.ndarray, weights: np.ndarray
+    ) -> np.ndarray:
+        """Z-score and weigh raw values, with missing values set to the mean"""
+        vectors = (raw - mean) / std * weights
+        return np.nan_to_num(vectors).astype(np.float32)
+
+    def save(self, path: str) -> None:
+        """Save the index, replacing the file at path only once it is complete"""
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as index_file:
+            np.savez(
+                index_file,
+                file_ids=self.file_ids,
+                vectors=self.vectors,
+                feature_type_ids=self.feature_type_ids,
+                offsets=self.offsets,
+                mean=self.mean,
+                std=self.std,
+                weights=self.weights,
+                backend=np.array(self.backend),
+            )
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SimilarityIndex":
+        with np.load(path) as data:
+            return cls(
+                data["file_ids"],
+                data["vectors"],
+                data["feature_type_ids"],
+                data["offsets"],
+                data["mean"],
+                data["std"],
+                data["weights"],
+                str(data["backend"]),
+            )
+
+    def vector_of(self, file_id: int) -> np.ndarray:
+        """Get the normalized vector of a File, even if it is not in the index"""
+        row = self.rows.get(file_id)
+        if row is not None:
+            return self.vectors[row]
+        ends = np.append(self.offsets[1:], len(self.mean))
+        columns = dict(
+            zip(self.feature_type_ids.tolist(), zip(self.offsets.tolist(), ends))
+        )
+        raw = np.full(len(self.mean), np.nan, dtype=np.float32)
+        features = ExtractedFeature.objects.filter(feature_of=file_id).values_list(
+            "instance_of_feature_id", "value"
+        )
+        for feature_type_id, value in features:
+            # FeatureTypes added after the index was built are left out
+            offset, end = columns.get(feature_type_id, (0, -1))
+            if len(value) == end - offset:
+                raw[offset:end] = value
+        return self.normalize(raw, self.mean, self.std, self.weights)
+
+    def similar_to(self, file_id: int, k: int = 10) -> List[Tuple[int, float]]:
+        """Get the k Files nearest to a File
+
+        Returns
+        -------
+        List[Tuple[int, float]]
+            The ids of the Files and their distances to the File, nearest first
+        """
+        rows, distances = self.index.query(
+            self.vector_of(file_id), k, exclude=self.rows.get(file_id)
+        )
+        return [
+            (int(self.file_ids[row]), float(distance))
+            for row, distance in zip(rows, distances)
+        ]
+
+
+_similarity_index: Optional[SimilarityIndex] = None
+_similarity_index_mtime: Optional[float] = None
+
+
+def get_similarity_index() -> Optional[SimilarityIndex]:
+    """Get the SimilarityIndex saved at SIMILARITY_INDEX_PATH, if it was built
+
+    The index is loaded once per process and loaded again when the file changes.
+    """
+    global _similarity_index, _similarity_index_mtime
+    path = settings.SIMILARITY_INDEX_PATH
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _similarity_index is None or mtime != _similarity_index_mtime:
+        _similarity_index = SimilarityIndex.load(path)
+        _similarity_index_mtime = mtime
+    return _similarity_index
@@ -0,0 +1,117 @@
+"""Fuzzy search of titles and person names with pg_trgm
+
+Early music titles come in many spellings, so exact and ``icontains`` matching miss
+most of what users type, and cannot use an index. These helpers match the titles
+of Musical Works and the names of Persons by trigram word similarity instead,
+which tolerates misspellings and matches partial words.
+
+The titles and names are flattened by the ``simssadb_titles`` and
+``simssadb_person_name`` SQL functions, which are declared immutable so that the
+GIN trigram indexes in EXTRA_SQL can be built on them. The expressions below call
+the same functions so that PostgreSQL uses those indexes.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.contrib.postgres.lookups import PostgresSimpleLookup
+from django.db.models import F, FloatField, Func, Q, QuerySet, TextField, Value
+
+
+@TextField.register_lookup
+class TrigramWordSimilar(PostgresSimpleLookup):
+    """True if the value has a word similar enough to the query
+
+    ``text %> query`` uses the ``pg_trgm.word_similarity_threshold`` setting and is
+    supported by the ``gin_trgm_ops`` indexes.
+    """
+
+    lookup_name = "trigram_word_similar"
+    operator = "%%>"
+
+
+class TrigramWordSimilarity(Func):
+    """The greatest similarity between a query and any part of a text"""
+
+    function = "word_similarity"
+    # As a double rather than a real, so that the value read back compares equal to
+    # the expression when a keyset cursor seeks past it
+    template = "%(function)s(%(expressions)s)::double precision"
+    output_field = FloatField()
+
+    def __init__(self, query: str, expression, **extra) -> None:
+        super().__init__(Value(query), expression, **extra)
+
+
+def is_enabled() -> bool:
+    return getattr(settings, "TRIGRAM_SEARCH", False)
+
+
+def titles(prefix: str = "") -> Func:
+    """The variant titles of a Musical Work as one string"""
+    return Func(
+        F(prefix + "variant_titles"),
+        function="simssadb_titles",
+        output_field=TextField(),
+    )
+
+
+def person_name(prefix: str = "") -> Func:
+    """The given name and surname of a Person as one string"""
+    return Func(
+        F(prefix + "given_name"),
+        F(prefix + "surname"),
+        function="simssadb_person_name",
+        output_field=TextField(),
+    )
+
+
+def search_persons(queryset: QuerySet, query: str) -> QuerySet:
+    """Filter Persons whose name is similar to a query, most similar first"""
+    return (
+        queryset.annotate(name_text=person_name())
+        .filter(name_text__trigram_word_similar=query)
+        .annotate(similarity=TrigramWordSimilarity(query, person_name()))
+        .order_by("-similarity")
+    )
+
+
+def search_works(queryset: QuerySet, query: str) -> QuerySet:
+    """Filter Musical Works whose titles or contributors are similar to a query
+
+    The works are ordered by the similarity of their titles, most similar first.
+    """
+    person_model = apps.get_model("database", "person")
+    contribution_model = apps.get_model("database", "contributionmusicalwork")
+    persons = search_persons(person_model.objects.all(), query).order_by()
+    contributions = contribution_model.objects.filter(
+        person__in=persons.values("id")
+    ).values("contributed_to_work_id")
+    return (
+        queryset.annotate(titles_text=titles())
+        .filter(
+            Q(titles_text__trigram_word_similar=query) | Q(id__in=contributions)
+        )
+        .annotate(similarity=TrigramWordSimilarity(query, titles()))
+        .order_by("-similarity")
+    )
+
+
+class TrigramSearchMixin:
+    """Replaces the icontains search of SearchableListMixin with a trigram search
+
+    Views using this mixin must set ``trigram_search`` to one of the search
+    functions of this module, as a staticmethod. The search is only used when
+    TRIGRAM_SEARCH is on.
+    """
+
+    def get_search_query(self):
+        if is_enabled():
+            # Turns off the search of SearchableListMixin
+            return None
+        return super().get_search_query()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        query = self.request.GET.get("q", "").strip()
+        if is_enabled() and query:
+            queryset = self.trigram_search(queryset, query)
+        return queryset
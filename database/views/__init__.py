@@ -19,7 +19,7 @@ from database.views.extracted_feature import (
 )
 from database.views.feature_file import FeatureFileDetailView, FeatureFileListView
 from database.views.feature_type import FeatureTypeDetailView, FeatureTypeListView
-from database.views.file import FileDetailView, FileListView
+from database.views.file import FileDetailView, FileListView, SimilarFilesView
 from database.views.genre_as_in_style import (
     GenreAsInStyleDetailView,
     GenreAsInStyleListView,
@@ -58,3 +58,4 @@ from database.views.download import (
     download_cart,
 )
 from database.views.cart import CartView, add_to_cart, remove_from_cart, clear_cart
+from database.views.suggestions import suggest
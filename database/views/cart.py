@@ -4,6 +4,7 @@ from database.models import File, ResearchCorpus
 from django.http import HttpRequest, JsonResponse, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.views.decorators.http import require_POST, require_safe
+from database.utils.result_sets import load_file_ids
 from database.utils.view_utils import zip_files
 from datetime import datetime
 import json
@@ -48,6 +49,13 @@ def add_to_cart(request: HttpRequest) -> JsonResponse:
         request.session["cart"].extend(search_results_file_ids)
         response = {}
 
+    elif "search_results_token" in data:
+        search_results_file_ids = load_file_ids(data["search_results_token"])
+        if search_results_file_ids is None:
+            return JsonResponse({"error": "The search results expired"}, status=410)
+        request.session["cart"].extend(search_results_file_ids)
+        response = {}
+
     # Removes duplicates but preserves the order of insertion
     request.session["cart"] = list(dict.fromkeys(request.session["cart"]))
     request.session.modified = True
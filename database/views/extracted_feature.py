@@ -1,6 +1,7 @@
 from django.views.generic import DetailView, ListView
 from database.models import ExtractedFeature
 from extra_views import SearchableListMixin
+from database.utils.pagination import KeysetPaginationMixin
 
 
 class ExtractedFeatureDetailView(DetailView):
@@ -8,11 +9,14 @@ class ExtractedFeatureDetailView(DetailView):
     template_name = "detail.html"
 
 
-class ExtractedFeatureListView(SearchableListMixin, ListView):
+class ExtractedFeatureListView(
+    KeysetPaginationMixin, SearchableListMixin, ListView
+):
     model = ExtractedFeature
     search_fields = ["instance_of_feature__name"]
     queryset = ExtractedFeature.objects.prefetch_related(
         "instance_of_feature"
     ).order_by("instance_of_feature__name")
     paginate_by = 100
+    keyset_ordering = ["instance_of_feature__name", "id"]
     template_name = "list.html"
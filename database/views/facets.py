@@ -1,6 +1,13 @@
-from typing import List, Optional, Union
+from collections import defaultdict
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
 from abc import ABCMeta, abstractmethod
-from django.db.models import Count, F, Q, QuerySet, Value, When
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, CharField, Count, F, Q, QuerySet, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Concat
+from database.utils.parallel import run_in_parallel, run_serially
 from database.models import (
     ExtractedFeature,
     FeatureType,
@@ -10,7 +17,7 @@ from database.models import (
     MusicalWork,
     Person,
     Section,
-    File,
+    WorkFileClosure,
 )
 
 
@@ -22,12 +29,28 @@ class FacetValue(object):
 
 
 class Facet(metaclass=ABCMeta):
+    """A property of Musical Works that search results can be narrowed down by.
+
+    Subclasses declare a name, a display name, the lookups used to filter Musical
+    Works by a selected value, the field of WorkSearchProjection holding the values
+    of a work and a ``facet_queryset`` that counts the Musical Works for each value.
+    Every concrete subclass is added to ``registry`` under its name, which is how
+    the search view and the FacetEngine find it.
+    """
+
+    registry: Dict[str, Type["Facet"]] = {}
+
     def __init__(self, selected: List[str] = None) -> None:
         if selected is None:
             self.selected: List[str] = []
         else:
             self.selected = selected
 
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        if isinstance(cls.__dict__.get("name"), str):
+            Facet.registry[cls.name] = cls
+
     @property
     @abstractmethod
     def name(self) -> str:
@@ -43,138 +66,281 @@ class Facet(metaclass=ABCMeta):
     def lookups(self) -> List[str]:
         raise NotImplementedError
 
+    @property
     @abstractmethod
-    def make_facet_values(self, ids: List[int]) -> List[Optional[FacetValue]]:
+    def projection_field(self) -> str:
+        raise NotImplementedError
+
+    @property
+    def projection_lookup(self) -> str:
+        """The lookup on WorkSearchProjection matching any of a list of values"""
+        return self.projection_field + "__overlap"
+
+    def display_names(self) -> Iterable[Tuple[Any, str]]:
+        """Get the (pk, display_name) of every value of this facet
+
+        Used by the FacetIndex, which counts values without querying their names.
+        The values missing from it are displayed as their pk.
+        """
+        return []
+
+    @abstractmethod
+    def facet_queryset(self, ids: Any) -> QuerySet:
+        """Count the Musical Works for each value of this facet.
+
+        Parameters
+        ----------
+        ids : Any
+            The ids of the Musical Works to count, either as a list, a QuerySet or
+            an expression usable in an ``__in`` lookup
+
+        Returns
+        -------
+        QuerySet
+            A QuerySet of (pk, display_name, count) tuples. The FacetEngine reads the
+            columns of its SQL by position, and annotations are selected in the
+            order they are made, so ``display_name`` is annotated before ``count``.
+        """
         raise NotImplementedError
 
+    def parse_pk(self, pk: Optional[str]) -> Any:
+        """Convert a pk read back as text by the FacetEngine to its original type"""
+        return int(pk)
+
+    def make_facet_values(self, ids: List[int]) -> List[Optional[FacetValue]]:
+        facet_values: List[Optional[FacetValue]] = []
+        for facet_tuple in self.facet_queryset(ids):
+            facet_values.append(FacetValue(*facet_tuple))
+        return facet_values
+
     facet_values: List[Optional[FacetValue]] = []
 
 
+class FacetEngine(object):
+    """Computes the values of several facets in a single query.
+
+    The ids of the matching Musical Works are materialized once in a common table
+    expression, and the counts of every facet are computed against it and combined
+    with ``UNION ALL``. The work ids subquery, which may include a ranked full text
+    search, is thus only evaluated once no matter how many facets are active.
+    """
+
+    works_table = "matched_works"
+
+    def __init__(self, facets: List[Facet]) -> None:
+        self.facets = facets
+
+    def works_sql(self, work_ids: Union[QuerySet, Iterable[int]]) -> Tuple[str, List]:
+        if isinstance(work_ids, QuerySet):
+            sql, params = work_ids.order_by().query.sql_with_params()
+            return sql, list(params)
+        return "SELECT unnest(%s::integer[])", [list(work_ids)]
+
+    def compute(self, work_ids: Union[QuerySet, Iterable[int]]) -> None:
+        """Set the ``facet_values`` of every facet of this engine.
+
+        Parameters
+        ----------
+        work_ids : Union[QuerySet, Iterable[int]]
+            The ids of the Musical Works matched by the search
+        """
+        if not self.facets:
+            return
+        works_sql, params = self.works_sql(work_ids)
+        matched_works = RawSQL("SELECT id FROM {0}".format(self.works_table), [])
+        selects = []
+        for index, facet in enumerate(self.facets):
+            facet_queryset = facet.facet_queryset(matched_works)
+            sql, facet_params = facet_queryset.query.sql_with_params()
+            selects.append(
+                "SELECT %s, f.pk::text, f.display_name::text, f.count "
+                "FROM ({0}) AS f (pk, display_name, count)".format(sql)
+            )
+            params.append(index)
+            params.extend(facet_params)
+        sql = "WITH {0} (id) AS ({1}) {2}".format(
+            self.works_table, works_sql, " UNION ALL ".join(selects)
+        )
+
+        rows: Dict[int, List[Tuple]] = defaultdict(list)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for index, pk, display_name, count in cursor.fetchall():
+                rows[index].append((pk, display_name, count))
+
+        for index, facet in enumerate(self.facets):
+            facet.facet_values = [
+                FacetValue(facet.parse_pk(pk), display_name, count)
+                for pk, display_name, count in rows[index]
+            ]
+
+
+def compute_facets(
+    facets: List[Facet],
+    work_ids: Union[QuerySet, Iterable[int]],
+    tasks: Optional[Dict[str, Callable[[], Any]]] = None,
+) -> Dict[str, Any]:
+    """Set the ``facet_values`` of some facets with the backend set by FACET_BACKEND
+
+    Either "sql", for a single query of the FacetEngine, "parallel", for one query
+    per facet run concurrently by run_in_parallel, or "bitmap", for the in-process
+    FacetIndex of database/utils/facet_index.py.
+
+    Parameters
+    ----------
+    facets : List[Facet]
+        The facets whose values are set
+    work_ids : Union[QuerySet, Iterable[int]]
+        The ids of the Musical Works that are counted
+    tasks : Optional[Dict[str, Callable[[], Any]]]
+        Other queries of the search, keyed by names that are not names of facets.
+        With the "parallel" backend they run along with the queries of the facets.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The result of each of the other queries, keyed by its name
+    """
+    tasks = dict(tasks or {})
+    backend = getattr(settings, "FACET_BACKEND", "sql")
+    if backend == "parallel":
+        tasks.update(
+            {facet.name: partial(facet.make_facet_values, work_ids) for facet in facets}
+        )
+        results = run_in_parallel(tasks)
+        for facet in facets:
+            facet.facet_values = results.pop(facet.name)
+        return results
+    if backend == "bitmap":
+        # Imported here since the facet index imports the facets
+        from database.utils.facet_index import get_facet_index
+
+        get_facet_index().compute(facets, work_ids)
+    else:
+        FacetEngine(facets).compute(work_ids)
+    return run_serially(tasks)
+
+
 class TypeFacet(Facet):
     name = "types"
     display_name = "Genre (Type of Work)"
     lookups = ["genres_as_in_type__pk"]
+    projection_field = "type_ids"
 
-    def make_facet_values(self, ids: List[int]) -> List[Optional[FacetValue]]:
-        facet_values: List[Optional[FacetValue]] = []
-        type_tuples = (
+    def facet_queryset(self, ids: Any) -> QuerySet:
+        return (
             GenreAsInType.objects.filter(musical_works__in=ids).annotate(
-                count=Count("musical_works"), display_name=F("name")
+                display_name=F("name"), count=Count("musical_works")
             )
         ).values_list("pk", "display_name", "count")
-        for type_tuple in type_tuples:
-            facet_values.append(FacetValue(*type_tuple))
-        return facet_values
+
+    def display_names(self) -> Iterable[Tuple[Any, str]]:
+        return GenreAsInType.objects.values_list("pk", "name")
 
 
 class StyleFacet(Facet):
     name = "styles"
     display_name = "Genre (Style)"
-    lookups = ["genres_as_in_type__pk"]
+    lookups = ["genres_as_in_style__pk"]
+    projection_field = "style_ids"
 
-    def make_facet_values(self, ids: List[int]) -> List[Optional[FacetValue]]:
-        facet_values: List[Optional[FacetValue]] = []
-        style_tuples = (
+    def facet_queryset(self, ids: Any) -> QuerySet:
+        return (
             GenreAsInStyle.objects.filter(musical_works__in=ids).annotate(
-                count=Count("musical_works"), display_name=F("name")
+                display_name=F("name"), count=Count("musical_works")
             )
         ).values_list("pk", "display_name", "count")
-        for style_tuple in style_tuples:
-            facet_values.append(FacetValue(*style_tuple))
-        return facet_values
+
+    def display_names(self) -> Iterable[Tuple[Any, str]]:
+        return GenreAsInStyle.objects.values_list("pk", "name")
 
 
 class ComposerFacet(Facet):
     name = "composers"
     display_name = "Composer"
     lookups = ["contributions__person__pk"]
+    projection_field = "composer_ids"
 
-    def make_facet_values(self, ids: List[int]) -> List[Optional[FacetValue]]:
-        facet_values: List[Optional[FacetValue]] = []
-        composer_tuples = (
+    def facet_queryset(self, ids: Any) -> QuerySet:
+        return (
             Person.objects.filter(
                 contributions_works__contributed_to_work__in=ids,
                 contributions_works__role="COMPOSER",
-            ).annotate(count=Count("contributions_works__contributed_to_work"))
-        ).values_list("pk", "given_name", "surname", "count")
-        for composer_tuple in composer_tuples:
-            facet_value = FacetValue(
-                pk=composer_tuple[0],
-                display_name="{0}, {1}".format(
-                    composer_tuple[2], composer_tuple[1]),
-                count=composer_tuple[3],
+            ).annotate(
+                display_name=Concat(
+                    "surname", Value(", "), "given_name", output_field=CharField()
+                ),
+                count=Count("contributions_works__contributed_to_work"),
             )
-            facet_values.append(facet_value)
-        return facet_values
+        ).values_list("pk", "display_name", "count")
+
+    def display_names(self) -> Iterable[Tuple[Any, str]]:
+        return Person.objects.annotate(
+            display_name=Concat(
+                "surname", Value(", "), "given_name", output_field=CharField()
+            )
+        ).values_list("pk", "display_name")
 
 
 class InstrumentFacet(Facet):
     name = "instruments"
     display_name = "Instrument/Voice"
     lookups = ["parts__written_for__pk"]
+    projection_field = "instrument_ids"
 
-    def make_facet_values(self, ids: List[int]) -> List[Optional[FacetValue]]:
-        facet_values: List[Optional[FacetValue]] = []
-        instrument_tuples = (
+    def facet_queryset(self, ids: Any) -> QuerySet:
+        return (
             Instrument.objects.filter(parts__musical_work__in=ids).annotate(
                 count=Count("parts__musical_work", distinct=True)
             )
         ).values_list("pk", "name", "count")
-        for instrument_tuple in instrument_tuples:
-            facet_values.append(FacetValue(*instrument_tuple))
-        return facet_values
+
+    def display_names(self) -> Iterable[Tuple[Any, str]]:
+        return Instrument.objects.values_list("pk", "name")
 
 
 class FileFormatFacet(Facet):
     name = "file_formats"
     display_name = "File Format"
-    lookups = ["source_instantiations__files__file_format",
-               "sections__source_instantiations__files__file_format",
-               "sections__parts__source_instantiations__files__file_format"]
+    lookups = ["file_closures__file_format"]
+    projection_field = "file_formats"
 
-    def make_facet_values(self, ids: List[int]) -> List[Optional[FacetValue]]:
-        facet_values: List[Optional[FacetValue]] = []
-        file_format_tuples = (
-            File.objects.filter(
-                Q(instantiates__sections__musical_work__in=ids)
-                | Q(instantiates__work__in=ids)
-            )
+    def facet_queryset(self, ids: Any) -> QuerySet:
+        return (
+            WorkFileClosure.objects.filter(work__in=ids)
             .values_list("file_format")
-            .annotate(display_name=F("file_format"), count=Count("file_format"))
+            .annotate(display_name=F("file_format"), count=Count("file", distinct=True))
         )
-        for file_format_tuple in file_format_tuples:
-            facet_values.append(FacetValue(*file_format_tuple))
-        return facet_values
+
+    def parse_pk(self, pk: Optional[str]) -> Any:
+        return pk
 
 
 class SacredFacet(Facet):
     name = "sacred"
     display_name = "Sacred or Secular"
     lookups = ["sacred_or_secular"]
+    projection_field = "sacred_or_secular"
+    projection_lookup = "sacred_or_secular__in"
 
-    def make_facet_values(self, ids: List[int]) -> List[Optional[FacetValue]]:
-        aggregated_query = MusicalWork.objects.filter(id__in=ids).aggregate(
-            trues=Count("sacred_or_secular", filter=Q(sacred_or_secular=True)),
-            falses=Count("sacred_or_secular", filter=Q(
-                sacred_or_secular=False)),
-            nones=Count("sacred_or_secular", filter=Q(sacred_or_secular=None)),
+    def facet_queryset(self, ids: Any) -> QuerySet:
+        return (
+            MusicalWork.objects.filter(id__in=ids)
+            .values_list("sacred_or_secular")
+            .annotate(
+                display_name=Case(
+                    When(sacred_or_secular=True, then=Value("Sacred")),
+                    When(sacred_or_secular=False, then=Value("Secular")),
+                    default=Value("Non-Applicable"),
+                    output_field=CharField(),
+                ),
+                count=Count("id"),
+            )
+            .order_by(F("sacred_or_secular").desc(nulls_last=True))
         )
 
-        trues: Optional[FacetValue] = None
-        falses: Optional[FacetValue] = None
-        nones: Optional[FacetValue] = None
-        if aggregated_query["trues"] > 0:
-            trues = FacetValue(
-                pk=True, display_name="Sacred", count=aggregated_query["trues"]
-            )
-        if aggregated_query["falses"] > 0:
-            falses = FacetValue(
-                pk=False, display_name="Secular", count=aggregated_query["falses"]
-            )
-        if aggregated_query["nones"] > 0:
-            nones = FacetValue(
-                pk=None, display_name="Non-Applicable", count=aggregated_query["nones"]
-            )
-        facet_values = [trues, falses, nones]
-        facet_values = [i for i in facet_values if i is not None]
-        return facet_values
+    def parse_pk(self, pk: Optional[str]) -> Any:
+        return {"true": True, "false": False}.get(pk)
+
+    def display_names(self) -> Iterable[Tuple[Any, str]]:
+        return [(True, "Sacred"), (False, "Secular"), (None, "Non-Applicable")]
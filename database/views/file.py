@@ -1,15 +1,42 @@
 from django.views.generic import DetailView, ListView
 from database.models import File
 from extra_views import SearchableListMixin
+from database.utils.pagination import KeysetPaginationMixin
+from database.utils.similarity import get_similarity_index
 
 class FileDetailView(DetailView):
     model = File
     context_object_name = "file"
 
 
-class FileListView(SearchableListMixin, ListView):
+class FileListView(KeysetPaginationMixin, SearchableListMixin, ListView):
     model = File
     search_fields = ["file_type", "file_format"]
     queryset = File.objects.order_by("id")
     paginate_by = 100
+    keyset_ordering = ["id"]
     template_name = "list.html"
+
+
+class SimilarFilesView(DetailView):
+    """Lists the Files whose features are nearest to the features of a File"""
+
+    model = File
+    context_object_name = "file"
+    template_name = "database/similar_files.html"
+    number_of_neighbours = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        index = get_similarity_index()
+        if index is None:
+            context["similar_files"] = None
+            return context
+        neighbours = index.similar_to(self.object.pk, self.number_of_neighbours)
+        files = File.objects.in_bulk([file_id for file_id, _ in neighbours])
+        context["similar_files"] = [
+            (files[file_id], distance)
+            for file_id, distance in neighbours
+            if file_id in files
+        ]
+        return context
@@ -1,6 +1,8 @@
 from django.views.generic import DetailView, ListView
 from database.models import MusicalWork
 from extra_views import SearchableListMixin
+from database.utils.pagination import KeysetPaginationMixin
+from database.utils.trigram import TrigramSearchMixin, search_works
 
 
 class MusicalWorkDetailView(DetailView):
@@ -11,7 +13,9 @@ class MusicalWorkDetailView(DetailView):
     )
 
 
-class MusicalWorkListView(SearchableListMixin, ListView):
+class MusicalWorkListView(
+    KeysetPaginationMixin, TrigramSearchMixin, SearchableListMixin, ListView
+):
     model = MusicalWork
     search_fields = [
         "contributions__person__surname",
@@ -21,3 +25,5 @@ class MusicalWorkListView(SearchableListMixin, ListView):
     context_object_name = "musicalworks"
     queryset = MusicalWork.objects.order_by("variant_titles")
     paginate_by = 100
+    trigram_search = staticmethod(search_works)
+    keyset_ordering = ["variant_titles", "id"]
@@ -1,6 +1,8 @@
 from django.views.generic import DetailView, ListView
 from database.models import Person
 from extra_views import SearchableListMixin
+from database.utils.pagination import KeysetPaginationMixin
+from database.utils.trigram import TrigramSearchMixin, search_persons
 
 
 class PersonDetailView(DetailView):
@@ -8,7 +10,9 @@ class PersonDetailView(DetailView):
     context_object_name = "person"
 
 
-class PersonListView(SearchableListMixin, ListView):
+class PersonListView(
+    KeysetPaginationMixin, TrigramSearchMixin, SearchableListMixin, ListView
+):
     model = Person
     search_fields = [
         "surname",
@@ -17,6 +21,8 @@ class PersonListView(SearchableListMixin, ListView):
     context_object_name = "persons"
     queryset = Person.objects.order_by("surname")
     paginate_by = 100
+    trigram_search = staticmethod(search_persons)
+    keyset_ordering = ["surname", "id"]
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -1,17 +1,52 @@
 import json
-from typing import List, Optional, Dict
+from functools import partial
+from typing import Iterable, List, Optional, Dict, Tuple, Union
+from django.conf import settings
 from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
-from django.db.models import Count, F, Q, QuerySet
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    FloatField,
+    Func,
+    Prefetch,
+    Q,
+    QuerySet,
+    TextField,
+    Value,
+    When,
+    prefetch_related_objects,
+)
+from django.db.models.functions import Cast
 from django.http import Http404, HttpResponse, HttpRequest
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 from django.views.generic.base import TemplateView
 from database.forms.feature_search_form import FeatureSearchForm
-from django.core.paginator import Paginator
+from django.core.paginator import InvalidPage, Page, Paginator
 from database.forms.facet_search_form import FacetSearchForm
 from psycopg2.extras import NumericRange
-from django.core.serializers.json import DjangoJSONEncoder
-from database.models import ExtractedFeature, FeatureType, MusicalWork, Section, File
+from database.models import (
+    FeatureType,
+    MusicalWork,
+    File,
+    FileFeatureVector,
+    Section,
+    WorkFileClosure,
+    WorkSearchProjection,
+)
+from database.utils import facet_index, result_sets, search_cache, trigram
+from database.utils.feature_matrix import get_feature_matrix
+from database.utils.pagination import (
+    KeysetPage,
+    KeysetPaginator,
+    ListKeysetPaginator,
+    get_pagination_mode,
+)
+from database.utils.search_cache import SearchResult
 from database.views.facets import (
     Facet,
+    compute_facets,
     TypeFacet,
     StyleFacet,
     ComposerFacet,
@@ -28,6 +63,11 @@ class FeatureFilter(object):
         self.max_val = max_val
 
 
+# Delimit the matched terms in ts_headline, to be replaced once the titles are escaped
+HEADLINE_START = "@@@start@@@"
+HEADLINE_STOP = "@@@stop@@@"
+
+
 class SearchView(TemplateView):
     """View to search the database for Musical Works using PostgreSQL full text search.
 
@@ -58,20 +98,8 @@ class SearchView(TemplateView):
     ) -> List[Facet]:
         facets: List[Facet] = []
         for facet_name in facet_name_list:
-            facet: Facet
             selected = request.GET.getlist(facet_name)
-            if facet_name == "types":
-                facet = TypeFacet(selected=selected)
-            elif facet_name == "styles":
-                facet = StyleFacet(selected=selected)
-            elif facet_name == "composers":
-                facet = ComposerFacet(selected=selected)
-            elif facet_name == "instruments":
-                facet = InstrumentFacet(selected=selected)
-            elif facet_name == "file_formats":
-                facet = FileFormatFacet(selected=selected)
-            elif facet_name == "sacred":
-                facet = SacredFacet(selected=selected)
+            facet = Facet.registry[facet_name](selected=selected)
             facets.append(facet)
         return facets
 
@@ -81,9 +109,32 @@ class SearchView(TemplateView):
         else:
             return False
 
+    def rank_expression(self, keyword: str) -> Func:
+        """Get the expression that ranks the Musical Works matching a keyword"""
+        # As a double, like the trigram similarity, see trigram.TrigramWordSimilarity
+        rank = Cast(
+            SearchRank(F("search_document"), SearchQuery(keyword)), FloatField()
+        )
+        if keyword and trigram.is_enabled():
+            # Misspelled titles are ranked by how close they are
+            return rank + trigram.TrigramWordSimilarity(keyword, trigram.titles())
+        return rank
+
     def keyword_search(self, keyword: str) -> QuerySet:
         query = SearchQuery(keyword)
-        rank_annotation = SearchRank(F("search_document"), query)
+        rank_annotation = self.rank_expression(keyword)
+        if keyword and trigram.is_enabled():
+            # Also matches misspelled titles, ranked by how close they are
+            return (
+                MusicalWork.objects.annotate(
+                    titles_text=trigram.titles(), rank=rank_annotation
+                )
+                .filter(
+                    Q(search_document=query)
+                    | Q(titles_text__trigram_word_similar=keyword)
+                )
+                .order_by("-rank")
+            )
         queryset = (
             MusicalWork.objects.annotate(rank=rank_annotation)
             .filter(search_document=query)
@@ -91,7 +142,78 @@ class SearchView(TemplateView):
         )
         return queryset
 
+    def get_rank_candidates(self) -> int:
+        return getattr(settings, "SEARCH_RANK_CANDIDATES", 0)
+
+    def rank_candidates(
+        self, works: QuerySet, keyword: str, limit: int
+    ) -> Tuple[QuerySet, bool]:
+        """Rank only a capped set of candidates among the keyword matches
+
+        ts_rank reads the whole search_document of every row it ranks, so short
+        queries matching most of the corpus rank all of it to display one page. The
+        candidates are the first matches in id order, which the GIN index finds
+        without ranking anything. Only those are ranked, and every other match is
+        kept after them with a rank of -1, in descending id order.
+
+        Returns
+        -------
+        Tuple[QuerySet, bool]
+            All the matching works, the ranked candidates first, and whether some
+            matches were left unranked
+        """
+        candidate_ids = list(
+            works.order_by("id").values_list("id", flat=True).distinct()[: limit + 1]
+        )
+        if len(candidate_ids) <= limit:
+            return works, False
+        rank = Case(
+            When(id__in=candidate_ids[:limit], then=self.rank_expression(keyword)),
+            # Not null, so that keyset pagination can seek past it
+            default=Value(-1.0),
+            output_field=FloatField(),
+        )
+        return works.annotate(rank=rank).order_by("-rank", "-id"), True
+
+    def add_headlines(self, works: List[MusicalWork], keyword: str) -> None:
+        """Set the titles of some works, with the terms matching a query in bold"""
+        document = Func(
+            F("variant_titles"),
+            Value(" "),
+            function="array_to_string",
+            output_field=TextField(),
+        )
+        headline = Func(
+            document,
+            SearchQuery(keyword),
+            Value(
+                "StartSel={0}, StopSel={1}, HighlightAll=true".format(
+                    HEADLINE_START, HEADLINE_STOP
+                )
+            ),
+            function="ts_headline",
+            output_field=TextField(),
+        )
+        headlines = dict(
+            MusicalWork.objects.filter(id__in=[work.id for work in works])
+            .annotate(headline=headline)
+            .values_list("id", "headline")
+        )
+        for work in works:
+            text = escape(headlines.get(work.id) or "")
+            work.headline = mark_safe(
+                text.replace(HEADLINE_START, "<b>").replace(HEADLINE_STOP, "</b>")
+            )
+
+    def is_projection_on(self) -> bool:
+        return getattr(settings, "SEARCH_PROJECTION", False)
+
     def make_facet_query(self, facet: Facet) -> Q:
+        if self.is_projection_on():
+            # An array overlap on the projection matches any of the selected values
+            if not facet.selected:
+                return Q()
+            return Q(**{facet.projection_lookup: facet.selected})
         q_objects = Q()
         for selection in facet.selected:
             kwargs_list: List[dict] = []
@@ -102,9 +224,20 @@ class SearchView(TemplateView):
         return q_objects
 
     def facet_filter(self, queryset: QuerySet, facets: List[Facet]) -> QuerySet:
+        if getattr(settings, "FACET_BACKEND", "sql") == "bitmap":
+            work_ids = facet_index.get_facet_index().filter(facets)
+            if work_ids is None:
+                return queryset
+            return queryset.filter(id__in=work_ids)
         querys = Q()
         for facet in facets:
             querys &= self.make_facet_query(facet)
+        if self.is_projection_on():
+            if not querys:
+                return queryset
+            # All the facets are checked on the single projection row of a work
+            projections = WorkSearchProjection.objects.filter(querys)
+            return queryset.filter(id__in=projections.values("work_id"))
         return queryset.filter(querys)
 
     def read_request_feature_filters(
@@ -121,28 +254,42 @@ class SearchView(TemplateView):
                 feature_filters.append(feature_filter)
         return feature_filters
 
-    def single_feature_filter(self, feature_filter: FeatureFilter) -> Q:
-        ids = ExtractedFeature.objects.filter(
-            instance_of_feature__code=feature_filter.code,
-            value__0__gte=feature_filter.min_val,
-            value__0__lte=feature_filter.max_val,
-        ).values_list("feature_of_id", flat=True)
-        return Q(id__in=ids)
+    def single_feature_filter(
+        self, feature_filter: FeatureFilter, feature_type_ids: Dict[str, int]
+    ) -> Q:
+        lookup = "feature_vector__" + FileFeatureVector.lookup(
+            feature_type_ids[feature_filter.code]
+        )
+        return Q(
+            **{
+                lookup + "__gte": feature_filter.min_val,
+                lookup + "__lte": feature_filter.max_val,
+            }
+        )
 
     def content_search(
         self, request: HttpRequest, codes: List[str], files: QuerySet
     ) -> QuerySet:
         feature_filters = self.read_request_feature_filters(request, codes)
+        if getattr(settings, "CONTENT_SEARCH_ENGINE", "database") == "memory":
+            file_ids = get_feature_matrix().search(feature_filters)
+            return files.filter(id__in=file_ids)
+        # All the ranges are checked on the single FileFeatureVector row of a File
+        feature_type_ids = dict(
+            FeatureType.objects.filter(
+                code__in=[feature_filter.code for feature_filter in feature_filters]
+            ).values_list("code", "id")
+        )
         q_feature_filters = Q()
         for feature_filter in feature_filters:
-            q_feature_filters &= self.single_feature_filter(feature_filter)
+            q_feature_filters &= self.single_feature_filter(
+                feature_filter, feature_type_ids
+            )
         return files.filter(q_feature_filters)
 
     def filter_works_with_no_files(self, works: QuerySet, files: QuerySet) -> QuerySet:
-        return works.filter(
-            Q(source_instantiations__files__in=files)
-            | Q(sections__source_instantiations__files__in=files)
-        ).distinct()
+        work_ids = WorkFileClosure.objects.filter(file__in=files).values("work_id")
+        return works.filter(id__in=work_ids).distinct()
 
     def date_filter(
         self,
@@ -150,45 +297,124 @@ class SearchView(TemplateView):
         min_date: Optional[int] = None,
         max_date: Optional[int] = None,
     ) -> QuerySet:
+        # The composition years are denormalized on the work, so no join is needed
         works = works.filter(
-            contributions__date_range_year_only__overlap=NumericRange(
+            composition_year_range__overlap=NumericRange(
                 min_date, max_date, bounds="[]"
-            ),
-            contributions__role="COMPOSER",
+            )
         )
         return works
 
+    def get_keyset_ordering(self, works: QuerySet) -> List[str]:
+        """Get a unique ordering matching the ordering of the works QuerySet"""
+        ordering = list(works.query.order_by) or ["-rank"]
+        last = ordering[-1]
+        if last.lstrip("-") not in ("id", "pk"):
+            ordering.append("-id" if last.startswith("-") else "id")
+        return ordering
+
+    def get_page_of_works(
+        self, page_of_ids: Union[Page, KeysetPage]
+    ) -> Union[Page, KeysetPage]:
+        """Replace the ids of a page of a paginated list of ids by their works"""
+        works_by_id = MusicalWork.objects.in_bulk(page_of_ids.object_list)
+        page_of_ids.object_list = [
+            works_by_id[pk] for pk in page_of_ids.object_list if pk in works_by_id
+        ]
+        return page_of_ids
+
+    def get_prefetch_plan(self) -> List[Union[str, Prefetch]]:
+        """Get the lookups to prefetch for all the works of a page of results
+
+        They cover everything search_item.html displays, so a page renders in a
+        fixed number of queries whatever its size.
+        """
+        sections = Section.objects.order_by("id").prefetch_related(
+            Section.prefetch_files()
+        )
+        return [
+            MusicalWork.prefetch_contributions(),
+            Prefetch("sections", queryset=sections),
+            "genres_as_in_type",
+            "genres_as_in_style",
+            MusicalWork.prefetch_files(),
+        ]
+
+    def prefetch_page(self, works: Iterable[MusicalWork]) -> List[MusicalWork]:
+        works = list(works)
+        prefetch_related_objects(works, *self.get_prefetch_plan())
+        return works
+
     def get_context_data(
         self,
-        works: QuerySet,
+        works: Union[QuerySet, List[int]],
         file_ids: List[int],
-        file_ids_json: str,
+        file_ids_token: Optional[str],
         facet_form: FacetSearchForm,
         feature_form: FeatureSearchForm,
         content_search_on: bool,
         page: int,
+        truncated: bool = False,
         **kwargs
     ) -> Dict:
         context = super(SearchView, self).get_context_data(**kwargs)
-        context["paginator"] = Paginator(works, self.paginate_by)
+        if isinstance(works, list):
+            # A cached list of ids, so a page is just a slice of it
+            if get_pagination_mode(self.request) == "keyset":
+                paginator = ListKeysetPaginator(works, self.paginate_by)
+                try:
+                    page_of_ids = paginator.get_page(self.request.GET.get("cursor"))
+                except InvalidPage as e:
+                    raise Http404(str(e))
+            else:
+                paginator = Paginator(works, self.paginate_by)
+                page_of_ids = paginator.get_page(page)
+            context["paginator"] = paginator
+            context["works"] = self.get_page_of_works(page_of_ids)
+        elif get_pagination_mode(self.request) == "keyset":
+            paginator = KeysetPaginator(
+                works, self.paginate_by, self.get_keyset_ordering(works)
+            )
+            try:
+                context["works"] = paginator.get_page(self.request.GET.get("cursor"))
+            except InvalidPage as e:
+                raise Http404(str(e))
+            context["paginator"] = paginator
+        else:
+            context["paginator"] = Paginator(works, self.paginate_by)
+            context["works"] = context["paginator"].get_page(page)
+        context["works"].object_list = self.prefetch_page(context["works"].object_list)
+        keyword = self.request.GET.get("q")
+        if keyword and getattr(settings, "SEARCH_HEADLINES", False):
+            self.add_headlines(context["works"].object_list, keyword)
+        context["results_truncated"] = truncated
+        context["rank_candidates"] = self.get_rank_candidates()
         context["is_paginated"] = True
-        context["works"] = context["paginator"].get_page(page)
         context["facet_form"] = facet_form
         context["feature_form"] = feature_form
-        context["file_ids"] = file_ids
-        context["file_ids_json"] = file_ids_json
+        # Only used to highlight the files of the page, so a set for fast lookups
+        context["file_ids"] = set(file_ids)
+        context["file_ids_token"] = file_ids_token
+        if file_ids_token is None:
+            context["file_ids_json"] = json.dumps(file_ids)
         context["content_search_on"] = content_search_on
 
         return context
 
-    def get(self, request: HttpRequest) -> HttpResponse:
-        codes = self.codes
-        feature_types = self.feature_types
-        facet_name_list = self.facet_name_list
+    def search(
+        self, request: HttpRequest, facets: List[Facet], content_search_on: bool
+    ) -> Tuple[QuerySet, QuerySet, bool]:
+        """Find the Musical Works and the Files that match the parameters of a request
 
+        Returns
+        -------
+        Tuple[QuerySet, QuerySet, bool]
+            The ordered QuerySet of matching Musical Works, the QuerySet of their
+            matching Files and whether only some of the keyword matches were ranked,
+            the others following them unranked
+        """
         q = request.GET.get("q")
         sorting = request.GET.get("sorting")
-        page = request.GET.get("page")
         min_date = (
             int(request.GET.get("min_date")) if request.GET.get(
                 "min_date") else None
@@ -197,38 +423,113 @@ class SearchView(TemplateView):
             int(request.GET.get("max_date")) if request.GET.get(
                 "max_date") else None
         )
-        if not page:
-            page = 1
-        facets = self.read_request_facets(request, facet_name_list)
-        content_search_on = self.is_content_search_on(request, codes)
         works = self.facet_filter(self.keyword_search(q), facets)
 
         if min_date or max_date:
             works = self.date_filter(works, min_date, max_date)
+        truncated = False
         if sorting:
             works = works.order_by(sorting)
+        elif q and self.get_rank_candidates():
+            works, truncated = self.rank_candidates(
+                works, q, self.get_rank_candidates()
+            )
 
-        sections = Section.objects.filter(musical_work__in=works)
         files = File.objects.filter(
-            Q(instantiates__work__in=works) | Q(
-                instantiates__sections__in=sections)
+            id__in=WorkFileClosure.objects.filter(work__in=works).values("file_id")
         )
 
         if content_search_on:
-            files = self.content_search(request, codes, files)
+            files = self.content_search(request, self.codes, files)
             works = self.filter_works_with_no_files(works, files)
 
-        work_ids = works.values_list("id", flat=True)
+        return works, files, truncated
+
+    def compute_aggregates(
+        self, facets: List[Facet], work_ids: Iterable[int], file_ids: List[int]
+    ) -> Dict[int, Tuple[float, float]]:
+        """Set the values of the facets and get the bounds of the feature sliders
+
+        With FACET_BACKEND set to "parallel", the query of every facet and the query
+        of the bounds run concurrently.
+        """
+        tasks = {}
+        if file_ids:
+            tasks["feature_bounds"] = partial(
+                FeatureSearchForm.make_bounds, self.feature_types, file_ids
+            )
+        results = compute_facets(facets, work_ids, tasks)
+        return results.get("feature_bounds", {})
+
+    def make_search_result(
+        self, works: QuerySet, files: QuerySet, facets: List[Facet], truncated: bool
+    ) -> SearchResult:
+        """Evaluate a search and all its aggregates so that it can be cached"""
+        # Removes duplicates but preserves the order of the works
+        work_ids = list(dict.fromkeys(works.values_list("id", flat=True)))
         file_ids = list(files.values_list("id", flat=True))
-        file_ids_json = json.dumps(file_ids, cls=DjangoJSONEncoder)
+        bounds = self.compute_aggregates(facets, work_ids, file_ids)
+        facet_values = {facet.name: facet.facet_values for facet in facets}
+        return SearchResult(work_ids, file_ids, facet_values, bounds, truncated)
 
-        facet_form = FacetSearchForm(
-            data=request.GET, work_ids=work_ids, facets=facets)
-        feature_form = FeatureSearchForm(
-            feature_types=feature_types, file_ids=file_ids, data=request.GET
-        )
+    def get(self, request: HttpRequest) -> HttpResponse:
+        feature_types = self.feature_types
+        facet_name_list = self.facet_name_list
+
+        page = request.GET.get("page")
+        if not page:
+            page = 1
+        facets = self.read_request_facets(request, facet_name_list)
+        content_search_on = self.is_content_search_on(request, self.codes)
+
+        if search_cache.is_enabled():
+            key = search_cache.make_key(request.GET)
+            result = search_cache.get_result(key)
+            if result is None:
+                works, files, truncated = self.search(
+                    request, facets, content_search_on
+                )
+                result = self.make_search_result(works, files, facets, truncated)
+                search_cache.set_result(key, result)
+            for facet in facets:
+                facet.facet_values = result.facet_values[facet.name]
+            works = result.work_ids
+            file_ids = result.file_ids
+            truncated = result.truncated
+            facet_form = FacetSearchForm(data=request.GET, work_ids=None, facets=facets)
+            feature_form = FeatureSearchForm(
+                feature_types=feature_types,
+                file_ids=file_ids,
+                bounds=result.bounds,
+                data=request.GET,
+            )
+        else:
+            works, files, truncated = self.search(request, facets, content_search_on)
+            # Evaluated once, rather than by every query of the aggregates
+            work_ids = list(works.values_list("id", flat=True))
+            file_ids = list(files.values_list("id", flat=True))
+            bounds = self.compute_aggregates(facets, work_ids, file_ids)
+            facet_form = FacetSearchForm(data=request.GET, work_ids=None, facets=facets)
+            feature_form = FeatureSearchForm(
+                feature_types=feature_types,
+                file_ids=file_ids,
+                bounds=bounds,
+                data=request.GET,
+            )
+        # The page only references the matched files if every process can resolve
+        # the reference, see add_to_cart
+        file_ids_token = None
+        if result_sets.is_shared():
+            file_ids_token = result_sets.store_file_ids(file_ids)
 
         context = self.get_context_data(
-            works, file_ids, file_ids_json, facet_form, feature_form, content_search_on, page
+            works,
+            file_ids,
+            file_ids_token,
+            facet_form,
+            feature_form,
+            content_search_on,
+            page,
+            truncated,
         )
         return self.render_to_response(context)
@@ -0,0 +1,30 @@
+import hashlib
+from django.core.cache import caches
+from django.http import HttpRequest, JsonResponse
+from django.views.decorators.http import require_safe
+from database.models import SearchSuggestion
+from database.models.search_suggestion import normalize_term
+
+MIN_PREFIX_LENGTH = 2
+MAX_SUGGESTIONS = 10
+# Suggestions for a prefix are cached briefly, the same short prefixes are typed by
+# everyone
+CACHE_TIMEOUT = 60
+
+
+@require_safe
+def suggest(request: HttpRequest) -> JsonResponse:
+    prefix = normalize_term(request.GET.get("q", ""))
+    if len(prefix) < MIN_PREFIX_LENGTH:
+        return JsonResponse({"suggestions": []})
+
+    cache = caches["search"]
+    key = "suggest:" + hashlib.sha256(prefix.encode()).hexdigest()
+    suggestions = cache.get(key)
+    if suggestions is None:
+        suggestions = [
+            {"label": suggestion.label, "kind": suggestion.kind, "url": suggestion.url}
+            for suggestion in SearchSuggestion.suggest(prefix, MAX_SUGGESTIONS)
+        ]
+        cache.set(key, suggestions, CACHE_TIMEOUT)
+    return JsonResponse({"suggestions": suggestions})
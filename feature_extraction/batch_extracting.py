@@ -0,0 +1,228 @@
+"""Extracting the features of many files with a single run of jSymbolic
+
+Starting the JVM and loading jSymbolic takes longer than extracting the features of
+a short MIDI file. Instead of running jSymbolic once per file, the files are spooled
+into a pending directory, and the whole directory is extracted by one run of
+jSymbolic once it holds enough files or its first file has waited long enough. The
+combined ACE XML, CSV and ARFF outputs are then split back into the same per-file
+outputs a single run would have written.
+
+The spool directory holds:
+
+* incoming/ - items being written, moved to pending/ once complete
+* pending/ - the items of the next batch, one directory per file with the file and
+  a manifest.json giving its pk and the paths of its outputs, and a scheduled marker
+  created exclusively by the first item to enter it, which schedules the batch
+* batch_<id>/ - a batch being extracted, pending/ is renamed to it atomically so
+  that files spooled meanwhile go to the next batch
+"""
+import json
+import os
+import shutil
+import uuid
+import xml.etree.cElementTree as et
+from feature_extraction import jvm_pool
+
+INCOMING = 'incoming'
+PENDING = 'pending'
+MANIFEST = 'manifest.json'
+SCHEDULED = 'scheduled'
+INPUT = 'input'
+MIDI_EXTENSIONS = ['.mid', '.midi']
+PARSABLE_FORMATS = ['.abc', '.krn', '.ly', '.mei', '.xml']
+
+
+def enqueue(spool_dir, file_pk, path, output_paths):
+    """
+    Add a file to the pending batch
+    :param spool_dir: The spool directory
+    :param file_pk: The pk of the File
+    :param path: The path of the symbolic music file
+    :param output_paths: The paths where the XML, CSV and ARFF feature values of the file are written
+    :return: The number of files in the pending batch, and whether the file is the first one to enter it
+    """
+    item_dir = os.path.join(spool_dir, INCOMING, uuid.uuid4().hex)
+    os.makedirs(item_dir)
+    shutil.copyfile(path, os.path.join(item_dir, os.path.basename(path)))
+    with open(os.path.join(item_dir, MANIFEST), 'w') as manifest:
+        json.dump({'file_pk': file_pk, 'name': os.path.basename(path), 'outputs': output_paths}, manifest)
+    pending_dir = os.path.join(spool_dir, PENDING)
+    while True:
+        os.makedirs(pending_dir, exist_ok=True)
+        try:
+            os.rename(item_dir, os.path.join(pending_dir, os.path.basename(item_dir)))
+            break
+        except FileNotFoundError:
+            # The pending batch was taken between makedirs and rename
+            continue
+    # Only one file can create the marker of a pending batch, even if the batch was taken
+    # meanwhile and this one is the next
+    try:
+        os.close(os.open(os.path.join(pending_dir, SCHEDULED), os.O_CREAT | os.O_EXCL))
+        first = True
+    except (FileExistsError, FileNotFoundError):
+        first = False
+    try:
+        pending = len([item for item in os.listdir(pending_dir) if item != SCHEDULED])
+    except FileNotFoundError:
+        pending = 0
+    return pending, first
+
+
+def take_batch(spool_dir):
+    """
+    Take the pending batch for extraction
+    :param spool_dir: The spool directory
+    :return: The directory of the batch, or None if no file is pending
+    """
+    batch_dir = os.path.join(spool_dir, 'batch_' + uuid.uuid4().hex)
+    try:
+        os.rename(os.path.join(spool_dir, PENDING), batch_dir)
+    except FileNotFoundError:
+        return None
+    return batch_dir
+
+
+def batch_items(batch_dir):
+    """
+    List the items of a batch taken by take_batch()
+    :return: A list of the directory and the manifest of each item
+    """
+    items = []
+    for item in sorted(os.listdir(batch_dir)):
+        item_dir = os.path.join(batch_dir, item)
+        if item == INPUT or not os.path.isfile(os.path.join(item_dir, MANIFEST)):
+            continue
+        with open(os.path.join(item_dir, MANIFEST)) as manifest_file:
+            items.append((item_dir, json.load(manifest_file)))
+    return items
+
+
+def stage(item_dir, manifest, input_dir):
+    """
+    Put the file of an item in the input directory of its batch, converted to MIDI
+    :return: The name of the staged file, or None if it cannot be converted
+    """
+    path = os.path.join(item_dir, manifest['name'])
+    name = '{0}__{1}'.format(manifest['file_pk'], manifest['name'])
+    extension = os.path.splitext(name)[1].lower()
+    if extension in MIDI_EXTENSIONS:
+        os.rename(path, os.path.join(input_dir, name))
+        return name
+    if extension in PARSABLE_FORMATS:
+        from music21 import converter
+        try:
+            converter.parse(path).write('midi', fp=os.path.join(input_dir, name + '.midi'))
+        except Exception:
+            return None
+        return name + '.midi'
+    return None
+
+
+def split_values(values_path, names):
+    """
+    Split the combined ACE XML feature values of a batch
+    :param values_path: The path of the combined feature values
+    :param names: The names of the staged files
+    :return: A dictionary mapping the name of each staged file to an ElementTree of its feature values
+    """
+    root = et.ElementTree(file=values_path).getroot()
+    header = [child for child in root if child.tag != 'data_set']
+    trees = {}
+    for data_set in root.iter('data_set'):
+        # jSymbolic identifies each data set by the path of its file
+        name = os.path.basename(data_set.find('data_set_id').text.strip())
+        if name in names:
+            file_root = et.Element(root.tag, root.attrib)
+            file_root.extend(header)
+            file_root.append(data_set)
+            trees[name] = et.ElementTree(file_root)
+    return trees
+
+
+def split_csv(csv_path, names):
+    """
+    Split the combined CSV feature values of a batch, whose rows start with the path of their file
+    :return: A dictionary mapping the name of each staged file to its CSV
+    """
+    with open(csv_path) as csv_file:
+        lines = csv_file.read().splitlines()
+    if not lines:
+        return {}
+    header, rows = lines[0], lines[1:]
+    csvs = {}
+    for row in rows:
+        name = os.path.basename(row.split(',', 1)[0].strip('"'))
+        if name in names:
+            csvs[name] = header + '\n' + row + '\n'
+    return csvs
+
+
+def split_arff(arff_path, ordered_names):
+    """
+    Split the combined ARFF feature values of a batch, whose instances are in the order of the data sets
+    of the ACE XML
+    :return: A dictionary mapping the name of each staged file to its ARFF
+    """
+    with open(arff_path) as arff_file:
+        lines = arff_file.read().splitlines()
+    header, rows = [], []
+    for line in lines:
+        if rows or (header and header[-1].strip().upper() == '@DATA'):
+            if line.strip():
+                rows.append(line)
+        else:
+            header.append(line)
+    if len(rows) != len(ordered_names):
+        return {}
+    return {name: '\n'.join(header + [row]) + '\n' for name, row in zip(ordered_names, rows)}
+
+
+def extract_batch(jar_file, config_file, batch_dir, log_dir=None):
+    """
+    Extract the features of every file of a batch with one run of jSymbolic
+    :param jar_file: Path where you store the .jar file
+    :param config_file: Path where you store the config file
+    :param batch_dir: The directory of a batch taken by take_batch()
+    :param log_dir: The directory of the logs of jSymbolic, the batch directory if not specified
+    :return: A dictionary mapping the pk of every File whose features were extracted to its output paths
+    """
+    input_dir = os.path.join(batch_dir, INPUT)
+    os.makedirs(input_dir, exist_ok=True)
+    manifests = {}
+    for item_dir, manifest in batch_items(batch_dir):
+        name = stage(item_dir, manifest, input_dir)
+        if name is not None:
+            manifests[name] = manifest
+    if not manifests:
+        return {}
+
+    values_path = os.path.join(batch_dir, 'batch_feature_values.xml')
+    log_dir = log_dir or batch_dir
+    with open(os.path.join(log_dir, 'extract_features_log.txt'), 'a') as f_stdout, \
+            open(os.path.join(log_dir, 'extract_features_error_log.txt'), 'a') as f_stderr:
+        jvm_pool.run_jsymbolic(jar_file, ['-configrun', config_file, input_dir, values_path,
+                                          os.path.join(batch_dir, 'batch_feature_descriptions.xml')],
+                               f_stdout, f_stderr)
+    if not os.path.exists(values_path):
+        return {}
+
+    trees = split_values(values_path, manifests)
+    ordered_names = list(trees)
+    base_path = os.path.splitext(values_path)[0]
+    csvs = split_csv(base_path + '.csv', manifests) if os.path.exists(base_path + '.csv') else {}
+    arffs = split_arff(base_path + '.arff', ordered_names) if os.path.exists(base_path + '.arff') else {}
+
+    extracted = {}
+    for name, tree in trees.items():
+        outputs = manifests[name]['outputs']
+        os.makedirs(os.path.dirname(outputs[0]), exist_ok=True)
+        tree.write(outputs[0], encoding='UTF-8', xml_declaration=True)
+        written = [outputs[0]]
+        for output, contents in zip(outputs[1:], (csvs.get(name), arffs.get(name))):
+            if contents is not None:
+                with open(output, 'w') as output_file:
+                    output_file.write(contents)
+                written.append(output)
+        extracted[manifests[name]['file_pk']] = written
+    return extracted
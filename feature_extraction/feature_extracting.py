@@ -6,7 +6,14 @@ import subprocess
 import argparse
 import datetime
 import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from celery import shared_task
+try:
+    from feature_extraction import jvm_pool
+except ImportError:  # Run as a script from this folder
+    import jvm_pool
 
 
 def conversion(jar_file, config_file, path, feature_path, flog, ftotal,
@@ -33,7 +40,7 @@ def conversion(jar_file, config_file, path, feature_path, flog, ftotal,
     print('Breakdown for the file:', filename_w_ext, file=ftotal)
     conversion_file_path = os.path.join(os.path.dirname(path), 'conversion')
     # This is the path to store the converted files
-    if os.path.exists(conversion_file_path) is False: os.mkdir(conversion_file_path)
+    os.makedirs(conversion_file_path, exist_ok=True)  # Also created by the other processes of a folder
     file_name, extension = os.path.splitext(filename_w_ext)
     if extension.lower() == '.mid' or extension.lower() == '.midi':
         num_of_midi_file += 1
@@ -79,27 +86,77 @@ def extract_features(ftotal, jar_file, config_file, path, feature_path, file_nam
     extracted = False
     f_stdout = open(os.path.join(feature_path, 'extract_features_log.txt'), 'a')
     f_stderr = open(os.path.join(feature_path, 'extract_features_error_log.txt'), 'a')
-    out = subprocess.Popen(['java', '-Xmx2g', '-jar', jar_file, '-configrun', config_file, path,
-                            os.path.join(feature_path, file_name + '_feature_values.xml'),
-                            os.path.join(feature_path, file_name + '_feature_descriptions.xml')],
-                           stdout=subprocess.PIPE,
-                           stderr=subprocess.PIPE)
-    stdout, stderr = out.communicate()
-    if stderr is None or len(stderr) == 0:
+    # Runs on a warm JVM of the pool if one is set up, in a new JVM otherwise
+    if jvm_pool.run_jsymbolic(jar_file, ['-configrun', config_file, path,
+                                         os.path.join(feature_path, file_name + '_feature_values.xml'),
+                                         os.path.join(feature_path, file_name + '_feature_descriptions.xml')],
+                              f_stdout, f_stderr):
         extracted = True
         num_of_files_feature_succeed += 1
         print('It manages to extract features', file=ftotal)
     else:
         print('It fails to extract features', file=ftotal)
-        print(stderr.decode("utf-8"), file=f_stderr)
         print('Feature extraction failed, please take a look at the log file!')
-    if stdout is not None:
-        print(stdout.decode("utf-8"), file=f_stdout)
     f_stdout.close()
     f_stderr.close()
     return num_of_files_feature_succeed, extracted
 
 
+def init_worker(jar_file, pool_size):
+    """
+    Set up a process of the pool of extract_features_setup, with its own warm jSymbolic JVM if pool_size is not 0
+    :param jar_file: Path where you store the .jar file
+    :param pool_size: The pool_size of extract_features_setup
+    :return:
+    """
+    jvm_pool.forget()  # The JVMs inherited from the parent are fed by the parent only
+    jvm_pool.ensure_pool(jar_file, min(pool_size, 1))
+
+
+def conversion_worker(jar_file, config_file, path, feature_path, log_dir):
+    """
+    Function that runs conversion on one file in a process of the pool of extract_features_setup. The logs go to
+    files of this process in log_dir, to be merged into the logs of the folder once every file is done
+    :param jar_file:
+    :param config_file:
+    :param path:
+    :param feature_path:
+    :param log_dir: a folder for the logs of the processes
+    :return: the counters of conversion for this file only, and whether its features are extracted
+    """
+    with open(os.path.join(log_dir, 'conversion_error_log_' + str(os.getpid()) + '.txt'), 'a') as flog, \
+            open(os.path.join(log_dir, 'standard_output_log_' + str(os.getpid()) + '.txt'), 'a') as ftotal:
+        return conversion(jar_file, config_file, path, feature_path, flog, ftotal, 0, 0, 0, 0, 0)
+
+
+def parallel_conversion(jar_file, config_file, paths, feature_path, flog, ftotal, workers, pool_size):
+    """
+    Function that runs conversion on many files with a pool of processes, and merges their logs into flog and ftotal
+    :param paths: the paths of the files
+    :param workers: the number of processes
+    :param pool_size: the pool_size of extract_features_setup
+    :return: the counters of conversion summed over every file, and whether the features of the last file are
+    extracted
+    """
+    totals = [0, 0, 0, 0, 0]
+    extracted = False
+    log_dir = tempfile.mkdtemp(prefix='extract_features_logs_')
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(jar_file, pool_size)) as executor:
+            results = executor.map(conversion_worker, [jar_file] * len(paths), [config_file] * len(paths), paths,
+                                   [feature_path] * len(paths), [log_dir] * len(paths))
+            for result in results:
+                totals = [total + count for total, count in zip(totals, result[:5])]
+                extracted = result[5]
+        for fn in sorted(os.listdir(log_dir)):  # Each file has the logs of one process, file by file
+            with open(os.path.join(log_dir, fn)) as worker_log:
+                print(worker_log.read(), end='', file=flog if fn.startswith('conversion_error_log') else ftotal)
+    finally:
+        shutil.rmtree(log_dir, ignore_errors=True)
+    return tuple(totals) + (extracted,)
+
+
 def standard_output(ftotal, num_of_total_files, num_of_non_processed_files, num_of_midi_file, num_of_midi_file_feature,
                     num_of_converted_files, num_of_converted_files_feature):
     """
@@ -133,7 +190,7 @@ def standard_output(ftotal, num_of_total_files, num_of_non_processed_files, num_
           'manage to convert into MIDI,', num_of_converted_files_feature, 'manage to extract features.', file=ftotal)
     ftotal.close()
 
-def extract_features_setup(jar_file, config_file, path, feature_path=''):
+def extract_features_setup(jar_file, config_file, path, feature_path='', pool_size=0, workers=1):
     """
     Function to extract features either for all the files in the folder or one file whose path is specified
     :param path: Either a folder or a file path
@@ -141,8 +198,13 @@ def extract_features_setup(jar_file, config_file, path, feature_path=''):
     'path'
     :param jar_file: Path where you store the .jar file
     :param config_file: Path where you store the config file
+    :param pool_size: The number of warm jSymbolic JVMs to keep for this and later extractions, see jvm_pool.py. If 0,
+    the pool already set up is used, or a new JVM is started per file if there is none
+    :param workers: The number of processes converting and extracting the files of a folder at the same time. With
+    more than 1, each process keeps its own warm JVM if pool_size is not 0
     :return:
     """
+    jvm_pool.ensure_pool(jar_file, pool_size)
     num_of_total_files = 0  # The number of files with the specified folder
     num_of_non_processed_files = 0  # The number of symbolic files that can be processed
     num_of_midi_file = 0  # The number of files whose original format is midi
@@ -159,13 +221,23 @@ def extract_features_setup(jar_file, config_file, path, feature_path=''):
             feature_path = os.path.join(path,
                                         'extracted_features')  # When doing on a folder, this function will create a separate folder
         if os.path.exists(feature_path) is False: os.mkdir(feature_path)
+        paths = []
+        extracted = False
         for id, fn in enumerate(os.listdir(path)):
             if fn.find('.DS_Store') == -1 \
                     and fn.find('extracted_features') == -1 and fn.find('conversion') == -1 \
                     and fn.find('log') == -1:  # Only convert the files that are already there
                 num_of_total_files += 1  # The total number of files within the folder
+                paths.append(os.path.join(path, fn))
+        if workers > 1 and len(paths) > 1:
+            (num_of_non_processed_files, num_of_midi_file, num_of_midi_file_feature, num_of_converted_files, \
+             num_of_converted_files_feature, extracted) = parallel_conversion(jar_file, config_file, paths,
+                                                                              feature_path, flog, ftotal, workers,
+                                                                              pool_size)
+        else:
+            for file_path in paths:
                 (num_of_non_processed_files, num_of_midi_file, num_of_midi_file_feature, num_of_converted_files, \
-                 num_of_converted_files_feature, extracted) = conversion(jar_file, config_file, os.path.join(path, fn),
+                 num_of_converted_files_feature, extracted) = conversion(jar_file, config_file, file_path,
                                                                          feature_path, flog, ftotal,
                                                                          num_of_non_processed_files, num_of_midi_file,
                                                                          num_of_midi_file_feature,
@@ -214,6 +286,15 @@ if __name__ == "__main__":
                              'files within',
                         type=str,
                         default=os.path.join(os.path.dirname(os.getcwd()), 'media', 'symbolic_music'))
+    parser.add_argument('-n', '--pool_size',
+                        help='The number of warm jSymbolic JVMs that extract the features of the files, or 0 to start '
+                             'a JVM per file',
+                        type=int, default=0)
+    parser.add_argument('-w', '--workers',
+                        help='The number of processes converting and extracting the files of a folder at the same '
+                             'time',
+                        type=int, default=1)
     args = parser.parse_args()
-    extracted = extract_features_setup(args.jsymbolic_file, args.jsymbolic_config_file, args.path)
+    extracted = extract_features_setup(args.jsymbolic_file, args.jsymbolic_config_file, args.path,
+                                       pool_size=args.pool_size, workers=args.workers)
     print(extracted)
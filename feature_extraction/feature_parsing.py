@@ -1,7 +1,12 @@
 import xml.etree.cElementTree as et
+from django.db import transaction
 from database.models.extracted_feature import ExtractedFeature
 from database.models.feature_type import FeatureType
+from database.models.file_feature_vector import FileFeatureVector
 from database.models.software import Software
+from database.utils import search_cache
+
+BULK_CREATE_BATCH_SIZE = 1000
 
 
 def parse_feature_types(feature_type_file_path, software):
@@ -22,6 +27,32 @@ def parse_feature_types(feature_type_file_path, software):
 
 
 def parse_feature_values(feature_values_file_path, symbolic_music_file, software):
+    """Save the feature values of a file in bulk
+
+    The FeatureTypes are read once and the dimensions of the values are checked
+    here instead of by ExtractedFeature.save(). The ExtractedFeatures are then
+    inserted together in one transaction, after which the max and min values of
+    their FeatureTypes are updated at once.
+
+    Parameters
+    ----------
+    feature_values_file_path : str
+        The path of the ACE XML feature values written by jSymbolic
+    symbolic_music_file : File
+        The File the features were extracted from
+    software : Software
+        The Software the features were extracted with
+
+    Returns
+    -------
+    bool
+        Whether the feature values could be parsed
+
+    Raises
+    ------
+    FeatureType.DoesNotExist
+        If a feature of the file has no FeatureType
+    """
     try:
         tree = et.ElementTree(file=feature_values_file_path)
     except:
@@ -30,21 +61,29 @@ def parse_feature_values(feature_values_file_path, symbolic_music_file, software
     else:
         root = tree.getroot()
         data_set = root.find('data_set')
+        feature_types = {feature_type.name: feature_type for feature_type in FeatureType.objects.all()}
+        ext_features = []
         for feature in data_set.iter('feature'):
             feature_name = feature.find('name').text
 
-            feature_def = FeatureType.objects.get(name__exact=feature_name)
+            feature_def = feature_types.get(feature_name)
 
             if feature_def is None:
-                raise Exception
+                raise FeatureType.DoesNotExist(feature_name)
 
-            ext_feature = ExtractedFeature(instance_of_feature=feature_def,
-                                           extracted_with=software,
-                                           feature_of=symbolic_music_file
-                                           )
             feature_values = []
             for v in feature.findall('v'):
-                feature_values.append(v.text)
-            ext_feature.value = feature_values
-            ext_feature.save()
+                feature_values.append(float(v.text))
+            ExtractedFeature.check_dimensions(feature_values, feature_def)
+            ext_features.append(ExtractedFeature(instance_of_feature=feature_def,
+                                                 extracted_with=software,
+                                                 feature_of=symbolic_music_file,
+                                                 value=feature_values
+                                                 ))
+        with transaction.atomic():
+            ExtractedFeature.objects.bulk_create(ext_features, batch_size=BULK_CREATE_BATCH_SIZE)
+            FeatureType.extend_max_and_min(ext_features)
+            FileFeatureVector.rebuild([symbolic_music_file.pk])
+        # bulk_create does not send the post_save signals that invalidate the search results
+        search_cache.bump_version()
         return True
@@ -0,0 +1,87 @@
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+
+/**
+ * Runs jSymbolic for every request read from stdin, in a JVM kept warm between them.
+ *
+ * Each request is one line holding the command line arguments of jSymbolic separated by
+ * tabs. Each response is one line holding the exit status of jSymbolic, then what it
+ * printed to stdout and to stderr, escaped and separated by tabs.
+ *
+ * Started and fed by feature_extraction/jvm_pool.py, with
+ * java -cp jSymbolic2.jar JSymbolicWorker.java (Java 11 or later).
+ */
+public class JSymbolicWorker {
+
+    /** Thrown instead of exiting the JVM when jSymbolic calls System.exit. */
+    static class ExitException extends SecurityException {
+        final int status;
+
+        ExitException(int status) {
+            this.status = status;
+        }
+    }
+
+    public static void main(String[] args) throws IOException {
+        PrintStream responses =
+                new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        BufferedReader requests =
+                new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        trapExit();
+        String request;
+        while ((request = requests.readLine()) != null) {
+            ByteArrayOutputStream out = new ByteArrayOutputStream();
+            ByteArrayOutputStream err = new ByteArrayOutputStream();
+            System.setOut(new PrintStream(out, true, "UTF-8"));
+            System.setErr(new PrintStream(err, true, "UTF-8"));
+            int status = 0;
+            try {
+                jsymbolic2.Main.main(request.split("\t", -1));
+            } catch (ExitException e) {
+                status = e.status;
+            } catch (Throwable t) {
+                status = 1;
+                t.printStackTrace(System.err);
+            }
+            System.out.flush();
+            System.err.flush();
+            responses.println(status + "\t" + escape(out.toString("UTF-8")) + "\t"
+                    + escape(err.toString("UTF-8")));
+        }
+    }
+
+    /**
+     * Turns the calls to System.exit into ExitExceptions. Java 18 and later refuse to
+     * install a SecurityManager unless started with -Djava.security.manager=allow, which
+     * the pool passes to the JVMs that accept it. Otherwise a call to System.exit ends
+     * the worker, the pool takes its exit status as that of jSymbolic and starts another.
+     */
+    private static void trapExit() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(Permission permission) {
+                }
+
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitException(status);
+                }
+            });
+        } catch (UnsupportedOperationException e) {
+            // Not supported by this JVM
+        }
+    }
+
+    private static String escape(String text) {
+        return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\r", "\\r")
+                .replace("\n", "\\n");
+    }
+}
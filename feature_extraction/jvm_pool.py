@@ -0,0 +1,271 @@
+"""A pool of warm jSymbolic JVMs
+
+Running jSymbolic from the command line starts a JVM and loads jSymbolic for every
+extraction, which takes longer than extracting the features of a short file. The
+pool keeps up to a number of JVMs running jsymbolic_worker/JSymbolicWorker.java,
+which runs jSymbolic for every request it reads on its stdin and answers on its
+stdout, so that bursts of files are extracted by JVMs that are already hot.
+
+A worker is replaced after a number of jobs or when its resident memory grows past
+a limit, since jSymbolic is not written to run for long. A worker that dies or does
+not answer in time is killed and replaced too.
+
+The pool of the process is set up with configure() or ensure_pool(). Once it is,
+extract_features() and extract_batch() send their extractions to it instead of
+starting jSymbolic, so a Celery worker keeps its JVMs from one task to the next.
+"""
+import functools
+import os
+import queue
+import re
+import selectors
+import subprocess
+import threading
+
+WORKER_SOURCE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'jsymbolic_worker',
+                             'JSymbolicWorker.java')
+
+
+def unescape(text):
+    """Reverse the escaping of JSymbolicWorker.escape()"""
+    replacements = {'\\': '\\', 't': '\t', 'r': '\r', 'n': '\n'}
+    result = []
+    characters = iter(text)
+    for character in characters:
+        if character == '\\':
+            following = next(characters, '')
+            result.append(replacements.get(following, following))
+        else:
+            result.append(character)
+    return ''.join(result)
+
+
+@functools.lru_cache()
+def java_version():
+    """The major version of the java command, or 0 if it cannot be run"""
+    try:
+        output = subprocess.run(['java', '-version'], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT).stdout.decode('utf-8', 'replace')
+    except OSError:
+        return 0
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', output)
+    if match is None:
+        return 0
+    major = int(match.group(1))
+    # Up to Java 8 the versions are 1.x
+    return int(match.group(2) or 0) if major == 1 else major
+
+
+class WorkerError(Exception):
+    """Raised when a worker dies or does not answer in time"""
+
+
+class WorkerExited(WorkerError):
+    """Raised when jSymbolic ended the worker with System.exit before it could answer"""
+
+    def __init__(self, status):
+        super(WorkerExited, self).__init__('jSymbolic worker exited with status {0}'.format(status))
+        self.status = status
+
+
+class JSymbolicWorker(object):
+    """A JVM running JSymbolicWorker.java"""
+
+    def __init__(self, jar_file, memory='2g'):
+        options = ['-Xmx' + memory]
+        if java_version() >= 12:
+            # Lets the worker trap System.exit on Java 18 and later, see JSymbolicWorker.trapExit()
+            options.append('-Djava.security.manager=allow')
+        # The Class-Path of the jar is relative to it, so the worker runs next to it
+        self.process = subprocess.Popen(['java'] + options + ['-cp', jar_file, WORKER_SOURCE],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, cwd=os.path.dirname(jar_file))
+        self.jobs = 0
+
+    def run(self, args, timeout):
+        """
+        Run jSymbolic with some command line arguments
+        :param args: The command line arguments of jSymbolic
+        :param timeout: The number of seconds to wait for the answer
+        :return: The exit status, stdout and stderr of jSymbolic
+        """
+        try:
+            self.process.stdin.write(('\t'.join(args) + '\n').encode('utf-8'))
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as error:
+            raise WorkerError(str(error))
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.process.stdout, selectors.EVENT_READ)
+            if not selector.select(timeout):
+                raise WorkerError('jSymbolic did not answer in {0} seconds'.format(timeout))
+        line = self.process.stdout.readline().decode('utf-8')
+        if not line.endswith('\n'):
+            # System.exit could not be trapped, so the exit status of the JVM is that of jSymbolic
+            try:
+                status = self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                raise WorkerError('jSymbolic worker closed its output')
+            raise WorkerExited(status)
+        self.jobs += 1
+        status, stdout, stderr = line.rstrip('\n').split('\t')
+        return int(status), unescape(stdout), unescape(stderr)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def memory_mb(self):
+        """The resident memory of the worker in MB, or None if it cannot be read"""
+        try:
+            with open('/proc/{0}/status'.format(self.process.pid)) as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024
+        except (OSError, ValueError, IndexError):
+            return None
+        return None
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class JSymbolicPool(object):
+    """Up to a number of warm jSymbolic workers, started on demand"""
+
+    def __init__(self, jar_file, size, max_jobs=200, max_memory_mb=3072, timeout=600):
+        """
+        :param jar_file: Path where you store the .jar file
+        :param size: The maximum number of workers
+        :param max_jobs: The number of extractions after which a worker is replaced
+        :param max_memory_mb: The resident memory in MB past which a worker is replaced
+        :param timeout: The number of seconds after which an extraction is abandoned
+        """
+        self.jar_file = jar_file
+        self.max_jobs = max_jobs
+        self.max_memory_mb = max_memory_mb
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.workers = set()
+        self.lock = threading.Lock()
+
+    def _acquire(self):
+        self.slots.acquire()
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            # Idle workers can die too, for instance when they are killed for their memory
+            if worker.is_alive():
+                return worker
+            self._discard(worker)
+        try:
+            worker = JSymbolicWorker(self.jar_file)
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.workers.add(worker)
+        return worker
+
+    def _release(self, worker, broken=False):
+        memory_mb = None if broken else worker.memory_mb()
+        if broken or not worker.is_alive() or worker.jobs >= self.max_jobs or \
+                (memory_mb is not None and memory_mb > self.max_memory_mb):
+            self._discard(worker)
+        else:
+            self.idle.put(worker)
+        self.slots.release()
+
+    def _discard(self, worker):
+        with self.lock:
+            self.workers.discard(worker)
+        worker.stop()
+
+    def run(self, args):
+        """
+        Run jSymbolic on a warm worker
+        :param args: The command line arguments of jSymbolic
+        :return: The exit status, stdout and stderr of jSymbolic
+        """
+        worker = self._acquire()
+        broken = False
+        try:
+            return worker.run(args, self.timeout)
+        except WorkerExited as error:
+            # The output of jSymbolic was lost with the worker
+            broken = True
+            return error.status, '', (str(error) if error.status else '')
+        except WorkerError as error:
+            # Discarded right away, since a killed process can still look alive for a moment
+            broken = True
+            worker.process.kill()
+            return 1, '', str(error)
+        finally:
+            self._release(worker, broken)
+
+    def close(self):
+        with self.lock:
+            workers = list(self.workers)
+            self.workers.clear()
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+
+
+def configure(jar_file, size, max_jobs=200, max_memory_mb=3072, timeout=600):
+    """Set up the pool of this process, or turn it off if size is 0"""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+    _pool = JSymbolicPool(jar_file, size, max_jobs, max_memory_mb, timeout) if size > 0 else None
+
+
+def forget():
+    """Drop the pool inherited by a forked process, without stopping the JVMs of the parent"""
+    global _pool
+    _pool = None
+
+
+def ensure_pool(jar_file, size, max_jobs=200, max_memory_mb=3072, timeout=600):
+    """Set up the pool of this process unless it is already set up for the jar file"""
+    if size > 0 and get_pool(jar_file) is None:
+        configure(jar_file, size, max_jobs, max_memory_mb, timeout)
+    return get_pool(jar_file)
+
+
+def get_pool(jar_file=None):
+    """Get the pool of this process, if it is set up for a jar file"""
+    if _pool is not None and (jar_file is None or os.path.realpath(jar_file) == os.path.realpath(_pool.jar_file)):
+        return _pool
+    return None
+
+
+def run_jsymbolic(jar_file, args, stdout_file, stderr_file):
+    """
+    Run jSymbolic on a warm worker of the pool, or in a new JVM if there is no pool
+    :param jar_file: Path where you store the .jar file
+    :param args: The command line arguments of jSymbolic
+    :param stdout_file: A file where the output of jSymbolic is appended
+    :param stderr_file: A file where the errors of jSymbolic are appended
+    :return: Whether jSymbolic printed no error
+    """
+    pool = get_pool(jar_file)
+    if pool is not None:
+        status, stdout, stderr = pool.run(args)
+    else:
+        out = subprocess.Popen(['java', '-Xmx2g', '-jar', jar_file] + args, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+        stdout, stderr = (output.decode('utf-8') for output in out.communicate())
+    if stdout:
+        print(stdout, file=stdout_file)
+    if stderr:
+        print(stderr, file=stderr_file)
+    return not stderr